@@ -4,46 +4,49 @@ This script connects to an AML device over a serial port, sends a
 command and logs any data returned by the device.  All configuration is
 provided via a command line interface so the script can be reused in a
 variety of environments without editing the source.
+
+Run from the repository root::
+
+    python -m AML.serial_comm --port /dev/ttyUSB0
 """
 
 from __future__ import annotations
 
 import argparse
-import time
-from typing import Iterable
+from contextlib import ExitStack
+from typing import Iterable, Optional
 
 import serial
 
-
-def log_data(log_file: str, data: bytes) -> None:
-    """Append *data* to *log_file* with a timestamp."""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_file, "a", encoding="utf-8") as fh:
-        fh.write(f"{timestamp} - {data.decode('utf-8')}")
+from serial_logging.capture import CaptureWriter
+from serial_logging.nmea import FIX_COLUMNS, NmeaStream
+from serial_logging.reader import SerialReader, format_line
+from serial_logging.sink import LogSink, add_sink_arguments, exit_on_sigterm
 
 
-def read_serial(port: str, baud: int, log_file: str, command: str) -> None:
-    """Open *port* at *baud* and log replies to *log_file*.
+def read_serial(port: str, baud: int, log: LogSink, command: str, gps: Optional[NmeaStream] = None) -> None:
+    """Open *port* at *baud* and log replies to *log*.
 
     A single *command* is sent immediately after opening the port.  The
-    script then continuously reads from the serial connection until the
-    user presses :kbd:`Ctrl+C`.
+    script then logs every line the device sends until the user presses
+    :kbd:`Ctrl+C`, sleeping in between rather than polling the port.
+    Lines are also fed to *gps*, if given, to decode the GPS fixes.
     """
 
     print(f"Opening serial port {port} at {baud} baud…")
-    with serial.Serial(port, baud, timeout=1) as ser:
+    with SerialReader(port, baud) as reader:
         print("Serial port opened successfully.")
         print(f"Sending {command!r} to the device…")
-        ser.write(f"{command}\r".encode())
+        reader.send(command)
         print("Waiting for device to respond…")
-        time.sleep(1)
 
         try:
-            while True:
-                if ser.in_waiting > 0:
-                    data = ser.readline()
-                    log_data(log_file, data)
-                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {data.decode('utf-8')}", end="")
+            for timestamp, data in reader:
+                line = format_line(data, timestamp)
+                log.write(line)
+                if gps is not None:
+                    gps.feed(line.encode())
+                print(line, end="")
         except KeyboardInterrupt:
             print("Exiting…")
 
@@ -73,13 +76,24 @@ def parse_args(args: Iterable[str] | None = None) -> argparse.Namespace:
         default="MONITOR",
         help="Command to send to the device on start-up",
     )
+    parser.add_argument(
+        "--fixes",
+        help="Also append the decoded GPS fixes to this capture file",
+    )
+    add_sink_arguments(parser)
     return parser.parse_args(args)
 
 
 def main(argv: Iterable[str] | None = None) -> None:
     args = parse_args(argv)
+    exit_on_sigterm()
     try:
-        read_serial(args.port, args.baud, args.log, args.command)
+        with LogSink.from_args(args.log, args) as log, ExitStack() as stack:
+            gps = None
+            if args.fixes:
+                gps = NmeaStream(stack.enter_context(CaptureWriter(args.fixes, FIX_COLUMNS)))
+                stack.callback(gps.flush)
+            read_serial(args.port, args.baud, log, args.command, gps)
     except serial.SerialException as exc:
         print(f"Serial error: {exc}")
 
@@ -3,16 +3,24 @@
 This script reads lines from a serial device and appends them to a log file
 with a timestamp. Serial parameters and the log file location can be
 configured through command-line arguments.
+
+Run from the repository root::
+
+    python -m Transmissometer.serial_comm --port /dev/ttyUSB0
 """
 
 from __future__ import annotations
 
 import argparse
+from contextlib import ExitStack
 from pathlib import Path
-import time
 
 import serial
 
+from serial_logging.capture import CaptureWriter, parse_tx_line
+from serial_logging.reader import SerialReader, format_line
+from serial_logging.sink import LogSink, add_sink_arguments, exit_on_sigterm
+
 
 DEFAULT_PORT = "/dev/tty.usbserial-FT9EJUFK1"
 DEFAULT_BAUDRATE = 19200
@@ -45,6 +53,13 @@ def parse_args() -> argparse.Namespace:
         default=DEFAULT_LOG,
         help=f"File to append logged data to (default: {DEFAULT_LOG})",
     )
+    parser.add_argument(
+        "-c",
+        "--capture",
+        type=Path,
+        help="Also append parsed readings to this columnar capture file",
+    )
+    add_sink_arguments(parser)
     return parser.parse_args()
 
 
@@ -52,7 +67,7 @@ def main() -> None:
     """Run the serial logger."""
 
     args = parse_args()
-    timestamp_fmt = "%Y-%m-%d %H:%M:%S"
+    exit_on_sigterm()
 
     print(
         f"Opening serial port {args.port} at {args.baudrate} baud. "
@@ -60,17 +75,18 @@ def main() -> None:
     )
 
     try:
-        with serial.Serial(args.port, args.baudrate, timeout=1) as ser, open(
-            args.log_file, "a", encoding="utf-8"
-        ) as log_file:
-            while True:
-                if ser.in_waiting:
-                    data = ser.readline()
-                    timestamp = time.strftime(timestamp_fmt)
-                    text = data.decode("utf-8", errors="replace")
-                    line = f"{timestamp} - {text}"
-                    log_file.write(line)
-                    print(line, end="")
+        with SerialReader(args.port, args.baudrate) as reader, LogSink.from_args(
+            args.log_file, args
+        ) as log_file, ExitStack() as stack:
+            capture = stack.enter_context(CaptureWriter(args.capture)) if args.capture else None
+            for timestamp, data in reader:
+                line = format_line(data, timestamp)
+                log_file.write(line)
+                print(line, end="")
+                if capture is not None:
+                    reading = parse_tx_line(data, timestamp)
+                    if reading is not None:
+                        capture.append(*reading)
     except serial.SerialException as exc:
         print(f"Serial error: {exc}")
     except KeyboardInterrupt:
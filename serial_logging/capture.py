@@ -0,0 +1,519 @@
+"""Chunked columnar capture files for transmissometer readings.
+
+``TX.txt`` stores each C-Star reading as text that every analysis has to
+parse again.  A capture file keeps the same readings as typed columns in
+self-describing chunks::
+
+    b"DCOLv001"                                   file magic
+    b"CHNK" <u32 header length> <JSON header>     per chunk
+    <column payloads, zlib-compressed, in header order>
+
+The header holds the row count, the instrument id, a CRC of the payload
+and, for every column, its dtype, compressed size and min/max.  Readers
+use the min/max to skip chunks outside a time range without reading
+them.  Each chunk is written with a single append.  A chunk cut short by
+a crash is ignored by readers, and the next writer truncates it.
+
+Times are local wall-clock times, as in the text logs, stored as
+``datetime64[ms]``.  The text parser works on whole arrays, so months of
+logs convert in seconds::
+
+    python -m serial_logging.capture convert Transmissometer/TX.txt TX.cap
+    python -m serial_logging.capture info TX.cap
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+MAGIC = b"DCOLv001"
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sI")
+CHUNK_ROWS = 3600
+
+# Columns in the order the C-Star sends them after its instrument id.
+TX_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("time", "<M8[ms]"),
+    ("reference", "<u4"),
+    ("signal", "<u4"),
+    ("corrected", "<u4"),
+    ("transmittance", "<f4"),
+    ("thermistor", "<u2"),
+)
+TX_FIELDS = len(TX_COLUMNS) - 1
+STAMP_BYTES = 19  # "2025-06-19 12:08:32"
+PREFIX_BYTES = STAMP_BYTES + 3  # followed by " - "
+FIELD_BYTES = 12
+BLOCK_BYTES = 8 * 1024 * 1024
+
+Row = Tuple[Any, ...]
+
+
+# ----------------------------------------------------------------------
+# Chunk encoding
+def _bound(values: np.ndarray) -> Tuple[Any, Any]:
+    if values.dtype.kind == "M":
+        values = values[~np.isnat(values)]
+        if not len(values):
+            return None, None
+        return int(values.min().astype("<i8")), int(values.max().astype("<i8"))
+    if values.dtype.kind == "f":
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return None, None
+        # The shortest text that reads back as the same value.
+        return float(str(values.min())), float(str(values.max()))
+    low, high = values.min(), values.max()
+    return low.item(), high.item()
+
+
+def encode_chunk(columns: Dict[str, np.ndarray], instrument: str, level: int = 6) -> bytes:
+    """Return one chunk holding ``columns`` (all the same length)."""
+    rows = len(next(iter(columns.values())))
+    described = []
+    payloads = []
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values)
+        data = zlib.compress(values.tobytes(), level)
+        low, high = _bound(values) if rows else (None, None)
+        described.append({"name": name, "dtype": values.dtype.str, "size": len(data), "min": low, "max": high})
+        payloads.append(data)
+    payload = b"".join(payloads)
+    header = json.dumps(
+        {"rows": rows, "instrument": instrument, "crc": zlib.crc32(payload), "columns": described},
+        separators=(",", ":"),
+    ).encode()
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, len(header)) + header + payload
+
+
+def _scan(fh) -> Iterator[Tuple[int, Dict[str, Any], int]]:
+    """Yield ``(offset, header, payload offset)`` of every complete chunk."""
+    end = os.fstat(fh.fileno()).st_size
+    if fh.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{fh.name} is not a capture file")
+    offset = len(MAGIC)
+    while offset + CHUNK_HEADER.size <= end:
+        fh.seek(offset)
+        magic, length = CHUNK_HEADER.unpack(fh.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + length > end:
+            return
+        try:
+            header = json.loads(fh.read(length))
+        except ValueError:
+            return
+        start = offset + CHUNK_HEADER.size + length
+        size = sum(column["size"] for column in header["columns"])
+        if start + size > end:
+            return
+        yield offset, header, start
+        offset = start + size
+
+
+def _decode(fh, header: Dict[str, Any], start: int, names: Optional[Sequence[str]]) -> Dict[str, np.ndarray]:
+    fh.seek(start)
+    payload = fh.read(sum(column["size"] for column in header["columns"]))
+    if zlib.crc32(payload) != header["crc"]:
+        raise ValueError(f"Corrupt chunk in {fh.name} at byte {start}")
+    columns = {}
+    offset = 0
+    for column in header["columns"]:
+        if names is None or column["name"] in names:
+            data = zlib.decompress(payload[offset:offset + column["size"]])
+            columns[column["name"]] = np.frombuffer(data, dtype=column["dtype"])
+        offset += column["size"]
+    return columns
+
+
+def chunk_headers(path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """Return the headers of the complete chunks in ``path``."""
+    with open(path, "rb") as fh:
+        return [header for _, header, _ in _scan(fh)]
+
+
+def _overlaps(header: Dict[str, Any], start: Optional[np.datetime64], end: Optional[np.datetime64]) -> bool:
+    if not header["rows"]:
+        return False
+    time = next((column for column in header["columns"] if column["name"] == "time"), None)
+    if time is None or time["min"] is None:
+        return True
+    low = np.datetime64(time["min"], "ms")
+    high = np.datetime64(time["max"], "ms")
+    return (start is None or high >= start) and (end is None or low < end)
+
+
+def read_capture(
+    path: Union[str, Path],
+    start: Union[str, datetime.datetime, np.datetime64, None] = None,
+    end: Union[str, datetime.datetime, np.datetime64, None] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> Dict[str, np.ndarray]:
+    """Return the readings in ``path`` as one array per column.
+
+    ``start``/``end`` (local time, end exclusive) limit the rows; chunks
+    entirely outside the range are not decompressed.  ``columns`` limits
+    which columns are decoded; ask for ``"instrument"`` to also get each
+    row's instrument id.
+    """
+    start = None if start is None else np.datetime64(start, "ms")
+    end = None if end is None else np.datetime64(end, "ms")
+    wanted = None if columns is None else set(columns) | {"time"}
+    parts: Dict[str, List[np.ndarray]] = {}
+    with open(path, "rb") as fh:
+        for _, header, offset in _scan(fh):
+            if not _overlaps(header, start, end):
+                continue
+            chunk = _decode(fh, header, offset, None if wanted is None else sorted(wanted))
+            if "time" in chunk and (start is not None or end is not None):
+                times = chunk["time"]
+                keep = np.ones(len(times), dtype=bool)
+                if start is not None:
+                    keep &= times >= start
+                if end is not None:
+                    keep &= times < end
+                chunk = {name: values[keep] for name, values in chunk.items()}
+            if wanted is not None and "instrument" in wanted:
+                rows = len(next(iter(chunk.values()))) if chunk else header["rows"]
+                chunk["instrument"] = np.full(rows, header["instrument"])
+            for name, values in chunk.items():
+                parts.setdefault(name, []).append(values)
+    result = {name: np.concatenate(values) for name, values in parts.items()}
+    if columns is not None:
+        result = {name: result[name] for name in columns if name in result}
+    return result
+
+
+class CaptureWriter:
+    """Append rows to a capture file, one chunk per ``chunk_rows`` rows.
+
+    Opening an existing file truncates a chunk a crash left incomplete.
+    Rows still buffered are written as a (short) chunk by :meth:`flush`
+    and :meth:`close`.  With ``sync`` every chunk is ``fsync``-ed as it is
+    written, otherwise only on close.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        columns: Sequence[Tuple[str, str]] = TX_COLUMNS,
+        chunk_rows: int = CHUNK_ROWS,
+        sync: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.columns = tuple(columns)
+        self.chunk_rows = chunk_rows
+        self.sync = sync
+        self._rows: List[Row] = []
+        self._pieces: List[Dict[str, np.ndarray]] = []
+        self._pending = 0
+        self._instrument: Optional[str] = None
+        self._fh = open(self.path, "a+b")
+        self._fh.seek(0)
+        if os.fstat(self._fh.fileno()).st_size == 0:
+            self._fh.write(MAGIC)
+            self._fh.flush()
+        else:
+            end = len(MAGIC)
+            for offset, header, start in _scan(self._fh):
+                end = start + sum(column["size"] for column in header["columns"])
+            self._fh.truncate(end)
+
+    def append(self, instrument: str, row: Row) -> None:
+        """Buffer one reading (values in column order)."""
+        self._switch(instrument)
+        self._rows.append(row)
+        self._pending += 1
+        if self._pending >= self.chunk_rows:
+            self._drain(complete=True)
+
+    def write_columns(self, instrument: str, columns: Dict[str, np.ndarray]) -> None:
+        """Buffer already columnar data, writing every complete chunk."""
+        self._switch(instrument)
+        self._collect_rows()
+        piece = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in self.columns}
+        self._pieces.append(piece)
+        self._pending += len(piece[self.columns[0][0]])
+        if self._pending >= self.chunk_rows:
+            self._drain(complete=True)
+
+    def flush(self) -> None:
+        """Write everything buffered, ending with a short chunk if needed."""
+        self._drain(complete=False)
+
+    def _switch(self, instrument: str) -> None:
+        if instrument != self._instrument:
+            self.flush()
+            self._instrument = instrument
+
+    def _collect_rows(self) -> None:
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self._pieces.append({
+                name: np.array([row[index] for row in rows], dtype=dtype)
+                for index, (name, dtype) in enumerate(self.columns)
+            })
+
+    def _drain(self, complete: bool) -> None:
+        self._collect_rows()
+        if not self._pieces:
+            return
+        names = [name for name, _ in self.columns]
+        merged = {name: np.concatenate([piece[name] for piece in self._pieces]) for name in names}
+        rows = len(merged[names[0]])
+        cut = rows - rows % self.chunk_rows if complete else rows
+        for first in range(0, cut, self.chunk_rows):
+            chunk = {name: values[first:first + self.chunk_rows] for name, values in merged.items()}
+            self._write(encode_chunk(chunk, self._instrument))
+        self._pieces = [{name: values[cut:] for name, values in merged.items()}] if cut < rows else []
+        self._pending = rows - cut
+
+    def _write(self, data: bytes) -> None:
+        self._fh.write(data)
+        self._fh.flush()
+        if self.sync:
+            os.fsync(self._fh.fileno())
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        self.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+
+    def __enter__(self) -> "CaptureWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ----------------------------------------------------------------------
+# Transmissometer text
+def parse_tx_line(data: bytes, timestamp: float) -> Optional[Tuple[str, Row]]:
+    """Return ``(instrument, row)`` for one C-Star line, or ``None``."""
+    fields = data.strip().split(b"\t")
+    if len(fields) != TX_FIELDS + 1:
+        return None
+    try:
+        values = [int(fields[1]), int(fields[2]), int(fields[3]), float(fields[4]), int(fields[5])]
+    except ValueError:
+        return None
+    when = np.datetime64(datetime.datetime.fromtimestamp(timestamp), "ms")
+    return fields[0].decode("ascii", errors="replace"), (when, *values)
+
+
+def parse_decimals(buf: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse the unsigned decimals ``buf[lo:hi]`` of every row at once.
+
+    Fields are right-aligned in a window as wide as the widest one and the
+    digits are weighted by their place with one matrix product.  A decimal
+    point scales the digits to its left down by ten and the result by the
+    number of decimals.  Returns the values and a mask of the rows that
+    held a valid number.
+    """
+    width = hi - lo
+    size = min(int(width.max()), FIELD_BYTES) if len(width) else 0
+    positions = hi[:, None] + np.arange(-size, 0)
+    inside = positions >= lo[:, None]
+    # Digits become 0-9; anything else wraps around to a larger value.
+    digits = np.where(inside, buf[np.maximum(positions, 0)] - np.uint8(48), np.uint8(0))
+    place = 10.0 ** np.arange(size - 1, -1, -1)
+    valid = (width > 0) & (width <= FIELD_BYTES)
+    dot = digits == np.uint8(46 - 48 + 256)
+    dotted = dot.any()
+    if dotted:
+        digits[dot] = 0
+    bad = digits > 9
+    # Per-row checks only when the block as a whole has something to find.
+    if bad.any():
+        valid &= ~bad.any(axis=1)
+    digits = digits.astype(np.float64)
+    if not dotted:
+        return digits @ place, valid
+    valid &= dot.sum(axis=1) <= 1
+    has_point = dot.any(axis=1)
+    point = dot.argmax(axis=1)
+    left = (np.arange(size) < point[:, None]) & has_point[:, None]
+    whole = digits @ place
+    shifted = np.where(left, digits, 0.0) @ place
+    return (whole - 0.9 * shifted) / 10.0 ** np.where(has_point, size - 1 - point, 0), valid
+
+
+def parse_stamps(buf: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse the logger timestamps at ``buf[starts]`` as one array.
+
+    Returns the times and a mask of the rows whose timestamp was valid.
+    """
+    stamps = buf[starts[:, None] + np.arange(STAMP_BYTES)].copy().view(f"S{STAMP_BYTES}").ravel()
+    ok = np.ones(len(starts), dtype=bool)
+    try:
+        return stamps.astype("M8[ms]"), ok
+    except ValueError:
+        pass
+    # A damaged timestamp somewhere; fall back to checking each one.
+    times = np.full(len(starts), np.datetime64("NaT"), dtype="M8[ms]")
+    for index, stamp in enumerate(stamps):
+        try:
+            times[index] = np.datetime64(stamp.decode("ascii", errors="replace").replace(" ", "T"), "ms")
+        except ValueError:
+            ok[index] = False
+    return times, ok
+
+
+def parse_tx_log(data: bytes) -> Tuple[List[Tuple[str, Dict[str, np.ndarray]]], int]:
+    """Parse a ``TX.txt`` log into column arrays, without a per-line loop.
+
+    Returns ``([(instrument, columns), ...], rejected)`` with one entry per
+    run of lines from the same instrument, and the number of non-empty
+    lines that were not valid readings.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf):
+        return [], 0
+    newlines = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buf)]))
+    ends = ends - (ends > starts) * (buf[np.maximum(ends - 1, 0)] == 13)
+    nonempty = ends > starts
+    starts, ends = starts[nonempty], ends[nonempty]
+    lines = len(starts)
+
+    tabs = np.flatnonzero(buf == 9)
+    owner = np.searchsorted(starts, tabs, side="right") - 1
+    inside = (owner >= 0) & (tabs < ends[np.maximum(owner, 0)])
+    counts = np.bincount(owner[inside], minlength=lines)
+    separator = np.minimum(starts + STAMP_BYTES, len(buf) - 1)
+    valid = (
+        (counts == TX_FIELDS)
+        & (ends - starts > PREFIX_BYTES)
+        & (buf[separator] == 32)
+        & (buf[np.minimum(separator + 1, len(buf) - 1)] == 45)
+    )
+    tab_rows = valid[owner] & inside
+    bounds = tabs[tab_rows].reshape(-1, TX_FIELDS)
+    starts, ends = starts[valid], ends[valid]
+
+    times, ok = parse_stamps(buf, starts)
+
+    field_hi = np.column_stack((bounds[:, 1:], ends))
+    values = []
+    for field in range(TX_FIELDS):
+        numbers, good = parse_decimals(buf, bounds[:, field] + 1, field_hi[:, field])
+        values.append(numbers)
+        ok &= good
+
+    id_width = int((bounds[:, 0] - starts - PREFIX_BYTES).max()) if len(starts) else 0
+    id_positions = (starts + PREFIX_BYTES)[:, None] + np.arange(max(id_width, 1))
+    id_chars = np.where(id_positions < bounds[:, :1], buf[np.minimum(id_positions, len(buf) - 1)], 0)
+    ids = id_chars.astype(np.uint8).view(f"S{max(id_width, 1)}").ravel()
+
+    rejected = lines - int(ok.sum())
+    times, ids = times[ok], ids[ok]
+    values = [numbers[ok] for numbers in values]
+    runs = []
+    if len(ids):
+        cuts = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        for first, last in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [len(ids)]))):
+            columns = {"time": times[first:last]}
+            for (name, dtype), numbers in zip(TX_COLUMNS[1:], values):
+                columns[name] = numbers[first:last].astype(dtype)
+            runs.append((ids[first].decode("ascii", errors="replace"), columns))
+    return runs, rejected
+
+
+def read_blocks(path: Union[str, Path], size: int = BLOCK_BYTES) -> Iterator[bytes]:
+    """Yield ``path`` in blocks of about ``size`` bytes that end on a line.
+
+    Rotated logs compressed by :class:`~.sink.LogSink` (``.gz``) are read
+    transparently.
+    """
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rb") as fh:
+        rest = b""
+        while True:
+            data = fh.read(size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            if not cut:
+                rest = data
+                continue
+            rest = data[cut:]
+            yield data[:cut]
+        if rest:
+            yield rest
+
+
+def convert(source: Union[str, Path], target: Union[str, Path], chunk_rows: int = CHUNK_ROWS) -> Tuple[int, int]:
+    """Append the readings in text log ``source`` to capture ``target``.
+
+    The log is parsed a block at a time, so memory use does not grow with
+    its size.  Returns ``(rows, rejected lines)``.
+    """
+    rows = rejected = 0
+    with CaptureWriter(target, chunk_rows=chunk_rows, sync=False) as writer:
+        for block in read_blocks(source):
+            runs, skipped = parse_tx_log(block)
+            rejected += skipped
+            for instrument, columns in runs:
+                writer.write_columns(instrument, columns)
+                rows += len(columns["time"])
+    return rows, rejected
+
+
+# ----------------------------------------------------------------------
+# CLI
+def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert and inspect capture files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    conv = sub.add_parser("convert", help="Append the readings of a TX.txt log to a capture file")
+    conv.add_argument("source", type=Path, help="Text log written by the transmissometer logger")
+    conv.add_argument("target", type=Path, nargs="?", help="Capture file (default: source with .cap)")
+    conv.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows per chunk")
+    info = sub.add_parser("info", help="Summarise a capture file")
+    info.add_argument("path", type=Path)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.command == "convert":
+        target = args.target or args.source.with_suffix(".cap")
+        rows, rejected = convert(args.source, target, args.chunk_rows)
+        print(
+            f"{rows} readings from {args.source} ({args.source.stat().st_size} bytes) "
+            f"appended to {target} ({target.stat().st_size} bytes); {rejected} lines skipped"
+        )
+        return
+    headers = [header for header in chunk_headers(args.path) if header["rows"]]
+    print(f"{args.path}: {len(headers)} chunks, {sum(h['rows'] for h in headers)} readings, {args.path.stat().st_size} bytes")
+    instruments: Dict[str, List[Dict[str, Any]]] = {}
+    for header in headers:
+        instruments.setdefault(header["instrument"], []).append(header)
+    for instrument, chunks in instruments.items():
+        print(f"{instrument}: {sum(h['rows'] for h in chunks)} readings")
+        for index, column in enumerate(chunks[0]["columns"]):
+            name = column["name"]
+            lows = [h["columns"][index]["min"] for h in chunks if h["columns"][index]["min"] is not None]
+            highs = [h["columns"][index]["max"] for h in chunks if h["columns"][index]["max"] is not None]
+            if not lows:
+                print(f"  {name}: -")
+                continue
+            low, high = min(lows), max(highs)
+            if column["dtype"].startswith("<M8"):
+                low, high = np.datetime64(low, "ms"), np.datetime64(high, "ms")
+            print(f"  {name}: {low} .. {high}")
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
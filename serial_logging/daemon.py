@@ -0,0 +1,408 @@
+"""Log every serial instrument from one asyncio process.
+
+Each instrument in the JSON configuration file gets its own port, line
+framing, start-up commands and :class:`~.sink.LogSink`, but all of them
+share one event loop: ports are watched with ``add_reader`` and only
+touched when the kernel has bytes for them.  Each instrument writes its
+files from a worker thread of its own, so file I/O never holds up the
+loop.  The configuration is
+re-read whenever it changes, starting, restarting or stopping only the
+instruments whose entry changed.  With ``--follow-schedule``, an
+instrument that names a scheduler ``sensor`` is only logged while the
+scheduler has that sensor on (or logging)::
+
+    python -m serial_logging.daemon serial_logging/instruments.json --follow-schedule
+
+The configuration looks like::
+
+    {
+        "sink": {"rotate": "daily", "backups": 365},
+        "instruments": {
+            "AML": {"port": "/dev/ttyUSB0", "baudrate": 38400, "log": "logs/AML.txt",
+                    "commands": ["MONITOR"], "sensor": "AML"}
+        }
+    }
+
+``log`` paths are relative to the configuration file.  ``delimiter``
+(default ``"\\n"``), ``terminator`` for commands (default ``"\\r"``) and
+``max_line`` set the framing; ``sink`` holds :class:`~.sink.LogSink`
+options, globally or per instrument.  For the transmissometer,
+``capture`` names a :mod:`~.capture` file that also receives every
+reading as typed columns.  For the AML, ``fixes`` names a capture file
+for the GPS fixes decoded by :mod:`~.nmea`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .capture import CaptureWriter, parse_tx_line
+from .nmea import FIX_COLUMNS, NmeaStream
+from .reader import MAX_LINE_BYTES, LineFramer, format_line
+from .sink import LogSink
+
+logger = logging.getLogger(__name__)
+
+POWERED_STATES = ("on", "logging")
+READ_BYTES = 65536
+# Keyword arguments of LogSink that a "sink" section may set.
+SINK_OPTIONS = ("buffer_bytes", "flush_interval", "fsync_interval", "max_bytes", "rotate", "compress", "backups")
+
+
+@dataclass(frozen=True)
+class InstrumentConfig:
+    """One instrument entry of the configuration file."""
+
+    name: str
+    port: str
+    baudrate: int
+    log: Path
+    delimiter: bytes = b"\n"
+    commands: Tuple[str, ...] = ()
+    terminator: str = "\r"
+    max_line: int = MAX_LINE_BYTES
+    sensor: Optional[str] = None
+    capture: Optional[Path] = None
+    fixes: Optional[Path] = None
+    sink: Tuple[Tuple[str, Any], ...] = ()
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict[str, Any], base: Path, sink: Dict[str, Any]) -> "InstrumentConfig":
+        if not isinstance(data, dict):
+            raise ValueError(f"Instrument {name} must be an object")
+        _check_sink(data.get("sink", {}), f"Instrument {name}")
+        try:
+            return cls(
+                name=name,
+                port=data["port"],
+                baudrate=int(data["baudrate"]),
+                log=base / data.get("log", f"{name}.txt"),
+                delimiter=data.get("delimiter", "\n").encode(),
+                commands=tuple(data.get("commands", ())),
+                terminator=data.get("terminator", "\r"),
+                max_line=int(data.get("max_line", MAX_LINE_BYTES)),
+                sensor=data.get("sensor"),
+                capture=base / data["capture"] if data.get("capture") else None,
+                fixes=base / data["fixes"] if data.get("fixes") else None,
+                sink=tuple(sorted({**sink, **data.get("sink", {})}.items())),
+            )
+        except KeyError as exc:
+            raise ValueError(f"Instrument {name} is missing {exc.args[0]!r}") from None
+        except (AttributeError, TypeError) as exc:
+            raise ValueError(f"Instrument {name} has an invalid value: {exc}") from None
+
+
+def _check_sink(sink: Any, where: str) -> None:
+    if not isinstance(sink, dict):
+        raise ValueError(f"{where}: sink must be an object")
+    unknown = sorted(set(sink) - set(SINK_OPTIONS))
+    if unknown:
+        raise ValueError(f"{where}: unknown sink option(s) {', '.join(unknown)}")
+
+
+def load_config(path: Path) -> Dict[str, InstrumentConfig]:
+    """Return the instruments configured in ``path`` by name.
+
+    A malformed file or entry raises ``ValueError``.
+    """
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    instruments = data.get("instruments", {}) if isinstance(data, dict) else None
+    if not isinstance(instruments, dict):
+        raise ValueError(f"{path}: expected an object with an \"instruments\" object")
+    base = path.resolve().parent
+    sink = data.get("sink", {})
+    _check_sink(sink, str(path))
+    return {
+        name: InstrumentConfig.from_dict(name, entry, base, sink)
+        for name, entry in instruments.items()
+    }
+
+
+class InstrumentLogger:
+    """Log one instrument until cancelled, reopening its port when lost.
+
+    A port that cannot be opened (the sensor has only just been powered
+    and its USB adapter is still enumerating) or that fails later is
+    retried with exponential backoff up to ``retry`` seconds.
+
+    The event loop only reads and frames lines.  Writing them to the log,
+    the capture file and the GPS decoder happens in order on a worker
+    thread of the instrument's own, so a slow SD card stalls no port.
+    """
+
+    def __init__(self, config: InstrumentConfig, retry: float = 30.0) -> None:
+        self.config = config
+        self.retry = retry
+        self.lines = 0
+        self.sink: Optional[LogSink] = None
+        self.capture: Optional[CaptureWriter] = None
+        self.gps: Optional[NmeaStream] = None
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix=f"log-{config.name}")
+
+    async def run(self) -> None:
+        config = self.config
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self._open_outputs)
+            delay = 1.0
+            while True:
+                try:
+                    ser = await asyncio.to_thread(self._open)
+                except Exception as exc:
+                    logger.warning("%s: cannot open %s: %s", config.name, config.port, exc)
+                else:
+                    delay = 1.0
+                    try:
+                        await self._read(ser)
+                    except OSError as exc:
+                        logger.warning("%s: lost %s: %s", config.name, config.port, exc)
+                    finally:
+                        ser.close()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry)
+        finally:
+            # Runs after every line already handed to the writer.
+            await asyncio.shield(loop.run_in_executor(self._writer, self._close_outputs))
+            self._writer.shutdown(wait=False)
+
+    def _open_outputs(self) -> None:
+        config = self.config
+        self.sink = LogSink(config.log, **dict(config.sink))
+        if config.capture:
+            self.capture = CaptureWriter(config.capture)
+        if config.fixes:
+            self.gps = NmeaStream(CaptureWriter(config.fixes, FIX_COLUMNS))
+
+    def _close_outputs(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.gps is not None:
+            self.gps.flush()
+            self.gps.writer.close()
+
+    def _store(self, lines: List[bytes], timestamp: Optional[float]) -> None:
+        """Write framed ``lines`` to the outputs (on the writer thread)."""
+        for line in lines:
+            text = format_line(line, timestamp)
+            self.sink.write(text)
+            if self.gps is not None:
+                self.gps.feed(text.encode())
+            if self.capture is not None and timestamp is not None:
+                reading = parse_tx_line(line, timestamp)
+                if reading is not None:
+                    self.capture.append(*reading)
+
+    def _submit(self, lines: List[bytes], timestamp: Optional[float]) -> None:
+        future = self._writer.submit(self._store, lines, timestamp)
+        future.add_done_callback(self._stored)
+
+    def _stored(self, future: Future) -> None:
+        exc = future.exception()
+        if exc is not None:
+            logger.error("%s: cannot write %s: %s", self.config.name, self.config.log, exc)
+
+    def _open(self):
+        import serial
+
+        config = self.config
+        # timeout=0 keeps pyserial from blocking; reads happen on readiness.
+        ser = serial.Serial(config.port, config.baudrate, timeout=0)
+        for command in config.commands:
+            ser.write(f"{command}{config.terminator}".encode())
+        logger.info("%s: logging %s to %s", config.name, config.port, config.log)
+        return ser
+
+    async def _read(self, ser) -> None:
+        loop = asyncio.get_running_loop()
+        framer = LineFramer(self.config.delimiter, self.config.max_line)
+        lost: asyncio.Future = loop.create_future()
+        fd = ser.fileno()
+
+        def readable() -> None:
+            try:
+                data = os.read(fd, READ_BYTES)
+            except BlockingIOError:
+                return
+            except OSError as exc:
+                if not lost.done():
+                    lost.set_exception(exc)
+                return
+            if not data:
+                if not lost.done():
+                    lost.set_exception(OSError("device disconnected"))
+                return
+            lines = framer.feed(data)
+            if lines:
+                self.lines += len(lines)
+                self._submit(lines, time.time())
+
+        loop.add_reader(fd, readable)
+        try:
+            await lost
+        finally:
+            loop.remove_reader(fd)
+            rest = framer.flush()
+            if rest is not None:
+                self._submit([rest], None)
+
+
+class LoggingDaemon:
+    """Keep one :class:`InstrumentLogger` task per wanted instrument.
+
+    ``powered`` returns the scheduler state of a sensor; without it every
+    configured instrument is logged.
+    """
+
+    def __init__(
+        self,
+        config_path: Path,
+        powered: Optional[Callable[[str], bool]] = None,
+        refresh: Optional[Callable[[], Any]] = None,
+        poll: float = 1.0,
+    ) -> None:
+        self.config_path = Path(config_path)
+        self.powered = powered
+        self.refresh = refresh
+        self.poll = poll
+        self.instruments: Dict[str, InstrumentConfig] = {}
+        self.tasks: Dict[str, Tuple[InstrumentConfig, asyncio.Task]] = {}
+        self._mtime: Optional[int] = None
+
+    def _reload(self) -> None:
+        try:
+            mtime = self.config_path.stat().st_mtime_ns
+        except OSError as exc:
+            if self._mtime is None:
+                raise
+            logger.error("Cannot stat %s: %s", self.config_path, exc)
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            instruments = load_config(self.config_path)
+        except (OSError, ValueError) as exc:
+            if self._mtime is None:
+                raise
+            logger.error("Keeping the previous configuration: %s", exc)
+        else:
+            self.instruments = instruments
+            logger.info("Loaded %d instrument(s) from %s", len(instruments), self.config_path)
+        self._mtime = mtime
+
+    def wanted(self) -> Dict[str, InstrumentConfig]:
+        if self.powered is None:
+            return dict(self.instruments)
+        wanted = {}
+        for name, config in self.instruments.items():
+            try:
+                if config.sensor is None or self.powered(config.sensor):
+                    wanted[name] = config
+            except KeyError:
+                logger.error("%s: unknown sensor %s", name, config.sensor)
+        return wanted
+
+    async def _stop(self, names: List[str]) -> None:
+        tasks = []
+        for name in names:
+            _, task = self.tasks.pop(name)
+            task.cancel()
+            tasks.append(task)
+        for name, result in zip(names, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logger.error("%s: logger failed: %s", name, result)
+            else:
+                logger.info("%s: stopped", name)
+
+    async def sync(self) -> None:
+        """Start, restart and stop loggers to match the configuration."""
+        self._reload()
+        if self.refresh is not None:
+            await asyncio.to_thread(self.refresh)
+        wanted = self.wanted()
+        await self._stop([
+            name for name, (config, task) in self.tasks.items()
+            if wanted.get(name) != config or task.done()
+        ])
+        for name, config in wanted.items():
+            if name not in self.tasks:
+                task = asyncio.create_task(InstrumentLogger(config).run(), name=f"log-{name}")
+                self.tasks[name] = (config, task)
+
+    async def serve(self) -> None:
+        """Run until cancelled, then close every port and log."""
+        try:
+            while True:
+                await self.sync()
+                await asyncio.sleep(self.poll)
+        finally:
+            await self._stop(list(self.tasks))
+
+
+# ----------------------------------------------------------------------
+# CLI
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Log several serial instruments from one process")
+    parser.add_argument("config", type=Path, help="JSON instrument configuration")
+    parser.add_argument(
+        "--follow-schedule",
+        action="store_true",
+        help="Only log instruments whose sensor the scheduler has powered",
+    )
+    parser.add_argument("--storage", help="Schedule storage file (default: shared sensor_schedule.json)")
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=1.0,
+        help="Seconds between checks of the configuration and the schedule",
+    )
+    return parser.parse_args(argv)
+
+
+def schedule_hooks(storage: Optional[str]) -> Tuple[Callable[[str], bool], Callable[[], Any]]:
+    """Return the ``powered`` and ``refresh`` hooks following the scheduler's store."""
+    from webapps.shared.services.backend import ExecutionBackend
+    from webapps.shared.services.schedule_manager import ScheduleManager
+
+    manager = ScheduleManager(storage, backend=ExecutionBackend())
+
+    def powered(sensor: str) -> bool:
+        return manager.state_at(sensor)[0] in POWERED_STATES
+
+    return powered, manager.refresh
+
+
+async def run(args: argparse.Namespace) -> None:
+    powered = refresh = None
+    if args.follow_schedule:
+        powered, refresh = schedule_hooks(args.storage)
+
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        await LoggingDaemon(args.config, powered, refresh, args.poll).serve()
+    except asyncio.CancelledError:
+        print("Exiting...")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
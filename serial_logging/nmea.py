@@ -0,0 +1,361 @@
+"""Decode the NMEA GPS sentences in the AML log into a table of fixes.
+
+The AML interleaves ``$GPGGA``, ``$GPRMC``, ``$GPVTG`` and friends with
+its own readings.  :func:`decode` finds every sentence in a block of log
+text and validates its checksum.  It parses the GGA and RMC sentences
+into typed columns with array operations only, so archived logs are
+processed without a per-line loop.  Each RMC sentence (which carries the
+date) becomes one row, joined with the GGA sentence of the same epoch.
+:class:`NmeaStream` feeds arbitrary pieces of text through :func:`decode`
+a batch at a time.  It is used both by the live loggers and to convert
+archives::
+
+    python -m serial_logging.nmea webapps/shared/AML.txt --output fixes.cap --csv fixes.csv
+
+The table is a :mod:`~.capture` file with the :data:`FIX_COLUMNS`.
+``time`` is the GPS time (UTC) and ``logged`` the logger's local clock
+when the line carries a logger timestamp.  Rows whose time is unknown
+are dropped.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .capture import PREFIX_BYTES, STAMP_BYTES, CaptureWriter, parse_decimals, parse_stamps, read_blocks
+
+FIX_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("time", "<M8[ms]"),
+    ("logged", "<M8[ms]"),
+    ("latitude", "<f8"),
+    ("longitude", "<f8"),
+    ("valid", "|b1"),
+    ("quality", "|u1"),
+    ("satellites", "|u1"),
+    ("hdop", "<f4"),
+    ("altitude", "<f4"),
+    ("speed", "<f4"),
+    ("course", "<f4"),
+)
+SENTENCE_TYPES = (b"GGA", b"RMC", b"VTG", b"GSA", b"GSV")
+MAX_SENTENCE = 120
+BATCH_BYTES = 16 * 1024
+
+_HEX = np.full(256, 16, dtype=np.uint8)
+_HEX[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_HEX[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+_HEX[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+
+Fixes = Dict[str, np.ndarray]
+
+
+def _code(kind: bytes) -> int:
+    return kind[0] << 16 | kind[1] << 8 | kind[2]
+
+
+def _positions(buf: np.ndarray, byte: int) -> np.ndarray:
+    """Return where ``byte`` occurs in ``buf``, followed by ``len(buf)``."""
+    return np.append(np.flatnonzero(buf == byte), len(buf))
+
+
+def _after(positions: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Return the first of (padded) ``positions`` after each target."""
+    return positions[np.searchsorted(positions, targets)]
+
+
+class _Sentences:
+    """Checksum-valid sentences of one type and the bounds of their fields."""
+
+    def __init__(self, buf: np.ndarray, commas: np.ndarray, dollars: np.ndarray, stars: np.ndarray) -> None:
+        self.buf = buf
+        self.commas = commas  # padded with len(buf), see _positions
+        self.dollars = dollars
+        self.stars = stars
+        self._first = np.searchsorted(commas, dollars)
+
+    def subset(self, index: np.ndarray) -> "_Sentences":
+        return _Sentences(self.buf, self.commas, self.dollars[index], self.stars[index])
+
+    def field(self, number: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(lo, hi)`` of field ``number`` (1 is the first after the type)."""
+        last = len(self.commas) - 1
+        index = self._first + number - 1
+        lo = self.commas[np.minimum(index, last)] + 1
+        hi = np.minimum(self.commas[np.minimum(index + 1, last)], self.stars)
+        missing = lo > self.stars
+        return np.where(missing, self.stars, lo), np.where(missing, self.stars, hi)
+
+    def number(self, number: int, signed: bool = False) -> np.ndarray:
+        """Parse field ``number`` as a decimal; empty or invalid fields are NaN."""
+        lo, hi = self.field(number)
+        sign = np.ones(len(lo))
+        if signed:
+            negative = (hi > lo) & (self.buf[np.minimum(lo, len(self.buf) - 1)] == 45)
+            lo = lo + negative
+            sign[negative] = -1
+        values, valid = parse_decimals(self.buf, lo, hi)
+        return np.where(valid, values * sign, np.nan)
+
+    def char(self, number: int) -> np.ndarray:
+        """Return the first byte of field ``number`` (0 when empty)."""
+        lo, hi = self.field(number)
+        return np.where(hi > lo, self.buf[np.minimum(lo, len(self.buf) - 1)], 0)
+
+    def coordinate(self, number: int, negative: int) -> np.ndarray:
+        """Parse a ``(d)ddmm.mmmm`` field and its hemisphere into degrees."""
+        value = self.number(number)
+        degrees = np.floor(value / 100)
+        result = degrees + (value - degrees * 100) / 60
+        return np.where(self.char(number + 1) == negative, -result, result)
+
+
+def _seconds(value: np.ndarray) -> np.ndarray:
+    """Return milliseconds since midnight for ``hhmmss.sss`` values."""
+    hours = np.floor(value / 10000)
+    minutes = np.floor(value / 100) - hours * 100
+    seconds = value - hours * 10000 - minutes * 100
+    return np.round((hours * 3600 + minutes * 60 + seconds) * 1000)
+
+
+def _dates(value: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the days of ``ddmmyy`` values and a mask of plausible ones."""
+    known = ~np.isnan(value)
+    value = np.where(known, value, 0).astype(np.int64)
+    day, month, year = value // 10000, value // 100 % 100, value % 100
+    ok = known & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    month = np.where(ok, month, 1)
+    day = np.where(ok, day, 1)
+    months = (year + 2000 - 1970).astype("M8[Y]").astype("M8[M]") + (month - 1).astype("m8[M]")
+    return months.astype("M8[D]") + (day - 1).astype("m8[D]"), ok
+
+
+def decode(data: bytes) -> Tuple[Fixes, Dict[str, int]]:
+    """Decode every NMEA sentence in ``data`` (whole lines of log text).
+
+    Returns the fixes as :data:`FIX_COLUMNS` arrays and counts of the
+    sentences found per type, plus ``bad`` for those that failed their
+    checksum or framing.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    counts = {kind.decode(): 0 for kind in SENTENCE_TYPES}
+    counts["other"] = counts["bad"] = 0
+    empty = {name: np.empty(0, dtype=dtype) for name, dtype in FIX_COLUMNS}
+    dollars = np.flatnonzero(buf == 36)
+    if not len(dollars):
+        return empty, counts
+    newlines = _positions(buf, 10)
+    size = len(buf)
+
+    # Framing: "$" ... "*" two hex digits, within one line and no other "$".
+    star = _after(_positions(buf, 42), dollars)
+    line_end = _after(newlines, dollars)
+    next_dollar = np.append(dollars[1:], size)
+    framed = (star + 3 <= np.minimum(line_end, next_dollar)) & (star - dollars <= MAX_SENTENCE) & (star > dollars + 6)
+    total = int(framed.sum())
+    counts["bad"] = len(dollars) - total
+    dollars, star = dollars[framed], star[framed]
+    if not len(dollars):
+        return empty, counts
+
+    # Checksum: XOR of the bytes between "$" and "*".
+    checksum = np.bitwise_xor.reduceat(buf, np.column_stack((dollars + 1, star)).ravel())[::2]
+    high, low = _HEX[buf[star + 1]], _HEX[buf[star + 2]]
+    good = (high < 16) & (low < 16) & (checksum == (high << 4 | low))
+    counts["bad"] += int((~good).sum())
+    dollars, star = dollars[good], star[good]
+
+    kind = buf[dollars + 3].astype(np.int32) << 16 | buf[dollars + 4].astype(np.int32) << 8 | buf[dollars + 5]
+    for name in SENTENCE_TYPES:
+        counts[name.decode()] = int((kind == _code(name)).sum())
+    counts["other"] = len(dollars) - sum(counts[name.decode()] for name in SENTENCE_TYPES)
+
+    commas = _positions(buf, 44)
+    rmc = kind == _code(b"RMC")
+    gga = kind == _code(b"GGA")
+    if not rmc.any():
+        return empty, counts
+    r = _Sentences(buf, commas, dollars[rmc], star[rmc])
+    g = _Sentences(buf, commas, dollars[gga], star[gga])
+
+    clock = _seconds(r.number(1))
+    days, dated = _dates(r.number(9))
+    known = dated & ~np.isnan(clock)
+    fixes: Fixes = {
+        "time": days.astype("M8[ms]") + np.where(known, clock, 0).astype("m8[ms]"),
+        "valid": r.char(2) == 65,  # "A"
+        "latitude": r.coordinate(3, 83),  # "S"
+        "longitude": r.coordinate(5, 87),  # "W"
+        "speed": r.number(7),
+        "course": r.number(8),
+    }
+
+    # The GGA sentence of the same epoch is the last one before the RMC.
+    before = np.searchsorted(g.dollars, r.dollars) - 1
+    match = before >= 0
+    g = g.subset(before[match])
+    match[match] = _seconds(g.number(1)) == clock[match]
+    g = g.subset(match[before >= 0])
+    fixes["quality"] = np.zeros(len(clock))
+    fixes["satellites"] = np.zeros(len(clock))
+    fixes["hdop"] = np.full(len(clock), np.nan)
+    fixes["altitude"] = np.full(len(clock), np.nan)
+    fixes["quality"][match] = np.nan_to_num(g.number(6))
+    fixes["satellites"][match] = np.nan_to_num(g.number(7))
+    fixes["hdop"][match] = g.number(8)
+    fixes["altitude"][match] = g.number(9, signed=True)
+
+    # Logger timestamps: "YYYY-mm-dd HH:MM:SS - " right before the "$".
+    line_start = np.append(0, newlines[:-1] + 1)[np.searchsorted(newlines, r.dollars)]
+    stamped = (r.dollars - line_start == PREFIX_BYTES) & (buf[np.minimum(line_start + STAMP_BYTES + 1, size - 1)] == 45)
+    logged = np.full(len(clock), np.datetime64("NaT"), dtype="M8[ms]")
+    if stamped.any():
+        stamps, ok = parse_stamps(buf, line_start[stamped])
+        logged[stamped] = np.where(ok, stamps, np.datetime64("NaT"))
+    fixes["logged"] = logged
+
+    return {name: np.asarray(fixes[name])[known].astype(dtype) for name, dtype in FIX_COLUMNS}, counts
+
+
+class NmeaStream:
+    """Decode NMEA text fed in arbitrary pieces, ``batch_bytes`` at a time.
+
+    Text is decoded up to the end of the last complete RMC line, so an
+    epoch is never split between batches.  Decoded fixes are appended to
+    ``writer`` and/or passed to ``on_fixes``.  ``counts`` accumulates the
+    sentence counts of every batch.
+    """
+
+    def __init__(
+        self,
+        writer: Optional[CaptureWriter] = None,
+        on_fixes: Optional[Callable[[Fixes], None]] = None,
+        batch_bytes: int = BATCH_BYTES,
+        source: str = "GPS",
+    ) -> None:
+        self.writer = writer
+        self.on_fixes = on_fixes
+        self.batch_bytes = batch_bytes
+        self.source = source
+        self.counts: Dict[str, int] = {}
+        self.fixes = 0
+        self._pending: List[bytes] = []
+        self._size = 0
+
+    def feed(self, data: bytes) -> None:
+        self._pending.append(data)
+        self._size += len(data)
+        if self._size >= self.batch_bytes:
+            self._decode(final=False)
+
+    def flush(self) -> None:
+        """Decode everything fed so far."""
+        self._decode(final=True)
+
+    def _decode(self, final: bool) -> None:
+        data = b"".join(self._pending)
+        cut = len(data)
+        if not final:
+            complete = data.rfind(b"\n") + 1
+            last = data.rfind(b"RMC,", 0, complete)
+            cut = data.find(b"\n", last) + 1 if last >= 0 else 0
+            if not cut:
+                if len(data) < 4 * self.batch_bytes:
+                    # No complete epoch yet; wait for more text.
+                    self._pending, self._size = [data], len(data)
+                    return
+                cut = complete
+        self._pending = [data[cut:]] if cut < len(data) else []
+        self._size = len(data) - cut
+        if not cut:
+            return
+        fixes, counts = decode(data[:cut])
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+        if not len(fixes["time"]):
+            return
+        self.fixes += len(fixes["time"])
+        if self.writer is not None:
+            self.writer.write_columns(self.source, fixes)
+        if self.on_fixes is not None:
+            self.on_fixes(fixes)
+
+
+def write_csv(fixes: Fixes, out) -> None:
+    """Write ``fixes`` as CSV rows (header included) to the file ``out``."""
+    columns = []
+    for name, _ in FIX_COLUMNS:
+        values = fixes[name]
+        text = values.astype(str)
+        if values.dtype.kind == "M":
+            text[np.isnat(values)] = ""
+        elif values.dtype.kind == "f":
+            text[np.isnan(values)] = ""
+        columns.append(text)
+    writer = csv.writer(out)
+    writer.writerow([name for name, _ in FIX_COLUMNS])
+    writer.writerows(zip(*columns))
+
+
+# ----------------------------------------------------------------------
+# CLI
+def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Decode the GPS fixes in AML logs")
+    parser.add_argument("logs", nargs="+", type=Path, help="Log files (rotated .gz logs included)")
+    parser.add_argument("--output", type=Path, help="Append the fixes to this capture file")
+    parser.add_argument("--csv", help="Write the fixes as CSV to this file ('-' for stdout)")
+    parser.add_argument("--valid-only", action="store_true", help="Keep only fixes the receiver marked valid")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    args = parse_args(argv)
+    tables: List[Fixes] = []
+    kept = 0
+
+    def collect(fixes: Fixes) -> None:
+        nonlocal kept
+        if args.valid_only:
+            fixes = {name: values[fixes["valid"]] for name, values in fixes.items()}
+        kept += len(fixes["time"])
+        if args.csv:
+            tables.append(fixes)
+        if writer is not None and len(fixes["time"]):
+            writer.write_columns("GPS", fixes)
+
+    writer = CaptureWriter(args.output, FIX_COLUMNS, sync=False) if args.output else None
+    stream = NmeaStream(on_fixes=collect, batch_bytes=8 * 1024 * 1024)
+    started = time.perf_counter()
+    size = 0
+    try:
+        for path in args.logs:
+            for block in read_blocks(path):
+                size += len(block)
+                stream.feed(block)
+        stream.flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - started
+    if args.csv:
+        merged = {name: np.concatenate([t[name] for t in tables]) if tables else np.empty(0, dtype) for name, dtype in FIX_COLUMNS}
+        if args.csv == "-":
+            write_csv(merged, sys.stdout)
+        else:
+            with open(args.csv, "w", newline="") as out:
+                write_csv(merged, out)
+    summary = ", ".join(f"{name} {count}" for name, count in stream.counts.items() if count)
+    print(
+        f"{kept} fixes from {size} bytes in {elapsed:.2f} s ({summary or 'no sentences'})",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
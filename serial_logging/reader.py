@@ -0,0 +1,176 @@
+"""Blocking, line-framed serial reader shared by the instrument loggers.
+
+The original loggers spun on ``if ser.in_waiting`` with nothing to block
+on, keeping a core busy while the instruments send about a line a second.
+:class:`SerialReader` instead sleeps in the driver until bytes arrive
+(pyserial waits with ``select`` on POSIX and an overlapped wait on
+Windows), drains everything that is buffered with one bulk read and
+splits it into lines with a :class:`LineFramer`.
+
+Run from the repository root::
+
+    python -m serial_logging.reader --port /dev/ttyUSB0 --baud 38400
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+MAX_LINE_BYTES = 4096
+
+
+def format_line(data: bytes, timestamp: Optional[float] = None) -> str:
+    """Return ``data`` as a log line prefixed with its local timestamp."""
+    stamp = time.strftime(TIMESTAMP_FORMAT, time.localtime(timestamp))
+    return f"{stamp} - {data.decode('utf-8', errors='replace')}"
+
+
+class LineFramer:
+    """Reassemble lines from arbitrarily split chunks of a byte stream.
+
+    Lines keep their ``delimiter`` so that they are logged exactly as
+    received.  A run of more than ``max_line`` bytes without a delimiter
+    (noise on a floating line, a wrong baud rate) is emitted as is rather
+    than buffered without bound.
+    """
+
+    def __init__(self, delimiter: bytes = b"\n", max_line: int = MAX_LINE_BYTES) -> None:
+        self.delimiter = delimiter
+        self.max_line = max_line
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Add ``data`` and return the lines it completes."""
+        buffer = self._buffer
+        # Only the new bytes (and a delimiter split across chunks) need scanning.
+        start = max(0, len(buffer) - len(self.delimiter) + 1)
+        buffer += data
+        lines: List[bytes] = []
+        size = len(self.delimiter)
+        head = 0
+        while True:
+            end = buffer.find(self.delimiter, start)
+            if end < 0:
+                break
+            lines.append(bytes(buffer[head:end + size]))
+            head = start = end + size
+        while len(buffer) - head > self.max_line:
+            lines.append(bytes(buffer[head:head + self.max_line]))
+            head += self.max_line
+        del buffer[:head]
+        return lines
+
+    def flush(self) -> Optional[bytes]:
+        """Return and clear a trailing partial line, if any."""
+        if not self._buffer:
+            return None
+        rest = bytes(self._buffer)
+        self._buffer.clear()
+        return rest
+
+
+class SerialReader:
+    """Read delimited lines from a serial port without polling.
+
+    ``timeout`` bounds how long a read blocks when the port is idle, so
+    iteration periodically returns control to check ``stop``; idle
+    wake-ups yield nothing.  Iterating yields ``(timestamp, line)`` where
+    ``timestamp`` is the time the chunk holding the end of the line
+    arrived.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int,
+        *,
+        delimiter: bytes = b"\n",
+        timeout: float = 1.0,
+        max_line: int = MAX_LINE_BYTES,
+    ) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.framer = LineFramer(delimiter, max_line)
+        self.stopped = False
+        self._serial = None
+
+    # ------------------------------------------------------------------
+    # Port management
+    def open(self) -> "SerialReader":
+        import serial
+
+        self._serial = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+        return self
+
+    def close(self) -> None:
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+
+    def __enter__(self) -> "SerialReader":
+        return self.open() if self._serial is None else self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def send(self, command: str, terminator: str = "\r") -> None:
+        """Write ``command`` followed by ``terminator`` to the device."""
+        self._serial.write(f"{command}{terminator}".encode())
+
+    def stop(self) -> None:
+        """Make iteration end after the current read returns."""
+        self.stopped = True
+
+    # ------------------------------------------------------------------
+    # Reading
+    def read_chunk(self) -> bytes:
+        """Block until data arrives (or ``timeout``) and return all of it."""
+        ser = self._serial
+        data = ser.read(1)
+        if data:
+            waiting = ser.in_waiting
+            if waiting:
+                data += ser.read(waiting)
+        return data
+
+    def __iter__(self) -> Iterator[Tuple[float, bytes]]:
+        while not self.stopped:
+            data = self.read_chunk()
+            if not data:
+                continue
+            now = time.time()
+            for line in self.framer.feed(data):
+                yield now, line
+        rest = self.framer.flush()
+        if rest is not None:
+            yield time.time(), rest
+
+
+# ----------------------------------------------------------------------
+# CLI
+def parse_args(args: Iterable[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Print timestamped lines from a serial port")
+    parser.add_argument("--port", required=True, help="Serial device path")
+    parser.add_argument("--baud", type=int, default=9600, help="Baud rate for the serial connection")
+    parser.add_argument("--command", help="Command to send to the device on start-up")
+    return parser.parse_args(args)
+
+
+def main(argv: Iterable[str] | None = None) -> None:
+    args = parse_args(argv)
+    with SerialReader(args.port, args.baud) as reader:
+        if args.command:
+            reader.send(args.command)
+        try:
+            for timestamp, line in reader:
+                print(format_line(line, timestamp), end="")
+        except KeyboardInterrupt:
+            print("Exiting…")
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
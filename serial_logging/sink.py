@@ -0,0 +1,330 @@
+"""Batched, rotating log files for the serial loggers.
+
+Opening and closing the log for every line (or leaving Python's buffer
+to flush whenever it fills) either grinds the SD card or loses an
+unknown amount of data on a power cut.  :class:`LogSink` collects lines
+in memory and appends them with one write per batch, so a batch is never
+split mid-line.  It calls ``fsync`` on a separate, slower schedule.  The
+live file is rotated by size and/or at the start of every hour or day.
+Rotated files are gzipped by a background thread.
+
+Rotated files are named ``AML.20261017-000000.txt`` (the time the file
+was started) and become ``AML.20261017-000000.txt.gz``.  A file that
+was rotated but not yet compressed when the process stopped is compressed
+on the next start, and half-written archives are discarded.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import gzip
+import logging
+import os
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+ROTATE_PERIODS = ("hourly", "daily")
+STAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def exit_on_sigterm() -> None:
+    """Raise ``SystemExit`` on SIGTERM so ``with`` blocks flush their sinks.
+
+    The scheduler stops loggers with SIGTERM, which would otherwise end the
+    process without unwinding.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def add_sink_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the flush and rotation options read by :meth:`LogSink.from_args`."""
+    group = parser.add_argument_group("log file")
+    group.add_argument("--flush-interval", type=float, default=5.0, help="Seconds a line may wait in memory (default: 5)")
+    group.add_argument(
+        "--fsync-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between fsyncs; 0 syncs every write, a negative value only on rotation (default: 60)",
+    )
+    group.add_argument("--max-bytes", type=int, help="Rotate the log once it would exceed this size")
+    group.add_argument("--rotate", choices=ROTATE_PERIODS, help="Rotate the log at the start of every hour or day")
+    group.add_argument("--backups", type=int, help="Number of rotated logs to keep (default: all)")
+    group.add_argument("--no-compress", dest="compress", action="store_false", help="Leave rotated logs uncompressed")
+
+
+def _next_boundary(now: float, period: str) -> float:
+    start = datetime.datetime.fromtimestamp(now)
+    if period == "hourly":
+        start = start.replace(minute=0, second=0, microsecond=0)
+        return (start + datetime.timedelta(hours=1)).timestamp()
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (start + datetime.timedelta(days=1)).timestamp()
+
+
+class LogSink:
+    """Append text lines to ``path`` in batches, rotating as configured.
+
+    Lines wait in memory until ``buffer_bytes`` are pending or the oldest
+    has waited ``flush_interval`` seconds.  The background thread enforces
+    the interval even when no further lines arrive.  Data is ``fsync``-ed
+    at most every ``fsync_interval`` seconds (``0`` after every write,
+    ``None`` only on rotation and close).  ``max_bytes`` and ``rotate``
+    (``"hourly"`` or ``"daily"``) start a new file.  ``backups`` keeps
+    only that many compressed files.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        *,
+        buffer_bytes: int = 64 * 1024,
+        flush_interval: float = 5.0,
+        fsync_interval: Optional[float] = 60.0,
+        max_bytes: Optional[int] = None,
+        rotate: Optional[str] = None,
+        compress: bool = True,
+        backups: Optional[int] = None,
+    ) -> None:
+        if rotate is not None and rotate not in ROTATE_PERIODS:
+            raise ValueError(f"rotate must be one of {ROTATE_PERIODS}, not {rotate!r}")
+        self.path = Path(path)
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate = rotate
+        self.compress = compress
+        self.backups = backups
+        self._pattern = re.compile(
+            re.escape(self.path.stem) + r"\.(\d{8}-\d{6})(?:-(\d+))?" + re.escape(self.path.suffix) + r"(?:\.gz)?"
+        )
+
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._first_pending = 0.0
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+        self._closed = False
+        self._archive: List[Path] = []
+
+        self._fd = -1
+        self._open()
+        self._recover()
+        self._thread = threading.Thread(target=self._run, name=f"LogSink({self.path.name})", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_args(cls, path: Union[str, Path], args: argparse.Namespace) -> "LogSink":
+        """Create a sink configured by :func:`add_sink_arguments` options."""
+        return cls(
+            path,
+            flush_interval=args.flush_interval,
+            fsync_interval=args.fsync_interval if args.fsync_interval >= 0 else None,
+            max_bytes=args.max_bytes,
+            rotate=args.rotate,
+            compress=args.compress,
+            backups=args.backups,
+        )
+
+    # ------------------------------------------------------------------
+    # Public API
+    def write(self, line: str) -> None:
+        """Queue ``line`` (including its newline) for the log."""
+        data = line.encode("utf-8")
+        with self._lock:
+            if self._closed:
+                raise ValueError("write to closed LogSink")
+            now = time.time()
+            if self._rotation_due(now, len(data)):
+                self._flush_locked()
+                self._rotate_locked()
+            if not self._pending:
+                self._first_pending = time.monotonic()
+                self._wake.notify()
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            self._size += len(data)
+            if self._pending_bytes >= self.buffer_bytes:
+                self._flush_locked()
+
+    def flush(self, sync: bool = False) -> None:
+        """Write pending lines now and, with ``sync``, ``fsync`` them."""
+        with self._lock:
+            self._flush_locked()
+            if sync:
+                self._sync_locked()
+
+    def close(self) -> None:
+        """Flush, ``fsync`` and close the file and stop the archiver.
+
+        A compression that is in progress finishes; files still queued
+        behind it are compressed on the next start.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._sync_locked()
+            os.close(self._fd)
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+
+    def __enter__(self) -> "LogSink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ------------------------------------------------------------------
+    # File handling (called with the lock held)
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        stat = os.fstat(self._fd)
+        self._size = stat.st_size
+        now = time.time()
+        # An existing file was started when it was last rotated; its age is
+        # unknown, so it is treated as started now.
+        self._started = now
+        self._next_rotation = _next_boundary(now, self.rotate) if self.rotate else None
+
+    def _rotation_due(self, now: float, incoming: int) -> bool:
+        if self._next_rotation is not None and now >= self._next_rotation:
+            if self._size:
+                return True
+            # Nothing to rotate out; just move on to the next period.
+            self._next_rotation = _next_boundary(now, self.rotate)
+        return bool(self.max_bytes) and self._size > 0 and self._size + incoming > self.max_bytes
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_bytes = 0
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        self._unsynced = True
+        if self.fsync_interval is not None and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if self._unsynced:
+            os.fsync(self._fd)
+            self._unsynced = False
+        self._last_sync = time.monotonic()
+
+    def _rotate_locked(self) -> None:
+        self._sync_locked()
+        os.close(self._fd)
+        stamp = time.strftime(STAMP_FORMAT, time.localtime(self._started))
+        target = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        counter = 1
+        while target.exists() or target.with_name(target.name + ".gz").exists():
+            target = self.path.with_name(f"{self.path.stem}.{stamp}-{counter}{self.path.suffix}")
+            counter += 1
+        os.replace(self.path, target)
+        self._open()
+        if self.compress:
+            self._archive.append(target)
+            self._wake.notify()
+        else:
+            self._prune()
+
+    # ------------------------------------------------------------------
+    # Background thread
+    def _recover(self) -> None:
+        """Queue rotated files left uncompressed and drop partial archives."""
+        for entry in self.path.parent.glob(f"{self.path.stem}.*.gz.tmp"):
+            entry.unlink()
+        if self.compress:
+            self._archive = [entry for entry in self._rotated() if entry.suffix != ".gz"]
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if not self._step():
+                    return
+            except Exception:
+                # Keep flushing and archiving; a full card or a vanished
+                # file must not silently stop the thread.
+                logger.exception("%s: background flush or compression failed", self.path)
+                with self._lock:
+                    if self._closed:
+                        return
+                    self._wake.wait(self.flush_interval)
+
+    def _step(self) -> bool:
+        """Wait for and do one piece of background work; ``False`` when closed."""
+        with self._lock:
+            while not self._closed and not self._archive:
+                timeout = None
+                if self._pending:
+                    timeout = self._first_pending + self.flush_interval - time.monotonic()
+                    if timeout <= 0:
+                        self._flush_locked()
+                        continue
+                elif self.fsync_interval is not None and self._unsynced:
+                    timeout = self._last_sync + self.fsync_interval - time.monotonic()
+                    if timeout <= 0:
+                        self._sync_locked()
+                        continue
+                self._wake.wait(timeout if timeout is not None else self.flush_interval)
+            if self._closed or not self._archive:
+                return False
+            source = self._archive[0]
+        try:
+            self._compress(source)
+        finally:
+            with self._lock:
+                self._archive.remove(source)
+        return True
+
+    def _compress(self, source: Path) -> None:
+        target = source.with_name(source.name + ".gz")
+        partial = source.with_name(target.name + ".tmp")
+        try:
+            with open(source, "rb") as src, open(partial, "wb") as raw:
+                with gzip.GzipFile(filename=source.name, mode="wb", fileobj=raw, mtime=int(source.stat().st_mtime)) as gz:
+                    shutil.copyfileobj(src, gz, 1024 * 1024)
+                raw.flush()
+                os.fsync(raw.fileno())
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        os.replace(partial, target)
+        source.unlink()
+        self._prune()
+
+    def _prune(self) -> None:
+        if self.backups is None:
+            return
+        rotated = self._rotated()
+        # Files still waiting for compression count, but are never deleted.
+        queued = set(self._archive)
+        excess = len(rotated) - self.backups
+        for entry in [entry for entry in rotated if entry not in queued][:max(0, excess)]:
+            entry.unlink(missing_ok=True)
+
+    def _rotated(self) -> List[Path]:
+        """Return the rotated files, oldest first."""
+        found = []
+        for entry in self.path.parent.glob(f"{self.path.stem}.*"):
+            match = self._pattern.fullmatch(entry.name)
+            if match:
+                found.append((match.group(1), int(match.group(2) or 0), entry))
+        return [entry for _, _, entry in sorted(found)]
@@ -1,17 +1,25 @@
 """Admin-facing FastAPI application with HTTP Basic authentication."""
 
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
+import asyncio
+import json
 import os
-import shutil
 
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile, status
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from ..shared.services.schedule_manager import ScheduleManager
+from ..shared.services.command_queue import CommandQueue
+from ..shared.services.events import EventHub
+from ..shared.services.importer import ImportReport, ScheduleReader, UploadTooLarge, import_schedules
+from ..shared.services.metrics import instrument
+from ..shared.services.schedule_manager import READ_ONLY_COMMANDS
+from ..shared.web import CachedFile, RequestMetrics, cached_response, metrics_response, open_writer, start_writer
 
 load_dotenv()
 USERNAME = os.getenv("USERNAME")
@@ -19,11 +27,28 @@ PASSWORD = os.getenv("PASSWORD")
 
 BASE_DIR = Path(__file__).resolve().parent
 SHARED_DIR = BASE_DIR.parent / "shared"
+# Created at startup rather than on import; see open_writer.
+writer: Optional[CommandQueue] = None
+hub: Optional[EventHub] = None
+index_page = CachedFile(SHARED_DIR / "static" / "index.html", "text/html")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global writer, hub
+    writer = open_writer()
+    hub = EventHub(writer)
+    await start_writer(writer)
+    await hub.start()
+    yield
+    await hub.stop()
+    await writer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory=SHARED_DIR / "static"), name="static")
+app.add_middleware(RequestMetrics)
 security = HTTPBasic()
-manager = ScheduleManager()
 
 
 class CommandRequest(BaseModel):
@@ -44,47 +69,142 @@ def authenticate(credentials: HTTPBasicCredentials = Depends(security)) -> HTTPB
 
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root(credentials: HTTPBasicCredentials = Depends(authenticate)) -> HTMLResponse:
-    with open(SHARED_DIR / "static" / "index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+async def read_root(
+    request: Request, credentials: HTTPBasicCredentials = Depends(authenticate)
+) -> Response:
+    return index_page.response(request)
 
 
 @app.post("/execute")
 async def execute_command(
     request: CommandRequest, credentials: HTTPBasicCredentials = Depends(authenticate)
 ) -> HTMLResponse:
-    result = manager.execute(request.command, request.args)
+    try:
+        if request.command in READ_ONLY_COMMANDS:
+            result = writer.snapshot.query(request.command, request.args)
+        else:
+            result = await writer.execute(request.command, request.args)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     return HTMLResponse(content=result)
 
 
 @app.get("/view_schedules")
 async def view_schedules(credentials: HTTPBasicCredentials = Depends(authenticate)) -> HTMLResponse:
-    return HTMLResponse(content=manager.view_schedules())
+    return HTMLResponse(content=writer.snapshot.view_schedules())
 
 
 @app.get("/view_states")
 async def view_states(credentials: HTTPBasicCredentials = Depends(authenticate)) -> HTMLResponse:
-    return HTMLResponse(content=manager.view_states())
+    return HTMLResponse(content=writer.snapshot.view_states())
+
+
+@app.get("/api/schedules")
+async def api_schedules(
+    request: Request, credentials: HTTPBasicCredentials = Depends(authenticate)
+) -> Response:
+    snapshot = writer.snapshot
+    return cached_response(request, snapshot.schedules_json(), snapshot.etag, "application/json")
+
+
+@app.get("/api/states")
+async def api_states(
+    request: Request, credentials: HTTPBasicCredentials = Depends(authenticate)
+) -> Response:
+    body, etag = writer.snapshot.states_json()
+    return cached_response(request, body, etag, "application/json")
+
+
+@app.get("/events")
+async def events(
+    request: Request, credentials: HTTPBasicCredentials = Depends(authenticate)
+) -> StreamingResponse:
+    return StreamingResponse(
+        hub.stream(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+async def metrics(credentials: HTTPBasicCredentials = Depends(authenticate)) -> Response:
+    return metrics_response()
+
+
+@app.get("/calendar")
+async def calendar(
+    days: int = Query(30, ge=1, le=366),
+    sensor: Optional[str] = None,
+    credentials: HTTPBasicCredentials = Depends(authenticate),
+) -> dict:
+    snapshot = writer.snapshot
+    try:
+        sensors = sensor.split(",") if sensor else None
+        transitions = await asyncio.to_thread(snapshot.calendar, days, sensors=sensors)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return {
+        "days": days,
+        "overrides": {key: value for key, value in snapshot.sensors_override.items() if value},
+        "transitions": transitions.to_records(),
+    }
+
+
+@app.get("/energy")
+async def energy(
+    days: int = Query(90, ge=1, le=366),
+    step: int = Query(60, ge=1, le=1440),
+    draw: Optional[str] = None,
+    credentials: HTTPBasicCredentials = Depends(authenticate),
+) -> dict:
+    try:
+        budget = await asyncio.to_thread(writer.snapshot.energy_budget, days, draw)
+        return budget.summary(step)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
 
 @app.post("/upload_schedule")
 async def upload_schedule(
     file: UploadFile = File(...),
+    mode: str = Query("replace", pattern="^(replace|append)$"),
+    strict: bool = True,
+    dry_run: bool = False,
     credentials: HTTPBasicCredentials = Depends(authenticate),
-) -> HTMLResponse:
-    if not file.filename.endswith(".json"):
-        raise HTTPException(status_code=400, detail="File must be a JSON file")
-    schedule_dir = SHARED_DIR / "schedule_files"
-    temp_path = schedule_dir / file.filename
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    existing = schedule_dir / "sensor_schedule.json"
-    backup_dir = schedule_dir / "on_hold"
-    backup_dir.mkdir(exist_ok=True)
-    if existing.exists():
-        existing.rename(backup_dir / "sensor_schedule.json")
-    temp_path.rename(existing)
-    return HTMLResponse(content=manager.view_schedules())
+) -> dict:
+    try:
+        report = await writer.run(lambda: _import_upload(file, mode, strict, dry_run))
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid schedule file: {exc}") from exc
+    result = dict(report.to_dict(), filename=file.filename)
+    if strict and report.rejected:
+        raise HTTPException(status_code=400, detail=result)
+    return result
+
+
+@instrument("upload")
+def _import_upload(file: UploadFile, mode: str, strict: bool, dry_run: bool) -> ImportReport:
+    """Stream ``file`` into the schedule store; runs on the writer thread.
+
+    Once a replace has been applied, the schedules it replaced are saved to
+    ``schedule_files/on_hold``.
+    """
+    manager = writer.manager
+    reader = ScheduleReader(file.file, file.filename or "")
+    previous = None
+    if mode == "replace" and not dry_run:
+        # Serialized now: the replace clears the live dictionaries.
+        manager.refresh()
+        previous = json.dumps(dict(manager.schedules_document(), indices=manager.sensors_indices), indent=4)
+    report = import_schedules(manager, reader, mode, strict, dry_run)
+    if previous is not None and report.applied:
+        backup_dir = SHARED_DIR / "schedule_files" / "on_hold"
+        backup_dir.mkdir(exist_ok=True)
+        with open(backup_dir / "sensor_schedule.json", "w") as backup:
+            backup.write(previous)
+    return report
 
 
 if __name__ == "__main__":  # pragma: no cover
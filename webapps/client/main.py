@@ -1,22 +1,46 @@
 """Client-facing FastAPI application."""
 
+from contextlib import asynccontextmanager
 from pathlib import Path
-import shutil
+from typing import Optional
+import asyncio
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
-from ..shared.services.schedule_manager import ScheduleManager
+from ..shared.services.command_queue import CommandQueue
+from ..shared.services.events import EventHub
+from ..shared.services.importer import ImportReport, ScheduleReader, UploadTooLarge, import_schedules
+from ..shared.services.metrics import instrument
+from ..shared.services.schedule_manager import READ_ONLY_COMMANDS
+from ..shared.web import CachedFile, RequestMetrics, cached_response, metrics_response, open_writer, start_writer
 
 
 BASE_DIR = Path(__file__).resolve().parent
 SHARED_DIR = BASE_DIR.parent / "shared"
+# Created at startup rather than on import; see open_writer.
+writer: Optional[CommandQueue] = None
+hub: Optional[EventHub] = None
+index_page = CachedFile(SHARED_DIR / "static" / "index.html", "text/html")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global writer, hub
+    writer = open_writer()
+    hub = EventHub(writer)
+    await start_writer(writer)
+    await hub.start()
+    yield
+    await hub.stop()
+    await writer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory=SHARED_DIR / "static"), name="static")
-manager = ScheduleManager()
+app.add_middleware(RequestMetrics)
 
 
 class CommandRequest(BaseModel):
@@ -25,15 +49,17 @@ class CommandRequest(BaseModel):
 
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root() -> HTMLResponse:
-    with open(SHARED_DIR / "static" / "index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+async def read_root(request: Request) -> Response:
+    return index_page.response(request)
 
 
 @app.post("/execute")
 async def execute_command(request: CommandRequest) -> HTMLResponse:
     try:
-        result = manager.execute(request.command, request.args)
+        if request.command in READ_ONLY_COMMANDS:
+            result = writer.snapshot.query(request.command, request.args)
+        else:
+            result = await writer.execute(request.command, request.args)
     except ValueError as exc:  # pragma: no cover - simple input validation
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     return HTMLResponse(content=result)
@@ -41,22 +67,92 @@ async def execute_command(request: CommandRequest) -> HTMLResponse:
 
 @app.get("/view_schedules")
 async def view_schedules() -> HTMLResponse:
-    return HTMLResponse(content=manager.view_schedules())
+    return HTMLResponse(content=writer.snapshot.view_schedules())
 
 
 @app.get("/view_states")
 async def view_states() -> HTMLResponse:
-    return HTMLResponse(content=manager.view_states())
+    return HTMLResponse(content=writer.snapshot.view_states())
+
+
+@app.get("/api/schedules")
+async def api_schedules(request: Request) -> Response:
+    snapshot = writer.snapshot
+    return cached_response(request, snapshot.schedules_json(), snapshot.etag, "application/json")
+
+
+@app.get("/api/states")
+async def api_states(request: Request) -> Response:
+    body, etag = writer.snapshot.states_json()
+    return cached_response(request, body, etag, "application/json")
+
+
+@app.get("/events")
+async def events(request: Request) -> StreamingResponse:
+    return StreamingResponse(
+        hub.stream(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    return metrics_response()
+
+
+@app.get("/calendar")
+async def calendar(days: int = Query(30, ge=1, le=366), sensor: Optional[str] = None) -> dict:
+    snapshot = writer.snapshot
+    try:
+        sensors = sensor.split(",") if sensor else None
+        transitions = await asyncio.to_thread(snapshot.calendar, days, sensors=sensors)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return {
+        "days": days,
+        "overrides": {key: value for key, value in snapshot.sensors_override.items() if value},
+        "transitions": transitions.to_records(),
+    }
+
+
+@app.get("/energy")
+async def energy(
+    days: int = Query(90, ge=1, le=366),
+    step: int = Query(60, ge=1, le=1440),
+    draw: Optional[str] = None,
+) -> dict:
+    try:
+        budget = await asyncio.to_thread(writer.snapshot.energy_budget, days, draw)
+        return budget.summary(step)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
 
 @app.post("/upload_schedule")
-async def upload_schedule(file: UploadFile = File(...)) -> dict:
-    if not file.filename.endswith(".json"):
-        raise HTTPException(status_code=400, detail="File must be a JSON file")
-    schedule_dir = SHARED_DIR / "schedule_files"
-    with open(schedule_dir / file.filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"filename": file.filename}
+async def upload_schedule(
+    file: UploadFile = File(...),
+    mode: str = Query("replace", pattern="^(replace|append)$"),
+    strict: bool = True,
+    dry_run: bool = False,
+) -> dict:
+    try:
+        report = await writer.run(lambda: _import_upload(file, mode, strict, dry_run))
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid schedule file: {exc}") from exc
+    result = dict(report.to_dict(), filename=file.filename)
+    if strict and report.rejected:
+        raise HTTPException(status_code=400, detail=result)
+    return result
+
+
+@instrument("upload")
+def _import_upload(file: UploadFile, mode: str, strict: bool, dry_run: bool) -> ImportReport:
+    """Stream ``file`` into the schedule store; runs on the writer thread."""
+    reader = ScheduleReader(file.file, file.filename or "")
+    return import_schedules(writer.manager, reader, mode, strict, dry_run)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,318 @@
+"""Benchmark the ScheduleManager hot paths against growing schedule sets.
+
+Every size gets a fresh temporary directory holding the storage file and,
+with the default ``cron`` backend, a crontab file that python-crontab
+reads and writes exactly as it would the user crontab.  The set is
+prefilled with non-overlapping one-off schedules on future dates, so each
+of them still owns two cron jobs, and the jobs are installed with one
+reconcile.  Then each operation is timed ``--repeat`` times:
+
+``add_schedule``/``remove_schedule``
+    Add a one-off schedule for today and remove it again.
+``view_states``
+    Right after each add and remove, as the web page does.
+``override_sensor``
+    Set an override; it is removed again untimed.
+``_persist``
+    Journal one operation in its own batch.
+
+Memory is measured in a second pass under ``tracemalloc``, which would
+otherwise distort the timings.  Run with::
+
+    python -m webapps.shared.benchmark --sizes 10,1000,50000 --output bench.json
+
+With ``--startup`` it times instead how long a web application takes from
+being launched under uvicorn to answering its first ``/api/schedules``
+request, with and without ``SCHEDULER_FAST_START``.  Each application
+runs against its own temporary store and, with the ``cron`` backend, a
+temporary crontab file (``SCHEDULER_CRONTAB``); a warm-up run writes the
+startup cache.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from .services.backend import ExecutionBackend
+from .services.schedule_manager import ScheduleManager
+
+DEFAULT_SIZES = "10,100,1000,10000,50000"
+OPERATIONS = ("add_schedule", "remove_schedule", "view_states", "override_sensor", "_persist")
+PERCENTILES = (50, 90, 99)
+# One-hour slots per day; each holds a 50 minute schedule per sensor.
+SLOTS = 24
+
+
+def prefill(manager: ScheduleManager, size: int) -> None:
+    """Store ``size`` one-off schedules spread over the sensors, none overlapping."""
+    sensors = list(manager.sensors_channels)
+    schedules: Dict[str, list] = {sensor: [] for sensor in sensors}
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    for i in range(size):
+        sensor = sensors[i % len(sensors)]
+        slot = len(schedules[sensor])
+        hour = slot % SLOTS
+        schedules[sensor].append(
+            {
+                "start": f"{hour:02d}:00",
+                "end": f"{hour:02d}:50",
+                "repeat": False,
+                "state": "on",
+                "days": None,
+                "end_repeat": None,
+                "date": (tomorrow + datetime.timedelta(days=slot // SLOTS)).isoformat(),
+                "id": slot,
+            }
+        )
+    overrides = {sensor: None for sensor in sensors}
+    indices = {sensor: len(items) for sensor, items in schedules.items()}
+    manager.store.write_snapshot((schedules, overrides, indices))
+    manager.reload()
+
+
+def make_manager(directory: Path, backend: str) -> ScheduleManager:
+    if backend == "cron":
+        from .services.cron_backend import CronBackend
+
+        tabfile = directory / "crontab"
+        tabfile.touch()
+        execution: ExecutionBackend = CronBackend(tabfile=str(tabfile))
+    else:
+        execution = ExecutionBackend()
+    return ScheduleManager(storage_file=str(directory / "sensor_schedule.json"), backend=execution)
+
+
+def _timed(samples: List[float], func: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - start)
+
+
+def run_operations(manager: ScheduleManager, repeat: int) -> Dict[str, List[float]]:
+    """Time every operation ``repeat`` times; return the samples in seconds."""
+    samples: Dict[str, List[float]] = {name: [] for name in OPERATIONS}
+    sensors = list(manager.sensors_channels)
+    for i in range(repeat):
+        sensor = sensors[i % len(sensors)]
+        index = manager.sensors_indices[sensor]
+        _timed(samples["add_schedule"], lambda: manager.add_schedule(sensor, "00:00", "00:10", "on"))
+        _timed(samples["view_states"], manager.view_states)
+        _timed(samples["remove_schedule"], lambda: manager.remove_schedule(sensor, index))
+        _timed(samples["view_states"], manager.view_states)
+        _timed(samples["override_sensor"], lambda: manager.override_sensor([sensor], "on"))
+        manager.remove_override([sensor])
+
+        def persist() -> None:
+            with manager.batch():
+                manager._persist({"op": "override", "sensor": sensor, "state": None})
+
+        _timed(samples["_persist"], persist)
+    return samples
+
+
+def summarize(samples: List[float]) -> dict:
+    values = np.array(samples) * 1000
+    summary = {"count": len(values), "mean_ms": round(float(values.mean()), 4)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}_ms"] = round(float(value), 4)
+    summary["max_ms"] = round(float(values.max()), 4)
+    return summary
+
+
+def measure_memory(size: int, backend: str) -> dict:
+    """Return the bytes held by a loaded manager and the peak while it works."""
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(Path(directory), backend)
+        prefill(manager, size)
+        del manager
+        tracemalloc.start()
+        try:
+            manager = make_manager(Path(directory), backend)
+            manager.view_states()
+            loaded, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run_operations(manager, 1)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"loaded_bytes": loaded, "peak_bytes": peak}
+
+
+def benchmark(size: int, repeat: int, backend: str, memory: bool = True) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(Path(directory), backend)
+        start = time.perf_counter()
+        prefill(manager, size)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        manager.reconcile()
+        reconcile_s = time.perf_counter() - start
+        samples = run_operations(manager, repeat)
+    result = {
+        "size": size,
+        "setup": {"load_s": round(load_s, 4), "reconcile_s": round(reconcile_s, 4)},
+        "operations": {name: summarize(values) for name, values in samples.items()},
+    }
+    if memory:
+        result["memory"] = measure_memory(size, backend)
+    return result
+
+
+# ----------------------------------------------------------------------
+# Startup
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_first_response(app: str, env: Dict[str, str], timeout: float = 60.0) -> float:
+    """Launch ``app`` under uvicorn; return the seconds until it answers a request."""
+    port = _free_port()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/api/schedules")
+    if app == "admin":
+        credentials = base64.b64encode(f"{env['USERNAME']}:{env['PASSWORD']}".encode()).decode()
+        request.add_header("Authorization", f"Basic {credentials}")
+    command = [sys.executable, "-m", "uvicorn", f"webapps.{app}.main:app", "--port", str(port), "--log-level", "warning"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{app} exited with status {process.returncode}")
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"{app} did not answer within {timeout} s")
+    finally:
+        # A clean shutdown writes the startup cache.
+        process.terminate()
+        process.wait()
+
+
+def benchmark_startup(size: int, runs: int, app: str, backend: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(Path(directory), backend)
+        prefill(manager, size)
+        manager.reconcile()
+        env = dict(
+            os.environ,
+            SCHEDULER_STORAGE=str(manager.storage_file),
+            SCHEDULER_BACKEND="cron" if backend == "cron" else "daemon",
+            SCHEDULER_CRONTAB=str(Path(directory) / "crontab"),
+            USERNAME=os.getenv("USERNAME") or "benchmark",
+            PASSWORD=os.getenv("PASSWORD") or "benchmark",
+        )
+        modes = {}
+        for mode, flag in (("default", "0"), ("fast_start", "1")):
+            env["SCHEDULER_FAST_START"] = flag
+            time_first_response(app, env)  # warm-up
+            samples = [time_first_response(app, env) for _ in range(runs)]
+            modes[mode] = {
+                "min_s": round(min(samples), 4),
+                "median_s": round(float(np.median(samples)), 4),
+                "max_s": round(max(samples), 4),
+            }
+    speedup = modes["default"]["median_s"] / modes["fast_start"]["median_s"]
+    return {"size": size, "app": app, "modes": modes, "speedup": round(speedup, 2)}
+
+
+def format_startup(report: dict) -> str:
+    lines = [f"{'size':>7} {'mode':<12}{'min_s':>10}{'median_s':>10}{'max_s':>10}"]
+    for result in report["results"]:
+        for mode, summary in result["modes"].items():
+            lines.append(
+                f"{result['size']:>7} {mode:<12}"
+                + "".join(f"{summary[column]:>10.3f}" for column in ("min_s", "median_s", "max_s"))
+            )
+        lines.append(f"{result['size']:>7} {'speedup':<12}{result['speedup']:>10.2f}x")
+    return "\n".join(lines)
+
+
+def format_report(report: dict) -> str:
+    columns = ["p50_ms", "p90_ms", "p99_ms", "max_ms"]
+    lines = [f"{'size':>7} {'operation':<16}" + "".join(f"{column:>12}" for column in columns)]
+    for result in report["results"]:
+        for name, summary in result["operations"].items():
+            lines.append(
+                f"{result['size']:>7} {name:<16}" + "".join(f"{summary[column]:>12.3f}" for column in columns)
+            )
+        if "memory" in result:
+            memory = result["memory"]
+            lines.append(
+                f"{result['size']:>7} {'memory':<16}"
+                f"loaded {memory['loaded_bytes'] / 2**20:.1f} MiB, peak {memory['peak_bytes'] / 2**20:.1f} MiB"
+            )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the schedule manager")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated schedule counts")
+    parser.add_argument("--repeat", type=int, default=30, help="Timed runs of each operation per size")
+    parser.add_argument(
+        "--backend",
+        choices=["cron", "none"],
+        default="cron",
+        help="cron: temporary crontab file; none: skip the execution backend",
+    )
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the tracemalloc pass")
+    parser.add_argument(
+        "--startup", action="store_true", help="Time launching a web application until its first answer"
+    )
+    parser.add_argument("--app", choices=["client", "admin"], default="client", help="Application for --startup")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Timed launches per mode with --startup")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="Print the JSON report instead of a table")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.repeat <= 0:
+        sys.exit("--repeat must be positive")
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    if args.startup:
+        report["backend"] = args.backend
+        report["runs"] = args.startup_runs
+        report["results"] = [benchmark_startup(size, args.startup_runs, args.app, args.backend) for size in sizes]
+        text = format_startup(report)
+    else:
+        report["backend"] = args.backend
+        report["repeat"] = args.repeat
+        report["results"] = [benchmark(size, args.repeat, args.backend, args.memory) for size in sizes]
+        text = format_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    print(json.dumps(report, indent=2) if args.json else text)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,12 @@
 """Command line interface for managing sensor schedules."""
 
 import argparse
-from typing import List
+import json
+import shlex
+import sys
+from typing import Iterable, List, Optional, Tuple
 
-from .services.schedule_manager import ScheduleManager
+from .services.schedule_manager import ScheduleManager, ScheduleSnapshot, cache_path, storage_path
 
 
 def parse_args() -> argparse.Namespace:
@@ -35,11 +38,85 @@ def parse_args() -> argparse.Namespace:
     parser_remove_override = subparsers.add_parser("remove_override", help="Remove sensor override")
     parser_remove_override.add_argument("sensor", help="Sensor name or comma separated list")
 
+    subparsers.add_parser("reconcile", help="Sync cron jobs with the stored schedules")
+
+    parser_lint = subparsers.add_parser("lint", help="Report overlapping schedules")
+    parser_lint.add_argument("file", nargs="?", help="Schedule file to check instead of the stored schedules")
+
+    parser_energy = subparsers.add_parser("energy", help="Simulate the power budget of the schedules")
+    parser_energy.add_argument("--days", type=int, default=90, help="Days to simulate")
+    parser_energy.add_argument("--draw", help="Power draws overriding the table, e.g. AML=3.5,UV=12")
+    parser_energy.add_argument("--table", help="JSON table of sensor power draws in watts")
+    parser_energy.add_argument("--step", type=int, default=1440, help="Minutes per series point with --json")
+    parser_energy.add_argument("--json", action="store_true", help="Print the full report as JSON")
+
+    parser_crontab = subparsers.add_parser("crontab", help="Print the cron jobs the schedules compile to")
+    parser_crontab.add_argument("--compact", action="store_true", help="Compile into as few jobs as possible")
+
+    parser_batch = subparsers.add_parser("batch", help="Apply many commands with one commit")
+    parser_batch.add_argument("file", nargs="?", help="Command file, one per line; stdin if omitted or -")
+    parser_batch.add_argument("--atomic", action="store_true", help="Apply nothing if any command fails")
+
     return parser.parse_args()
 
 
+# ----------------------------------------------------------------------
+# Batch mode
+
+
+def parse_command(line: str) -> Optional[Tuple[str, List[str]]]:
+    """Parse a JSON ``{"command": ..., "args": [...]}`` or ``command arg ...`` line.
+
+    The arguments are those of ``/execute``.  Blank and ``#`` lines give None.
+    """
+    if line.lstrip().startswith("{"):
+        document = json.loads(line)
+        if not isinstance(document, dict) or not isinstance(document.get("command"), str):
+            raise ValueError("Expected an object with a command")
+        args = document.get("args", [])
+        if not isinstance(args, list):
+            raise ValueError("args must be a list")
+        return document["command"], ["" if arg is None else str(arg) for arg in args]
+    words = shlex.split(line, comments=True)
+    if not words:
+        return None
+    return words[0], words[1:]
+
+
+def run_batch(manager: ScheduleManager, lines: Iterable[str], atomic: bool = False) -> List[dict]:
+    """Apply the commands on ``lines`` in one batch and return a result per command."""
+    results: List[dict] = []
+    commands: List[Tuple[str, List[str]]] = []
+    for number, line in enumerate(lines, 1):
+        try:
+            parsed = parse_command(line)
+        except ValueError as exc:
+            results.append({"line": number, "ok": False, "error": f"Invalid command: {exc}"})
+            continue
+        if parsed is not None:
+            results.append({"line": number, "command": parsed[0], "ok": True})
+            commands.append(parsed)
+    if atomic and not all(result["ok"] for result in results):
+        for result in results:
+            if result["ok"]:
+                result.update(ok=False, error="Not applied: invalid command in batch")
+        return results
+    pending = [result for result in results if result["ok"]]
+    for result, (ok, value) in zip(pending, manager.execute_each(commands, atomic=atomic)):
+        result["ok"] = ok
+        result["result" if ok else "error"] = value if ok else str(value) or type(value).__name__
+    return results
+
+
 def main() -> None:
     args = parse_args()
+    if args.command in ("view", "view_states"):
+        # A startup cache matching the store answers without loading it.
+        view = ScheduleSnapshot.load(cache_path(), storage_path()) or ScheduleManager()
+        print(view.query(args.command, []))
+        return
+    if args.command is None:
+        raise SystemExit("No command provided")
     manager = ScheduleManager()
     if args.command == "add":
         days = ScheduleManager._parse_days(args.days) if args.days else None
@@ -56,18 +133,48 @@ def main() -> None:
         )
     elif args.command == "remove":
         print(manager.remove_schedule(args.sensor, args.index))
-    elif args.command == "view":
-        print(manager.view_schedules())
-    elif args.command == "view_states":
-        print(manager.view_states())
     elif args.command == "override":
         sensors: List[str] = args.sensor.split(",")
         print(manager.override_sensor(sensors, args.state))
     elif args.command == "remove_override":
         sensors = args.sensor.split(",")
         print(manager.remove_override(sensors))
-    else:
-        raise SystemExit("No command provided")
+    elif args.command == "reconcile":
+        print(manager.execute("reconcile", []))
+    elif args.command == "lint":
+        conflicts = manager.lint_file(args.file) if args.file else manager.lint()
+        print(manager.format_conflicts(conflicts))
+        if conflicts:
+            raise SystemExit(1)
+    elif args.command == "energy":
+        budget = manager.energy_budget(args.days, args.draw, args.table)
+        report = budget.summary(args.step)
+        if args.json:
+            print(json.dumps(report, indent=4))
+            return
+        print(f"{report['days']} days from {report['start']}")
+        for sensor, usage in report["sensors"].items():
+            print(f"{sensor}: {usage['on_hours']} h at {usage['draw_w']} W = {usage['energy_wh']} Wh")
+        print(f"Total: {report['total_wh']} Wh, peak {report['peak_w']} W at {report['peak_at']}")
+    elif args.command == "crontab":
+        from .services.cron_backend import CronBackend
+
+        backend = CronBackend(compact=args.compact)
+        backend.bind(manager)
+        lines = backend.render_jobs()
+        print("\n".join(lines))
+        transitions = 2 * sum(len(schedules) for schedules in manager.sensors_schedule.values())
+        print(f"# {len(lines)} jobs for {transitions} schedule transitions")
+    elif args.command == "batch":
+        if args.file and args.file != "-":
+            with open(args.file) as file:
+                results = run_batch(manager, file, args.atomic)
+        else:
+            results = run_batch(manager, sys.stdin, args.atomic)
+        for result in results:
+            print(json.dumps(result))
+        if not all(result["ok"] for result in results):
+            raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -1,32 +1,35 @@
-import serial
-import time
+"""Log the AML's output while its sensor is scheduled as ``logging``.
+
+Run from the repository root::
+
+    python -m webapps.shared.scripts.LogSerialData
+"""
+
+from serial_logging.reader import SerialReader, format_line
+from serial_logging.sink import LogSink, exit_on_sigterm
 
 # Serial port settings
 serialPort = '/dev/ttyUSB0'
 baudRate = 38400
 logFilePath = 'AML.txt'
-
-def logData(data):
-    with open(logFilePath, 'a') as logFile:
-        logFile.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {data.decode('utf-8')}")
+# Start a new (gzipped) log every day and keep a year of them
+rotate = 'daily'
+backups = 365
 
 def main():
-    try:
-        # Open the serial port
-        ser = serial.Serial(serialPort, baudRate, timeout=1)
-        ser.write(b'MONITOR\r')
-        time.sleep(1)
-        # Main loop to read and log data
-        while True:
-            if ser.in_waiting > 0:
-                data = ser.readline()
-                logData(data)
-                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {data.decode('utf-8')}")
-    except KeyboardInterrupt:
-        print("Exiting...")
-    finally:
-        # Close the serial port when done
-        ser.close()
+    # The scheduler stops this script with SIGTERM; flush the log first
+    exit_on_sigterm()
+    # Open the serial port; reads block until the device sends something
+    with SerialReader(serialPort, baudRate) as reader, LogSink(logFilePath, rotate=rotate, backups=backups) as log:
+        reader.send('MONITOR')
+        try:
+            # Main loop to read and log data
+            for timestamp, data in reader:
+                line = format_line(data, timestamp)
+                log.write(line)
+                print(line, end='')
+        except KeyboardInterrupt:
+            print("Exiting...")
 
 if __name__ == "__main__":
     main()
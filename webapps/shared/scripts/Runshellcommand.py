@@ -1,17 +1,32 @@
-"""Example script for toggling relay channels using shell commands."""
+"""Example script that cycles every relay channel.
+
+Channels are switched with the ``8mosfet`` CLI, or through the I2C driver
+when ``SCHEDULER_MOSFET_CONFIG`` names its address and channel map.
+Run from the repository root::
+
+    python -m webapps.shared.scripts.Runshellcommand
+"""
 
 import os
 import time
 
+from webapps.shared.services.mosfet import CONFIG_ENV, driver_from_env
+
 COMMAND = "/home/admin/8mosfet-rpi/8mosfet 0 write {channel} {state}"
 CHANNELS = [6, 5, 4, 3, 8, 1, 2, 7]
 
-for channel in CHANNELS:
-    os.system(COMMAND.format(channel=channel, state="on"))
-    time.sleep(0.5)
+if os.getenv(CONFIG_ENV):
+    with driver_from_env() as driver:
+        driver.set_all("on", CHANNELS, stagger=0.5)
+        time.sleep(2)
+        driver.set_all("off", CHANNELS)
+else:
+    for channel in CHANNELS:
+        os.system(COMMAND.format(channel=channel, state="on"))
+        time.sleep(0.5)
 
-time.sleep(2)
+    time.sleep(2)
 
-for channel in CHANNELS:
-    os.system(COMMAND.format(channel=channel, state="off"))
-    time.sleep(0.5)
+    for channel in CHANNELS:
+        os.system(COMMAND.format(channel=channel, state="off"))
+        time.sleep(0.5)
@@ -0,0 +1,74 @@
+"""Execution backend interface used by :class:`ScheduleManager`."""
+
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:  # pragma: no cover - imported for type hints only
+    from .schedule_manager import ScheduleManager
+
+MOSFET_CLI = "/home/admin/8mosfet-rpi/8mosfet"
+
+
+class ExecutionBackend:
+    """Receive schedule mutations and make the hardware follow them.
+
+    The manager calls the ``schedule_*``/``override_*`` hooks after it has
+    updated its in-memory state and :meth:`commit` or :meth:`rollback` once
+    the surrounding batch finishes.  The base class records changes only,
+    which is what processes that leave execution to a separate scheduler
+    daemon want.
+    """
+
+    manager: Optional["ScheduleManager"] = None
+
+    def bind(self, manager: "ScheduleManager") -> None:
+        self.manager = manager
+
+    def schedule_added(self, sensor: str, schedule: dict) -> None:
+        pass
+
+    def schedule_removed(self, sensor: str, schedule: dict) -> None:
+        pass
+
+    def override_set(self, sensor: str, state: str) -> None:
+        pass
+
+    def override_removed(self, sensor: str) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def reconcile(self) -> Dict[str, int]:
+        """Make the execution side match the manager's state; return change counts."""
+        return {}
+
+
+def backend_from_env() -> ExecutionBackend:
+    """Return the backend selected by ``SCHEDULER_BACKEND``.
+
+    ``cron`` (the default) installs cron jobs; ``daemon`` only records
+    changes and leaves execution to ``scheduler_daemon``.  Setting
+    ``SCHEDULER_DRIVER=i2c`` lets the cron backend apply overrides through
+    a persistent :class:`~.mosfet.MosfetDriver` configured by
+    ``SCHEDULER_MOSFET_CONFIG``, and
+    ``SCHEDULER_CRON_COMPACT=1`` compiles the schedules into as few cron
+    jobs as possible.  ``SCHEDULER_CRONTAB`` points the cron backend at a
+    plain file instead of the user crontab.
+    """
+    name = os.getenv("SCHEDULER_BACKEND", "cron")
+    if name == "cron":
+        from .cron_backend import CronBackend
+        from .mosfet import driver_from_env
+
+        driver = driver_from_env() if os.getenv("SCHEDULER_DRIVER") == "i2c" else None
+        compact = os.getenv("SCHEDULER_CRON_COMPACT") == "1"
+        return CronBackend(tabfile=os.getenv("SCHEDULER_CRONTAB"), driver=driver, compact=compact)
+    if name == "daemon":
+        return ExecutionBackend()
+    raise ValueError(f"Unknown scheduler backend: {name}")
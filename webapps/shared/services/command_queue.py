@@ -0,0 +1,247 @@
+"""Single-writer command queue that keeps blocking work off the event loop.
+
+The web applications hand every mutation to a :class:`CommandQueue`.  One
+worker runs them on a dedicated thread, so crontab writes and fsyncs never
+block request handling and the manager is only ever mutated from one
+thread.  Commands that queue up while the worker is busy are applied
+together in one :meth:`ScheduleManager.batch`; a command that is
+rejected fails on its own and the rest still commit together.  Reads are
+answered from :attr:`CommandQueue.snapshot`, an immutable copy replaced
+after each write.
+
+Every ``poll`` seconds the worker also picks up changes other processes
+(the other web application, the CLI) made to the shared schedule store.
+Callbacks registered with :meth:`CommandQueue.subscribe` are told about
+every change once its snapshot is published.
+
+For a fast start the queue can be given a function creating the manager
+and a snapshot loaded from the startup cache (see
+:meth:`ScheduleSnapshot.load`).  Reads are then answered from the cached
+snapshot at once.  The manager is created on the writer thread by the
+first job, or ``poll`` seconds after the start, when the first requests
+have been answered; ``on_open`` is then called with it.  With ``cache``
+set, the snapshot is saved there again whenever it changed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+from .schedule_manager import ScheduleManager, ScheduleSnapshot
+
+logger = logging.getLogger(__name__)
+
+# (command, args) for manager commands, (None, callable) for arbitrary work,
+# with the context of the submitter so trace spans follow the work.
+Job = Tuple[Optional[str], Any, "asyncio.Future[Any]", contextvars.Context]
+Outcome = Tuple[bool, Any]
+# The operations applied since the last snapshot, ``None`` for a reload.
+Changes = List[Optional[List[dict]]]
+Subscriber = Callable[[ScheduleSnapshot, Changes], None]
+
+
+class CommandQueue:
+    """Serialize the mutations of ``manager`` through one worker."""
+
+    def __init__(
+        self,
+        manager: Union[ScheduleManager, Callable[[], ScheduleManager]],
+        max_batch: int = 64,
+        poll: float = 1.0,
+        snapshot: Optional[ScheduleSnapshot] = None,
+        cache: Optional[Path] = None,
+        on_open: Optional[Callable[[ScheduleManager], Any]] = None,
+    ) -> None:
+        self.max_batch = max_batch
+        self.poll = poll
+        self.cache = cache
+        self.on_open = on_open
+        self._factory: Optional[Callable[[], ScheduleManager]] = None
+        if isinstance(manager, ScheduleManager):
+            self.manager = manager
+            self.snapshot: ScheduleSnapshot = manager.snapshot()
+        else:
+            if snapshot is None:
+                raise ValueError("A manager created lazily needs a snapshot to serve meanwhile")
+            self._factory = manager
+            self.snapshot = snapshot
+        self._saved_stamp = snapshot.stamp if snapshot is not None else None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="schedule-writer")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._held: Optional[Job] = None
+        self._changes: Changes = []
+        self._subscribers: List[Subscriber] = []
+        self._opener: Optional[asyncio.Task] = None
+        if self._factory is None:
+            self.manager.add_listener(self._changes.append)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    async def start(self) -> None:
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._serve())
+            if self._factory is not None:
+                self._opener = asyncio.create_task(self._open())
+            if self.poll:
+                self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        """Finish the queued work, then stop the worker."""
+        if self._worker is None:
+            return
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        await self._queue.join()
+        if self.cache is not None and self.opened:
+            await self.run(self._save_cache)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._executor.shutdown(wait=True)
+
+    @property
+    def opened(self) -> bool:
+        """Whether :attr:`manager` exists yet."""
+        return self._factory is None
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        """Call ``subscriber(snapshot, changes)`` on the event loop after each change."""
+        self._subscribers.append(subscriber)
+
+    # ------------------------------------------------------------------
+    # Submitting work
+    async def execute(self, command: str, args: Sequence[str]) -> str:
+        """Queue ``manager.execute(command, args)`` and return its result."""
+        return await self._submit(command, list(args))
+
+    async def run(self, func: Callable[[], Any]) -> Any:
+        """Run ``func`` on the writer thread, alone, and return its result."""
+        return await self._submit(None, func)
+
+    async def _submit(self, command: Optional[str], payload: Any) -> Any:
+        if self._worker is None:
+            raise RuntimeError("CommandQueue is not started")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((command, payload, future, contextvars.copy_context()))
+        return await future
+
+    # ------------------------------------------------------------------
+    # Worker
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._held is not None:
+                jobs, self._held = [self._held], None
+            else:
+                jobs = [await self._queue.get()]
+            # Back-to-back commands are coalesced; arbitrary work runs alone.
+            while jobs[0][0] is not None and len(jobs) < self.max_batch and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job[0] is None:
+                    self._held = job
+                    break
+                jobs.append(job)
+            try:
+                outcomes, changes = await loop.run_in_executor(self._executor, self._apply, jobs)
+            except Exception as exc:  # creating the manager failed; retried with the next job
+                outcomes, changes = [(False, exc)] * len(jobs), []
+            if changes:
+                for subscriber in self._subscribers:
+                    try:
+                        subscriber(self.snapshot, changes)
+                    except Exception:
+                        logger.exception("Schedule change subscriber failed")
+            for (_, _, future, _), (ok, value) in zip(jobs, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for _ in jobs:
+                self._queue.task_done()
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                await self.run(self._refresh)
+            except Exception:
+                logger.exception("Failed to refresh the schedule store")
+
+    async def _open(self) -> None:
+        await asyncio.sleep(self.poll)
+        try:
+            # _apply creates the manager before running anything.
+            await self.run(lambda: None)
+        except Exception:
+            logger.exception("Failed to open the schedule store")
+
+    def _ensure_manager(self) -> None:
+        """Create the manager on the writer thread, if that is still to do."""
+        if self._factory is None:
+            return
+        manager = self._factory()
+        self._factory = None
+        self.manager = manager
+        manager.add_listener(self._changes.append)
+        if manager.version != self.snapshot.version:
+            self._changes.append(None)
+        logger.info("Opened the schedule store at revision %d", manager.revision)
+        if self.on_open is not None:
+            try:
+                self.on_open(manager)
+            except Exception:
+                logger.exception("Schedule store open callback failed")
+
+    def _refresh(self) -> None:
+        self.manager.refresh()
+        if self.cache is not None:
+            self._save_cache()
+
+    def _save_cache(self) -> None:
+        if self.manager.version != self.snapshot.version:
+            self.snapshot = self.manager.snapshot()
+        snapshot = self.snapshot
+        if snapshot.stamp != self._saved_stamp:
+            snapshot.save(self.cache)
+            self._saved_stamp = snapshot.stamp
+
+    def _apply(self, jobs: List[Job]) -> Tuple[List[Outcome], Changes]:
+        """Apply ``jobs`` on the writer thread and publish a new snapshot."""
+        self._ensure_manager()
+        command, payload, _, context = jobs[0]
+        if command is None:
+            outcomes = [context.run(self._call, payload)]
+        elif len(jobs) == 1:
+            outcomes = [context.run(self._call, lambda: self.manager.execute(command, payload))]
+        else:
+            # Rejected commands are skipped inside the batch, without a
+            # rollback, so only their own submitters see the error.
+            commands = [(command, args) for command, args, _, _ in jobs]
+            ok, value = context.run(self._call, lambda: self.manager.execute_each(commands))
+            outcomes = value if ok else [(False, value)] * len(jobs)
+            logger.debug("Applied %d coalesced commands", len(jobs))
+        if self.manager.version != self.snapshot.version:
+            self.snapshot = self.manager.snapshot()
+        changes, self._changes[:] = list(self._changes), []
+        return outcomes, changes
+
+    @staticmethod
+    def _call(func: Callable[[], Any]) -> Outcome:
+        try:
+            return True, func()
+        except Exception as exc:
+            return False, exc
@@ -0,0 +1,240 @@
+"""Per-channel overlap detection for schedule windows.
+
+Two schedules conflict when they drive the same MOSFET channel during
+the same minute of the same day: the end job of one switches the channel
+off while the other still expects it to be on.  Schedules are compared
+through their weekly :class:`~.timeline.Window` pieces, and two pieces
+that overlap within the week only conflict if their date bounds
+(``date``/``end_repeat``) share a day on which both fall.
+"""
+
+from __future__ import annotations
+
+import bisect
+import datetime
+import heapq
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .timeline import MINUTES_PER_DAY, Window, cron_weekday, schedule_windows
+
+DAY_NAMES = ("Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat")
+
+Piece = Tuple[int, int, str, Window]
+
+
+@dataclass(frozen=True)
+class Conflict:
+    """Two schedules on ``channel`` overlapping from ``start`` to ``end`` on ``day``.
+
+    ``day`` is the cron day of week and ``start``/``end`` are minutes of
+    that day.
+    """
+
+    channel: int
+    sensor: str
+    schedule_id: int
+    other_sensor: str
+    other_id: int
+    day: int
+    start: int
+    end: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.sensor} #{self.schedule_id} overlaps {self.other_sensor} #{self.other_id} "
+            f"on channel {self.channel} ({DAY_NAMES[self.day]} "
+            f"{_hhmm(self.start)}-{_hhmm(self.end)})"
+        )
+
+
+def _hhmm(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def _active_dates(
+    window: Window, today: datetime.date
+) -> Tuple[datetime.date, Optional[datetime.date]]:
+    """Return the calendar dates from ``today`` on which ``window`` can be active."""
+    offset = datetime.timedelta(days=window.offset)
+    first = today if window.first is None else max(window.first + offset, today)
+    last = None if window.last is None else window.last + offset
+    return first, last
+
+
+def _live(window: Window, today: datetime.date) -> bool:
+    first, last = _active_dates(window, today)
+    return last is None or last >= first
+
+
+def _share_day(a: Window, b: Window, day: int, today: datetime.date) -> bool:
+    """Return whether ``a`` and ``b`` are both active on some date falling on ``day``."""
+    first_a, last_a = _active_dates(a, today)
+    first_b, last_b = _active_dates(b, today)
+    first = max(first_a, first_b)
+    lasts = [last for last in (last_a, last_b) if last is not None]
+    if not lasts:
+        return True
+    last = min(lasts)
+    if (last - first).days >= 6:
+        return True
+    date = first
+    while date <= last:
+        if cron_weekday(date) == day:
+            return True
+        date += datetime.timedelta(days=1)
+    return False
+
+
+def _conflict(channel: int, piece: Piece, other: Piece, today: datetime.date) -> Optional[Conflict]:
+    start = max(piece[0], other[0])
+    end = min(piece[1], other[1])
+    if start >= end:
+        return None
+    day = start // MINUTES_PER_DAY
+    if not _share_day(piece[3], other[3], day, today):
+        return None
+    base = day * MINUTES_PER_DAY
+    return Conflict(
+        channel,
+        piece[2],
+        piece[3].schedule["id"],
+        other[2],
+        other[3].schedule["id"],
+        day,
+        start - base,
+        end - base,
+    )
+
+
+def _pieces(sensor: str, schedule: dict, today: datetime.date) -> Iterator[Piece]:
+    for window in schedule_windows(schedule):
+        if _live(window, today):
+            yield window.start, window.end, sensor, window
+
+
+def lint_plan(
+    schedules: Dict[str, List[dict]],
+    channels: Dict[str, int],
+    today: Optional[datetime.date] = None,
+) -> List[Conflict]:
+    """Return every conflict in ``schedules`` from ``today`` on.
+
+    The weekly pieces of each channel are swept in start order while a heap
+    keeps the pieces still running, so only pieces that actually overlap
+    are compared.
+    """
+    today = today or datetime.date.today()
+    by_channel: Dict[int, List[Piece]] = {}
+    for sensor, sensor_schedules in schedules.items():
+        channel = channels.get(sensor)
+        if channel is None:
+            continue
+        pieces = by_channel.setdefault(channel, [])
+        for schedule in sensor_schedules:
+            pieces.extend(_pieces(sensor, schedule, today))
+    conflicts: List[Conflict] = []
+    counter = itertools.count()
+    for channel, pieces in sorted(by_channel.items()):
+        pieces.sort(key=lambda piece: piece[:2])
+        running: List[Tuple[int, int, Piece]] = []
+        for piece in pieces:
+            while running and running[0][0] <= piece[0]:
+                heapq.heappop(running)
+            for _, _, other in running:
+                conflict = _conflict(channel, other, piece, today)
+                if conflict is not None:
+                    conflicts.append(conflict)
+            heapq.heappush(running, (piece[1], next(counter), piece))
+    return conflicts
+
+
+class ChannelIndex:
+    """Weekly pieces of one channel sorted by start minute.
+
+    Pieces never exceed a day, so the pieces overlapping a query can only
+    start between ``query.start - longest`` and ``query.end``.
+    """
+
+    def __init__(self) -> None:
+        self._starts: List[int] = []
+        self._pieces: List[Piece] = []
+        self._longest = 0
+
+    def add(self, piece: Piece) -> None:
+        position = bisect.bisect_right(self._starts, piece[0])
+        self._starts.insert(position, piece[0])
+        self._pieces.insert(position, piece)
+        self._longest = max(self._longest, piece[1] - piece[0])
+
+    def remove(self, sensor: str, schedule_id: int) -> None:
+        keep = [
+            index
+            for index, piece in enumerate(self._pieces)
+            if piece[2] != sensor or piece[3].schedule["id"] != schedule_id
+        ]
+        self._starts = [self._starts[index] for index in keep]
+        self._pieces = [self._pieces[index] for index in keep]
+
+    def overlapping(self, piece: Piece) -> Iterator[Piece]:
+        first = bisect.bisect_right(self._starts, piece[0] - self._longest)
+        last = bisect.bisect_left(self._starts, piece[1])
+        for other in self._pieces[first:last]:
+            if other[1] > piece[0]:
+                yield other
+
+
+class ConflictIndex:
+    """Lazily built :class:`ChannelIndex` for every channel.
+
+    Like :class:`~.timeline.Timeline`, ``schedules`` is the live mapping
+    owned by the schedule manager, which reports each change through
+    :meth:`added`/:meth:`removed` or calls :meth:`invalidate`.
+    """
+
+    def __init__(self, schedules: Dict[str, List[dict]], channels: Dict[str, int]) -> None:
+        self._schedules = schedules
+        self._channels = channels
+        self._index: Dict[int, ChannelIndex] = {}
+
+    def invalidate(self) -> None:
+        self._index.clear()
+
+    def channel(self, channel: int) -> ChannelIndex:
+        index = self._index.get(channel)
+        if index is None:
+            index = ChannelIndex()
+            today = datetime.date.today()
+            for sensor, sensor_channel in self._channels.items():
+                if sensor_channel != channel:
+                    continue
+                for schedule in self._schedules.get(sensor, []):
+                    for piece in _pieces(sensor, schedule, today):
+                        index.add(piece)
+            self._index[channel] = index
+        return index
+
+    def check(self, sensor: str, schedule: dict, today: Optional[datetime.date] = None) -> List[Conflict]:
+        """Return the conflicts ``schedule`` would introduce for ``sensor``."""
+        today = today or datetime.date.today()
+        channel = self._channels[sensor]
+        index = self.channel(channel)
+        conflicts = []
+        for piece in _pieces(sensor, schedule, today):
+            for other in index.overlapping(piece):
+                conflict = _conflict(channel, piece, other, today)
+                if conflict is not None:
+                    conflicts.append(conflict)
+        return conflicts
+
+    def added(self, sensor: str, schedule: dict) -> None:
+        index = self._index.get(self._channels[sensor])
+        if index is not None:
+            for piece in _pieces(sensor, schedule, datetime.date.today()):
+                index.add(piece)
+
+    def removed(self, sensor: str, schedule: dict) -> None:
+        index = self._index.get(self._channels[sensor])
+        if index is not None:
+            index.remove(sensor, schedule["id"])
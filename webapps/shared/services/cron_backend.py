@@ -0,0 +1,372 @@
+"""Cron based execution backend."""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import re
+import shlex
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from crontab import CronTab
+
+from .backend import MOSFET_CLI, ExecutionBackend
+from .cron_compiler import CronTransition, compile_jobs
+from .metrics import instrument, timed
+from .mosfet import MosfetDriver
+from .schedule_manager import DEFAULT_STORAGE
+
+MANAGED_PREFIXES = ("sensor_", "override_")
+HOUSEKEEPING_TAG = "sensor_reconcile"
+# Daily pass that retires expired one-off and end_repeat schedules.
+HOUSEKEEPING_TIME = "5 0 * * *"
+COMPACT_PREFIX = "sensor_group_"
+JOB_LINE = re.compile(
+    r"^(?P<disabled>#\s*)?(?P<time>@\w+|(?:\S+\s+){4}\S+)\s+(?P<command>.+?)"
+    r"\s+#\s*(?P<tag>(?:sensor|override)_\S+)\s*$"
+)
+
+# python-crontab writes these aliases in place of their expansions.
+SPECIALS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+
+def _normalize_time(time: str) -> str:
+    return SPECIALS.get(time, " ".join(time.split()))
+
+
+def _render(tag: str, time: str, command: str, enabled: bool) -> str:
+    """Return the crontab line python-crontab would write for this job."""
+    return f"{'' if enabled else '# '}{time} {command} # {tag}"
+
+
+class CronBackend(ExecutionBackend):
+    """Install one cron job per schedule transition in the user crontab.
+
+    All hooks issued between two :meth:`commit` calls share one crontab
+    read and one write.  ``tabfile`` points the backend at a plain file
+    instead of the user crontab.  With a ``driver`` overrides are also
+    applied to the hardware right away, all channels in one register
+    write, instead of waiting for the next run of the override job.
+
+    With ``compact`` the schedules are compiled into as few jobs as
+    possible by :func:`~.cron_compiler.compile_jobs`.  Compiled jobs cannot
+    be patched per schedule, so each commit that changed anything
+    reconciles the whole crontab instead.
+    """
+
+    def __init__(
+        self,
+        tabfile: Optional[str] = None,
+        driver: Optional[MosfetDriver] = None,
+        compact: bool = False,
+    ) -> None:
+        self.tabfile = tabfile
+        self.driver = driver
+        self.compact = compact
+        self._cron: Optional[CronTab] = None
+        self._dirty = False
+        self._stale = False
+        self._overridden: Dict[str, Optional[str]] = {}
+
+    # ------------------------------------------------------------------
+    # Crontab session
+    @instrument("crontab_read")
+    def _open(self) -> CronTab:
+        if self.tabfile:
+            try:
+                return CronTab(tabfile=self.tabfile)
+            except FileNotFoundError:
+                # A missing tab file is empty, as in _read_text.
+                cron = CronTab()
+                cron.write(self.tabfile)
+                return cron
+        return CronTab(user=True)
+
+    def _crontab(self) -> CronTab:
+        """Return the crontab shared by the current batch."""
+        if self._cron is None:
+            self._cron = self._open()
+        return self._cron
+
+    def commit(self) -> None:
+        cron, self._cron = self._cron, None
+        if cron is not None and self._dirty:
+            with timed("crontab_write"):
+                cron.write()
+        self._dirty = False
+        overridden, self._overridden = self._overridden, {}
+        if self.driver is not None and overridden:
+            self._apply_now(overridden)
+        stale, self._stale = self._stale, False
+        if stale:
+            self.reconcile()
+
+    def rollback(self) -> None:
+        self._cron = None
+        self._dirty = False
+        self._stale = False
+        self._overridden = {}
+
+    def _apply_now(self, overridden: Dict[str, Optional[str]]) -> None:
+        channels = {}
+        for sensor, state in overridden.items():
+            if state is None:
+                state, _ = self.manager.state_at(sensor)
+            if state != "logging":
+                channels[self.manager.sensors_channels[sensor]] = state
+        if channels:
+            self.driver.apply(channels)
+
+    # ------------------------------------------------------------------
+    # Job derivation
+    def _command(self, sensor: str, state: str, verb: str = "in state") -> str:
+        if state == "logging":
+            return (
+                f'echo "Sensor {sensor} is now logging" '
+                f"&& cd {self.manager.scripts_dir.parents[2]} "
+                "&& python -m webapps.shared.scripts.LogSerialData"
+            )
+        channel = self.manager.sensors_channels[sensor]
+        return (
+            f'echo "Sensor {sensor} is now {verb} {state}" '
+            f"&& {MOSFET_CLI} 0 write {channel} {state}"
+        )
+
+    def _schedule_jobs(
+        self, sensor: str, schedule: dict, today: datetime.date
+    ) -> Optional[List[Tuple[str, str, str]]]:
+        """Return ``(tag, time, command)`` for the start and end jobs of ``schedule``.
+
+        Schedules that can no longer fire yield no jobs.  ``None`` means the
+        jobs cannot be derived (one-off schedules stored before their date
+        was recorded), in which case existing jobs are left alone.
+        """
+        start_hours, start_minutes = (int(part) for part in schedule["start"].split(":"))
+        end_hours, end_minutes = (int(part) for part in schedule["end"].split(":"))
+        if (start_hours, start_minutes) == (end_hours, end_minutes):
+            return []
+        overnight = (end_hours, end_minutes) < (start_hours, start_minutes)
+        days = schedule.get("days")
+        end_repeat = schedule.get("end_repeat")
+
+        start_fields = end_fields = "* * *"
+        if not schedule.get("repeat"):
+            if not schedule.get("date"):
+                return None
+            occurrence = datetime.date.fromisoformat(schedule["date"])
+            last = occurrence + datetime.timedelta(days=1) if overnight else occurrence
+            if last < today:
+                return []
+            start_fields = f"{occurrence.day} {occurrence.month} *"
+            end_fields = f"{last.day} {last.month} *"
+        else:
+            months = "*"
+            if end_repeat:
+                end_date = datetime.date.fromisoformat(end_repeat)
+                if end_date < today:
+                    return []
+                if end_date.year == today.year and (today.month, end_date.month) != (1, 12):
+                    months = str(today.month) if today.month == end_date.month else f"{today.month}-{end_date.month}"
+            start_days = end_days = "*"
+            if days and len(set(days)) < 7:
+                start_days = ",".join(str(day) for day in sorted(days))
+                shift = 1 if overnight else 0
+                end_days = ",".join(str((day + shift) % 7) for day in sorted(days))
+            start_fields = f"* {months} {start_days}"
+            end_fields = f"* {months} {end_days}"
+        return [
+            (
+                f"sensor_{sensor}_schedule_{schedule['id']}_start",
+                f"{start_minutes} {start_hours} {start_fields}",
+                self._command(sensor, schedule["state"]),
+            ),
+            (
+                f"sensor_{sensor}_schedule_{schedule['id']}_end",
+                f"{end_minutes} {end_hours} {end_fields}",
+                self._command(sensor, "off"),
+            ),
+        ]
+
+    def desired_jobs(self) -> Dict[str, Optional[Tuple[str, str, bool]]]:
+        """Return the ``(time, command, enabled)`` each managed tag should have.
+
+        A ``None`` entry marks a tag whose existing job must be kept as is.
+        Compiled jobs are tagged with a digest of their time and command, so
+        unchanged jobs keep their lines.  Schedules of overridden sensors
+        are left out of them rather than disabled.
+        """
+        today = datetime.date.today()
+        jobs: Dict[str, Optional[Tuple[str, str, bool]]] = {
+            HOUSEKEEPING_TAG: (HOUSEKEEPING_TIME, self._housekeeping_command(), True)
+        }
+        transitions: List[CronTransition] = []
+        for sensor, schedules in self.manager.sensors_schedule.items():
+            override = self.manager.sensors_override.get(sensor)
+            for schedule in schedules:
+                derived = self._schedule_jobs(sensor, schedule, today)
+                if derived is None:
+                    jobs[f"sensor_{sensor}_schedule_{schedule['id']}_start"] = None
+                    jobs[f"sensor_{sensor}_schedule_{schedule['id']}_end"] = None
+                    continue
+                if not self.compact:
+                    for tag, time, command in derived:
+                        jobs[tag] = (time, command, not override)
+                elif derived and not override:
+                    (_, start, start_command), (_, end, end_command) = derived
+                    logging = schedule["state"] == "logging"
+                    transitions.append(CronTransition(start, start_command, order=1, solo=logging))
+                    transitions.append(CronTransition(end, end_command, order=0))
+            if override:
+                command = self._command(sensor, override, "overridden to state")
+                jobs[f"override_{sensor}"] = ("* * * * *", command, True)
+        for time, command in compile_jobs(transitions):
+            digest = hashlib.sha1(f"{time} {command}".encode()).hexdigest()[:12]
+            jobs[f"{COMPACT_PREFIX}{digest}"] = (time, command, True)
+        return jobs
+
+    def render_jobs(self) -> List[str]:
+        """Return the crontab lines :meth:`desired_jobs` describes."""
+        return [_render(tag, *spec) for tag, spec in self.desired_jobs().items() if spec is not None]
+
+    def _housekeeping_command(self) -> str:
+        root = self.manager.scripts_dir.parents[2]
+        env = "SCHEDULER_CRON_COMPACT=1 " if self.compact else ""
+        # The nightly reconcile must find the same store and crontab.
+        if self.manager.storage_file != DEFAULT_STORAGE:
+            env += f"SCHEDULER_STORAGE={shlex.quote(str(self.manager.storage_file))} "
+        if self.tabfile:
+            env += f"SCHEDULER_CRONTAB={shlex.quote(str(self.tabfile))} "
+        return f"cd {root} && {env}python -m webapps.shared.cli reconcile"
+
+    # ------------------------------------------------------------------
+    # Cron helpers
+    @instrument("crontab_add_job")
+    def _add_crontab_job(self, tag: str, time: str, command: str, enabled: bool = True) -> None:
+        job = self._crontab().new(command=command, comment=tag)
+        job.setall(time)
+        job.enable(enabled)
+        self._dirty = True
+
+    def schedule_added(self, sensor: str, schedule: dict) -> None:
+        """Create the start and end cron jobs for ``schedule``."""
+        if self.compact:
+            self._stale = True
+            return
+        enabled = not self.manager.sensors_override.get(sensor)
+        for tag, time, command in self._schedule_jobs(sensor, schedule, datetime.date.today()) or []:
+            self._add_crontab_job(tag, time, command, enabled)
+
+    def schedule_removed(self, sensor: str, schedule: dict) -> None:
+        if self.compact:
+            self._stale = True
+            return
+        cron = self._crontab()
+        cron.remove_all(comment=f"sensor_{sensor}_schedule_{schedule['id']}_start")
+        cron.remove_all(comment=f"sensor_{sensor}_schedule_{schedule['id']}_end")
+        self._dirty = True
+
+    def override_set(self, sensor: str, state: str) -> None:
+        self._overridden[sensor] = state
+        if self.compact:
+            self._stale = True
+            return
+        cron = self._crontab()
+        for job in cron.find_comment(re.compile(f"^sensor_{re.escape(sensor)}_schedule_")):
+            job.enable(False)
+        cron.remove_all(comment=f"override_{sensor}")
+        command = self._command(sensor, state, "overridden to state")
+        self._add_crontab_job(f"override_{sensor}", "* * * * *", command)
+
+    def override_removed(self, sensor: str) -> None:
+        self._overridden[sensor] = None
+        if self.compact:
+            self._stale = True
+            return
+        cron = self._crontab()
+        cron.remove_all(comment=f"override_{sensor}")
+        for job in cron.find_comment(re.compile(f"^sensor_{re.escape(sensor)}_schedule_")):
+            job.enable(True)
+        self._dirty = True
+
+    # ------------------------------------------------------------------
+    # Reconciliation
+    @instrument("crontab_read")
+    def _read_text(self) -> str:
+        if self.tabfile:
+            try:
+                with open(self.tabfile, "r") as file:
+                    return file.read()
+            except FileNotFoundError:
+                return ""
+        result = subprocess.run(["crontab", "-l"], capture_output=True, text=True)
+        return result.stdout if result.returncode == 0 else ""
+
+    @instrument("crontab_write")
+    def _write_text(self, text: str) -> None:
+        if self.tabfile:
+            with open(self.tabfile, "w") as file:
+                file.write(text)
+            return
+        subprocess.run(["crontab", "-"], input=text, text=True, check=True)
+
+    def reconcile(self) -> Dict[str, int]:
+        """Bring the managed crontab jobs in line with the schedule store.
+
+        Only the difference between :meth:`desired_jobs` and the jobs
+        tagged ``sensor_*``/``override_*`` is applied.  The crontab is read
+        and diffed as plain text, so other jobs are left byte-for-byte
+        untouched, and it is written once, only if something changed.
+        """
+        self.commit()
+        desired = self.desired_jobs()
+        counts = {"added": 0, "removed": 0, "updated": 0, "toggled": 0}
+        seen = set()
+        lines = []
+        for line in self._read_text().splitlines():
+            match = JOB_LINE.match(line)
+            if match is None:
+                lines.append(line)
+                continue
+            tag = match["tag"]
+            if tag not in desired or tag in seen:
+                counts["removed"] += 1
+                continue
+            seen.add(tag)
+            spec = desired[tag]
+            if spec is None:
+                lines.append(line)
+                continue
+            time, command, enabled = spec
+            if _normalize_time(match["time"]) != time or match["command"] != command:
+                counts["updated"] += 1
+            elif bool(match["disabled"]) == enabled:
+                counts["toggled"] += 1
+            else:
+                lines.append(line)
+                continue
+            lines.append(_render(tag, *spec))
+        for tag, spec in desired.items():
+            if tag not in seen and spec is not None:
+                lines.append(_render(tag, *spec))
+                counts["added"] += 1
+        if any(counts.values()):
+            self._write_text("\n".join(lines) + "\n")
+        return counts
+
+    def clear(self) -> None:
+        """Remove every job installed by this backend."""
+        cron = self._crontab()
+        for job in list(cron):
+            if job.comment.startswith(MANAGED_PREFIXES):
+                cron.remove(job)
+        self._dirty = True
+        self.commit()
@@ -0,0 +1,128 @@
+"""Compile schedule transitions into a minimal set of cron jobs.
+
+Every schedule normally owns a start and an end job.  A plan of short
+duty cycles (five minutes on every hour, say) then becomes dozens of
+lines, and transitions falling on the same minute each spawn their own
+shell.  :func:`compile_jobs` instead:
+
+1. expands each transition into the ``(minute, hour, weekday)`` points it
+   fires at, per day-of-month and month field;
+2. groups the points by the exact set of commands due at them, so
+   simultaneous transitions share one job;
+3. covers each group with as few ``minutes hours * * weekdays``
+   products as grouping by weekday and minute sets allows, written with
+   ranges, steps and lists.
+
+Every job fires exactly at the points of its group, so the compiled
+crontab switches the same channels at the same minutes as the one job per
+transition form.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+ALL_WEEKDAYS = frozenset(range(7))
+FIELD_RANGES = {"minute": (0, 59), "hour": (0, 23), "weekday": (0, 6)}
+
+
+@dataclass(frozen=True)
+class CronTransition:
+    """One cron job of the uncompiled form.
+
+    ``order`` sorts the commands of a grouped job, so channels switched off
+    at a minute are switched off before others are switched on.  ``solo``
+    commands do not return promptly (serial logging) and are never grouped.
+    """
+
+    time: str
+    command: str
+    order: int = 0
+    solo: bool = False
+
+
+def format_field(values: Iterable[int], name: str) -> str:
+    """Return the shortest cron field for ``values`` among ``*``, a step or a list."""
+    low, high = FIELD_RANGES[name]
+    values = sorted(set(values))
+    if values == list(range(low, high + 1)):
+        return "*"
+    candidates = [_list_field(values)]
+    if len(values) >= 3:
+        step = values[1] - values[0]
+        if all(b - a == step for a, b in zip(values, values[1:])):
+            if values[0] == low and values[-1] + step > high:
+                candidates.append(f"*/{step}")
+            else:
+                candidates.append(f"{values[0]}-{values[-1]}/{step}")
+    return min(candidates, key=len)
+
+
+def _list_field(values: List[int]) -> str:
+    parts = []
+    start = previous = values[0]
+    for value in values[1:] + [None]:
+        if value is not None and value == previous + 1:
+            previous = value
+            continue
+        if previous - start >= 2:
+            parts.append(f"{start}-{previous}")
+        else:
+            parts.extend(str(item) for item in range(start, previous + 1))
+        if value is not None:
+            start = previous = value
+    return ",".join(parts)
+
+
+def _points(time: str) -> Tuple[Tuple[str, str], List[Tuple[int, int, int]]]:
+    """Split a ``minute hour dom month weekday`` time into its calendar key and points."""
+    minute, hour, dom, month, weekday = time.split()
+    weekdays = ALL_WEEKDAYS if weekday == "*" else {int(day) for day in weekday.split(",")}
+    return (dom, month), [(int(minute), int(hour), day) for day in sorted(weekdays)]
+
+
+def _cover(points: Set[Tuple[int, int, int]]) -> List[Tuple[FrozenSet[int], FrozenSet[int], FrozenSet[int]]]:
+    """Partition ``points`` into ``minutes x hours x weekdays`` products."""
+    weekdays: Dict[Tuple[int, int], Set[int]] = {}
+    for minute, hour, day in points:
+        weekdays.setdefault((minute, hour), set()).add(day)
+    minutes: Dict[Tuple[int, FrozenSet[int]], Set[int]] = {}
+    for (minute, hour), days in weekdays.items():
+        minutes.setdefault((hour, frozenset(days)), set()).add(minute)
+    hours: Dict[Tuple[FrozenSet[int], FrozenSet[int]], Set[int]] = {}
+    for (hour, days), mins in minutes.items():
+        hours.setdefault((frozenset(mins), days), set()).add(hour)
+    return [(mins, frozenset(hrs), days) for (mins, days), hrs in hours.items()]
+
+
+def compile_jobs(transitions: Iterable[CronTransition]) -> List[Tuple[str, str]]:
+    """Return ``(time, command)`` jobs firing exactly the given transitions."""
+    order: Dict[str, Tuple[int, str]] = {}
+    due: Dict[Tuple[Tuple[str, str], Tuple[int, int, int]], Set[str]] = {}
+    solo: List[Tuple[str, str]] = []
+    for transition in transitions:
+        if transition.solo:
+            solo.append((transition.time, transition.command))
+            continue
+        order[transition.command] = (transition.order, transition.command)
+        calendar, points = _points(transition.time)
+        for point in points:
+            due.setdefault((calendar, point), set()).add(transition.command)
+
+    groups: Dict[Tuple[FrozenSet[str], Tuple[str, str]], Set[Tuple[int, int, int]]] = {}
+    for (calendar, point), commands in due.items():
+        groups.setdefault((frozenset(commands), calendar), set()).add(point)
+
+    jobs = []
+    for (commands, (dom, month)), points in groups.items():
+        command = " ; ".join(sorted(commands, key=order.__getitem__))
+        for minutes, hours, days in _cover(points):
+            weekday = format_field(days, "weekday")
+            # cron ORs restricted day-of-month and weekday fields.
+            if dom != "*" and weekday != "*":  # pragma: no cover - not produced by the backend
+                raise ValueError("Cannot compile a job restricting both day of month and weekday")
+            fields = (format_field(minutes, "minute"), format_field(hours, "hour"), dom, month, weekday)
+            jobs.append((" ".join(fields), command))
+    jobs.extend(solo)
+    return sorted(set(jobs))
@@ -0,0 +1,473 @@
+"""Push schedule revisions from the DURIP computer to testbed nodes over TCP.
+
+The hub follows the shared schedule store like the web applications do and
+keeps the journal operations of its recent revisions.  It holds one
+connection per node and sends each node only the operations since the
+revision that node last acknowledged, all of them in one message, so a
+node catching up applies them with one crontab write.  Nodes are served
+concurrently; a slow or unreachable node delays no other.
+
+Each node runs a :class:`NodeServer` next to its own schedule store and
+applies what it receives with :meth:`ScheduleManager.apply_ops`.  The
+last revision it applied is kept in ``sensor_schedule.sync`` beside the
+store, so after a dropped link, or a node restart, the hub resumes from
+there.  A node that cannot be caught up with operations (the hub
+restarted, the store was replaced, the node diverged) is sent the whole
+state instead.
+
+Messages are JSON lines.  The hub opens with ``hello`` (carrying the
+shared ``token``, if one is set); the node answers with its ``cursor``,
+then acknowledges every ``sync`` or ``full`` message with ``ack`` or
+``error``.  Idle links are checked with ``ping``/``pong``.  A node
+listens on loopback only unless a token is set::
+
+    SCHEDULER_SYNC_TOKEN=... python -m webapps.shared.services.distribution node --listen 0.0.0.0:8765
+    SCHEDULER_SYNC_TOKEN=... python -m webapps.shared.services.distribution hub --node 10.0.0.11:8765 --node 10.0.0.12:8765
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .backend import ExecutionBackend
+from .metrics import timed
+from .schedule_manager import ScheduleManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+# A full state message carries every schedule.
+MAX_MESSAGE_BYTES = 64 * 2**20
+
+State = Tuple[Dict[str, list], Dict[str, Optional[str]], Dict[str, int]]
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+async def _receive(reader: asyncio.StreamReader, timeout: Optional[float]) -> dict:
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line:
+        raise ConnectionError("Connection closed")
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object")
+    return message
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """Split ``host:port`` (or ``host``, with the default port)."""
+    host, _, port = text.rpartition(":")
+    if not host:
+        return port, DEFAULT_PORT
+    return host.strip("[]"), int(port)
+
+
+def is_loopback(host: str) -> bool:
+    """Return whether ``host`` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# ----------------------------------------------------------------------
+# Hub
+
+
+class RevisionLog:
+    """The operations of the last ``history`` revisions of a store.
+
+    ``epoch`` names the lineage the revisions belong to; it changes when
+    the history is lost (a reload), so no node is caught up across it.
+    """
+
+    def __init__(self, revision: int, history: int = 1000) -> None:
+        self.history = history
+        self.epoch = uuid.uuid4().hex
+        self.revision = self.base = revision
+        self._entries: Deque[Tuple[int, List[dict]]] = collections.deque()
+
+    def record(self, revision: int, ops: Optional[List[dict]]) -> None:
+        """Log ``ops`` as the change to ``revision``; ``None`` restarts the history."""
+        if ops is None:
+            self.epoch = uuid.uuid4().hex
+            self.base = revision
+            self._entries.clear()
+        else:
+            self._entries.append((revision, ops))
+            while len(self._entries) > self.history:
+                self.base = self._entries.popleft()[0]
+        self.revision = revision
+
+    def since(self, epoch: Optional[str], revision: int) -> Optional[List[dict]]:
+        """Return the operations after ``revision``, or ``None`` if they are not all known."""
+        if epoch != self.epoch or not self.base <= revision <= self.revision:
+            return None
+        return [op for entry, ops in self._entries if entry > revision for op in ops]
+
+
+class NodeLink:
+    """Delivery state of one node."""
+
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self.address = address
+        self.name = f"{address[0]}:{address[1]}"
+        self.connected = False
+        self.epoch: Optional[str] = None
+        self.revision = -1
+        self.error: Optional[str] = None
+        self.acked_at: Optional[float] = None
+        # The (epoch, revision) a full state failed at, not retried until it changes.
+        self.failed: Optional[Tuple[str, int]] = None
+        self.wake = asyncio.Event()
+
+    def status(self) -> dict:
+        return {
+            "connected": self.connected,
+            "epoch": self.epoch,
+            "revision": self.revision,
+            "error": self.error,
+            "acked_at": self.acked_at,
+        }
+
+
+class Distributor:
+    """Keep every node in ``nodes`` at the latest revision of ``manager``.
+
+    ``manager`` is only read; it should not actuate anything, so use an
+    :class:`~.backend.ExecutionBackend`.
+    """
+
+    def __init__(
+        self,
+        manager: ScheduleManager,
+        nodes: List[Tuple[str, int]],
+        token: Optional[str] = None,
+        history: int = 1000,
+        poll: float = 1.0,
+        timeout: float = 30.0,
+        keepalive: float = 15.0,
+        retry: Tuple[float, float] = (0.5, 30.0),
+    ) -> None:
+        self.manager = manager
+        self.links = [NodeLink(address) for address in nodes]
+        self.token = token
+        self.poll = poll
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.retry = retry
+        self.log = RevisionLog(manager.revision, history)
+        self._pending: List[Optional[List[dict]]] = []
+        self._state = self._capture()
+        self._full: Optional[Tuple[Tuple[str, int], bytes]] = None
+        manager.add_listener(self._pending.append)
+
+    def status(self) -> Dict[str, dict]:
+        return {link.name: link.status() for link in self.links}
+
+    async def run(self) -> None:
+        """Serve every node until cancelled."""
+        await asyncio.gather(self._watch(), *(self._serve(link) for link in self.links))
+
+    # ------------------------------------------------------------------
+    # Following the store
+    def _capture(self) -> State:
+        """Copy the manager's state; stored schedules are never modified in place."""
+        manager = self.manager
+        return (
+            {sensor: list(items) for sensor, items in manager.sensors_schedule.items()},
+            dict(manager.sensors_override),
+            dict(manager.sensors_indices),
+        )
+
+    def _refresh(self) -> Optional[Tuple[int, Optional[List[dict]], State]]:
+        """Pick up store changes on a worker thread; return the new revision, ops and state."""
+        self.manager.refresh()
+        changes, self._pending[:] = list(self._pending), []
+        if not changes:
+            return None
+        if any(ops is None for ops in changes):
+            ops = None
+        else:
+            ops = [op for entry in changes for op in entry]
+        return self.manager.revision, ops, self._capture()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                change = await asyncio.to_thread(self._refresh)
+            except Exception:
+                logger.exception("Failed to refresh the schedule store")
+                continue
+            if change is not None:
+                revision, ops, self._state = change
+                self.log.record(revision, ops)
+                for link in self.links:
+                    link.wake.set()
+
+    def _full_message(self) -> bytes:
+        key = (self.log.epoch, self.log.revision)
+        if self._full is None or self._full[0] != key:
+            schedules, overrides, indices = self._state
+            message = {
+                "type": "full",
+                "epoch": key[0],
+                "revision": key[1],
+                "schedules": schedules,
+                "overrides": overrides,
+                "indices": indices,
+            }
+            self._full = (key, _encode(message))
+        return self._full[1]
+
+    # ------------------------------------------------------------------
+    # Links
+    async def _serve(self, link: NodeLink) -> None:
+        """Connect to ``link`` over and over, backing off while it is unreachable."""
+        delay = self.retry[0]
+        while True:
+            host, port = link.address
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port, limit=MAX_MESSAGE_BYTES), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError) as exc:
+                link.error = str(exc) or type(exc).__name__
+            else:
+                try:
+                    await self._session(link, reader, writer)
+                except (OSError, ValueError, asyncio.TimeoutError) as exc:
+                    link.error = str(exc) or type(exc).__name__
+                    logger.warning("Link to %s lost: %s", link.name, link.error)
+                finally:
+                    if link.connected:
+                        delay = self.retry[0]
+                    link.connected = False
+                    writer.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.retry[1])
+
+    async def _session(self, link: NodeLink, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(_encode({"type": "hello", "token": self.token, "keepalive": self.keepalive}))
+        await writer.drain()
+        cursor = await _receive(reader, self.timeout)
+        if cursor.get("type") != "cursor":
+            raise ValueError(cursor.get("error") or "Expected the node's cursor")
+        link.epoch, link.revision = cursor.get("epoch"), int(cursor.get("revision", -1))
+        link.connected, link.error = True, None
+        logger.info("Connected to %s (%s) at revision %d", link.name, cursor.get("node"), link.revision)
+        while True:
+            link.wake.clear()
+            target = (self.log.epoch, self.log.revision)
+            if (link.epoch, link.revision) != target and link.failed != target:
+                await self._push(link, reader, writer)
+                continue
+            try:
+                await asyncio.wait_for(link.wake.wait(), self.keepalive)
+            except asyncio.TimeoutError:
+                writer.write(_encode({"type": "ping"}))
+                await writer.drain()
+                reply = await _receive(reader, self.timeout)
+                if reply.get("type") != "pong":
+                    raise ValueError("Expected pong")
+
+    async def _push(self, link: NodeLink, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Send ``link`` what it misses and wait for its answer."""
+        target = (self.log.epoch, self.log.revision)
+        ops = self.log.since(link.epoch, link.revision)
+        if ops is None:
+            message = self._full_message()
+            kind = "full"
+        else:
+            message = _encode(
+                {"type": "sync", "epoch": target[0], "since": link.revision, "revision": target[1], "ops": ops}
+            )
+            kind = f"{len(ops)} ops"
+        with timed("sync_push"):
+            writer.write(message)
+            await writer.drain()
+            reply = await _receive(reader, self.timeout)
+        if reply.get("type") == "ack":
+            link.epoch, link.revision = reply["epoch"], int(reply["revision"])
+            link.acked_at = time.time()
+            link.error = link.failed = None
+            logger.info("%s at revision %d (%s)", link.name, link.revision, kind)
+        elif reply.get("type") == "error":
+            link.error = reply.get("error")
+            logger.warning("%s rejected revision %d (%s): %s", link.name, target[1], kind, link.error)
+            if ops is None:
+                link.failed = target
+            # Deltas no longer apply; send the whole state next.
+            link.epoch = None
+        else:
+            raise ValueError(f"Unexpected reply: {reply.get('type')}")
+
+
+# ----------------------------------------------------------------------
+# Node
+
+
+class NodeServer:
+    """Apply the revisions a hub pushes to the local ``manager``.
+
+    A hub can rewrite the node's schedules, so :meth:`serve` only listens
+    beyond the loopback interface when a ``token`` is set.
+    """
+
+    def __init__(self, manager: ScheduleManager, name: Optional[str] = None, token: Optional[str] = None) -> None:
+        self.manager = manager
+        self.name = name or socket.gethostname()
+        self.token = token
+        self.cursor_file = manager.storage_file.with_suffix(".sync")
+        self._lock = asyncio.Lock()
+
+    def cursor(self) -> Tuple[Optional[str], int]:
+        """Return the ``(epoch, revision)`` last applied, ``(None, -1)`` if none."""
+        try:
+            data = json.loads(self.cursor_file.read_text())
+            return data["epoch"], int(data["revision"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, -1
+
+    def _save_cursor(self, epoch: str, revision: int) -> None:
+        temp = self.cursor_file.with_name(f".{self.cursor_file.name}.tmp")
+        temp.write_text(json.dumps({"epoch": epoch, "revision": revision}))
+        os.replace(temp, self.cursor_file)
+
+    def _apply(self, message: dict) -> None:
+        if message["type"] == "full":
+            ops = [
+                {
+                    "op": "replace",
+                    "schedules": message["schedules"],
+                    "overrides": message["overrides"],
+                    "indices": message["indices"],
+                }
+            ]
+        else:
+            if self.cursor() != (message["epoch"], message["since"]):
+                raise ValueError("Out of sync: the operations do not follow the applied revision")
+            ops = message["ops"]
+        with timed("sync_apply"):
+            self.manager.apply_ops(ops)
+        self._save_cursor(message["epoch"], message["revision"])
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        try:
+            hello = await _receive(reader, 30.0)
+            token = str(hello.get("token") or "").encode()
+            if hello.get("type") != "hello" or not hmac.compare_digest(token, (self.token or "").encode()):
+                writer.write(_encode({"type": "error", "error": "Not authorized"}))
+                await writer.drain()
+                logger.warning("Rejected hub %s", peer)
+                return
+            idle = 4 * float(hello.get("keepalive", 15.0))
+            epoch, revision = self.cursor()
+            writer.write(_encode({"type": "cursor", "node": self.name, "epoch": epoch, "revision": revision}))
+            await writer.drain()
+            logger.info("Hub %s connected; at revision %d", peer, revision)
+            while True:
+                message = await _receive(reader, idle)
+                kind = message.get("type")
+                if kind == "ping":
+                    reply = {"type": "pong"}
+                elif kind in ("sync", "full"):
+                    async with self._lock:
+                        try:
+                            await asyncio.to_thread(self._apply, message)
+                        except Exception as exc:
+                            logger.warning("Failed to apply revision %s: %s", message.get("revision"), exc)
+                            reply = {"type": "error", "error": str(exc) or type(exc).__name__}
+                        else:
+                            reply = {"type": "ack", "epoch": message["epoch"], "revision": message["revision"]}
+                else:
+                    reply = {"type": "error", "error": f"Unknown message: {kind}"}
+                writer.write(_encode(reply))
+                await writer.drain()
+        except (OSError, ValueError, asyncio.TimeoutError) as exc:
+            logger.info("Hub %s disconnected: %s", peer, str(exc) or type(exc).__name__)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        if not self.token and not is_loopback(host):
+            raise ValueError(f"Refusing to listen on {host or 'all interfaces'} without a token")
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_MESSAGE_BYTES)
+        async with server:
+            await server.serve_forever()
+
+
+# ----------------------------------------------------------------------
+# Command line
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Distribute schedules to testbed nodes")
+    parser.add_argument("--storage", help="Schedule storage file (default: shared sensor_schedule.json)")
+    parser.add_argument(
+        "--token",
+        default=os.getenv("SCHEDULER_SYNC_TOKEN"),
+        help="Shared secret of hub and nodes (default: SCHEDULER_SYNC_TOKEN)",
+    )
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    parser_hub = subparsers.add_parser("hub", help="Push the schedules to nodes")
+    parser_hub.add_argument("--node", action="append", required=True, help="Node host:port; repeat per node")
+    parser_hub.add_argument("--poll", type=float, default=1.0, help="Seconds between checks for schedule changes")
+    parser_hub.add_argument("--history", type=int, default=1000, help="Revisions kept for catching nodes up")
+    parser_hub.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a node's answer")
+
+    parser_node = subparsers.add_parser("node", help="Receive schedules from the hub")
+    parser_node.add_argument(
+        "--listen",
+        default=f"127.0.0.1:{DEFAULT_PORT}",
+        help="Address to listen on; other than loopback only with a token",
+    )
+    parser_node.add_argument("--name", help="Name reported to the hub (default: host name)")
+    args = parser.parse_args(argv)
+    if args.role == "node" and not args.token and not is_loopback(parse_address(args.listen)[0]):
+        parser.error(f"--listen {args.listen} needs --token or SCHEDULER_SYNC_TOKEN")
+    return args
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.role == "hub":
+        manager = ScheduleManager(args.storage, backend=ExecutionBackend())
+        nodes = [parse_address(node) for node in args.node]
+        distributor = Distributor(
+            manager, nodes, token=args.token, history=args.history, poll=args.poll, timeout=args.timeout
+        )
+        await distributor.run()
+    else:
+        # The node's own backend (cron unless SCHEDULER_BACKEND says otherwise) actuates.
+        node = NodeServer(ScheduleManager(args.storage), name=args.name, token=args.token)
+        await node.serve(*parse_address(args.listen))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(run(parse_args(argv)))
+    except KeyboardInterrupt:
+        print("Exiting...")
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
@@ -0,0 +1,148 @@
+"""Server-sent events carrying schedule and sensor state changes to browsers.
+
+A stream starts with the full ``schedules`` document and every sensor's
+state.  After that it only carries deltas:
+
+``ops``
+    Journal operations applied to the schedules (see :func:`~.store.apply_op`).
+``schedules``
+    The full document again, after the stored state was replaced.
+``states``
+    The sensors whose state or source changed, checked after every change
+    and at the start of every minute, when cron jobs fire.
+
+A stream that falls ``max_pending`` messages behind (a stalled browser
+tab) has its backlog replaced by one resync: the full ``schedules``
+document and every sensor's state, as last published.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from .command_queue import Changes, CommandQueue
+from .schedule_manager import ScheduleSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Queued in place of the backlog of a stream that fell behind.
+_RESYNC = object()
+
+
+def _message(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class EventHub:
+    """Fan the changes published by ``writer`` out to every open stream."""
+
+    def __init__(self, writer: CommandQueue, heartbeat: float = 15.0, max_pending: int = 256) -> None:
+        self.writer = writer
+        self.heartbeat = heartbeat
+        self.max_pending = max_pending
+        self._clients: Set[asyncio.Queue] = set()
+        # Streams with a resync queued; they get nothing else until they read it.
+        self._lagging: Set[asyncio.Queue] = set()
+        # Last snapshot and states published; None until the first check,
+        # which sends every state.
+        self._snapshot: ScheduleSnapshot = writer.snapshot
+        self._states: Optional[Dict[str, dict]] = None
+        self._ticker: Optional[asyncio.Task] = None
+        writer.subscribe(self._on_change)
+
+    async def start(self) -> None:
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+
+    async def stop(self) -> None:
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        for queue in self._clients:
+            if queue.full():
+                self._drain(queue)
+            queue.put_nowait(None)
+
+    # ------------------------------------------------------------------
+    # Publishing
+    def _publish(self, event: str, data: object) -> None:
+        message = _message(event, data)
+        for queue in self._clients - self._lagging:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drain(queue)
+                queue.put_nowait(_RESYNC)
+                self._lagging.add(queue)
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            queue.get_nowait()
+
+    def _resync(self) -> str:
+        snapshot = self._snapshot
+        version = snapshot.etag.strip('"')
+        states = self._states if self._states is not None else snapshot.states_document()
+        schedules = dict(snapshot.schedules_document(), version=version)
+        return _message("schedules", schedules) + _message("states", states)
+
+    def _on_change(self, snapshot: ScheduleSnapshot, changes: Changes) -> None:
+        self._snapshot = snapshot
+        version = snapshot.etag.strip('"')
+        for ops in changes:
+            if ops is None:
+                self._publish("schedules", dict(snapshot.schedules_document(), version=version))
+            else:
+                self._publish("ops", {"version": version, "ops": ops})
+        self._check_states(snapshot)
+
+    def _check_states(self, snapshot: ScheduleSnapshot) -> None:
+        states = snapshot.states_document()
+        previous = self._states or {}
+        changed = {sensor: value for sensor, value in states.items() if previous.get(sensor) != value}
+        self._states = states
+        if changed:
+            self._publish("states", changed)
+
+    async def _tick(self) -> None:
+        while True:
+            now = datetime.datetime.now()
+            await asyncio.sleep(60 - now.second - now.microsecond / 1e6 + 0.05)
+            try:
+                self._check_states(self.writer.snapshot)
+            except Exception:
+                logger.exception("Failed to check sensor states")
+
+    # ------------------------------------------------------------------
+    # Streams
+    async def stream(self, is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+        """Yield SSE messages until the client goes away or the hub stops."""
+        snapshot = self.writer.snapshot
+        version = snapshot.etag.strip('"')
+        queue: asyncio.Queue = asyncio.Queue(self.max_pending)
+        # Registered before the first await, so no change can slip in between.
+        self._clients.add(queue)
+        try:
+            yield f"retry: 3000\n{_message('schedules', dict(snapshot.schedules_document(), version=version))}"
+            yield _message("states", snapshot.states_document())
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        return
+                    message = ": keep-alive\n\n"
+                if message is None:
+                    return
+                if message is _RESYNC:
+                    self._lagging.discard(queue)
+                    message = self._resync()
+                yield message
+        finally:
+            self._clients.discard(queue)
+            self._lagging.discard(queue)
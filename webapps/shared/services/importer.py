@@ -0,0 +1,397 @@
+"""Streaming, validated import of schedule files.
+
+Uploads are parsed incrementally: only one schedule entry is decoded at a
+time, the total size is capped and so is the size of a single entry, so a
+multi-megabyte mission plan is read in one pass with bounded memory.  Two
+formats are accepted:
+
+``.json``
+    The storage document (``{"schedules": {sensor: [...]}, "overrides":
+    {...}}``), or an array of entries.
+``.jsonl``
+    One entry per line.
+
+In arrays and ``.jsonl`` files every entry names its ``sensor``.  Each
+entry is validated on its own and checked for conflicts against the
+entries accepted before it (and, when appending, the stored schedules).
+:func:`import_schedules` then applies the accepted entries in a single
+batch and returns a per-entry report.
+"""
+
+from __future__ import annotations
+
+import codecs
+import datetime
+import json
+import re
+from dataclasses import dataclass, field
+from typing import IO, TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from .conflicts import ConflictIndex
+from .timeline import next_occurrence
+
+if TYPE_CHECKING:  # pragma: no cover - imported for type hints only
+    from .schedule_manager import ScheduleManager
+
+MAX_UPLOAD_BYTES = 16 * 2**20
+MAX_ENTRY_BYTES = 64 * 2**10
+CHUNK_BYTES = 64 * 2**10
+STATES = ("on", "off", "logging")
+MODES = ("replace", "append")
+HHMM = re.compile(r"([01]?\d|2[0-3]):([0-5]\d)\Z")
+
+
+class UploadTooLarge(ValueError):
+    """The upload, or one entry in it, exceeds its size limit."""
+
+
+class _JsonStream:
+    """Decode consecutive JSON values from a binary file, a chunk at a time."""
+
+    def __init__(self, file: IO[bytes], max_bytes: int) -> None:
+        self._file = file
+        self._max_bytes = max_bytes
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._read = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Read another chunk; return ``False`` at the end of the file."""
+        if self._eof:
+            return False
+        data = self._file.read(CHUNK_BYTES)
+        self._read += len(data)
+        if self._read > self._max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self._max_bytes} bytes")
+        self._buffer = self._buffer[self._pos :] + self._decoder.decode(data, final=not data)
+        self._pos = 0
+        if not data:
+            self._eof = True
+        return bool(data)
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character, or ``""`` at the end."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        char = self.peek()
+        if not char or char not in characters:
+            found = repr(char) if char else "end of file"
+            raise ValueError(f"Expected one of {characters!r}, found {found}")
+        self._pos += 1
+        return char
+
+    def value(self) -> object:
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as exc:
+                # An error near the end of the buffer, or in a string running
+                # into it, may only mean the value continues in the next
+                # chunk.  A real error stays put as the buffer grows.
+                truncated = exc.pos + 32 >= len(self._buffer) or exc.msg.startswith("Unterminated string")
+                if self._eof or not truncated:
+                    raise ValueError(f"Invalid JSON: {exc.msg}") from None
+            else:
+                # So may a number.
+                if end < len(self._buffer) or self._eof or not isinstance(value, (int, float)):
+                    self._pos = end
+                    return value
+            if len(self._buffer) - self._pos > MAX_ENTRY_BYTES:
+                raise UploadTooLarge(f"An entry exceeds {MAX_ENTRY_BYTES} bytes")
+            self._fill()
+
+    def line(self) -> Optional[str]:
+        """Return the next non-blank line, or ``None`` at the end."""
+        while self.peek():
+            newline = self._buffer.find("\n", self._pos)
+            if newline < 0 and not self._eof:
+                if len(self._buffer) - self._pos > MAX_ENTRY_BYTES:
+                    raise UploadTooLarge(f"A line exceeds {MAX_ENTRY_BYTES} bytes")
+                self._fill()
+                continue
+            end = len(self._buffer) if newline < 0 else newline
+            line, self._pos = self._buffer[self._pos : end], end
+            return line
+        return None
+
+
+class ScheduleReader:
+    """Yield ``(sensor, entry)`` pairs from an uploaded schedule file.
+
+    Malformed entries of ``.jsonl`` files are yielded as ``(None,
+    ValueError)`` so the rest of the file can still be read.  A storage
+    document's ``overrides`` and ``indices`` are available once the
+    entries have been consumed.
+    """
+
+    def __init__(self, file: IO[bytes], filename: str, max_bytes: int = MAX_UPLOAD_BYTES) -> None:
+        if filename.endswith(".jsonl"):
+            self.lines = True
+        elif filename.endswith(".json"):
+            self.lines = False
+        else:
+            raise ValueError("File must be a .json or .jsonl file")
+        self._stream = _JsonStream(file, max_bytes)
+        self.overrides: Dict[str, object] = {}
+        self.indices: Dict[str, object] = {}
+
+    def __iter__(self) -> Iterator[Tuple[Optional[str], object]]:
+        if self.lines:
+            return self._lines()
+        if self._stream.peek() == "[":
+            return self._array()
+        return self._document()
+
+    def _lines(self) -> Iterator[Tuple[Optional[str], object]]:
+        while True:
+            line = self._stream.line()
+            if line is None:
+                return
+            try:
+                entry = json.loads(line)
+            except ValueError as exc:
+                yield None, ValueError(f"Invalid JSON: {exc}")
+                continue
+            yield self._sensor_of(entry), entry
+
+    def _array(self) -> Iterator[Tuple[Optional[str], object]]:
+        stream = self._stream
+        stream.expect("[")
+        if stream.peek() == "]":
+            stream.expect("]")
+            return
+        while True:
+            entry = stream.value()
+            yield self._sensor_of(entry), entry
+            if stream.expect(",]") == "]":
+                return
+
+    def _document(self) -> Iterator[Tuple[Optional[str], object]]:
+        stream = self._stream
+        stream.expect("{")
+        if stream.peek() == "}":
+            stream.expect("}")
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "schedules":
+                yield from self._schedules()
+            else:
+                value = stream.value()
+                if key == "overrides" and isinstance(value, dict):
+                    self.overrides = value
+                elif key == "indices" and isinstance(value, dict):
+                    self.indices = value
+            if stream.expect(",}") == "}":
+                return
+
+    def _schedules(self) -> Iterator[Tuple[Optional[str], object]]:
+        stream = self._stream
+        stream.expect("{")
+        if stream.peek() == "}":
+            stream.expect("}")
+            return
+        while True:
+            sensor = stream.value()
+            if not isinstance(sensor, str):
+                raise ValueError("Sensor names must be strings")
+            stream.expect(":")
+            stream.expect("[")
+            if stream.peek() != "]":
+                while True:
+                    yield sensor, stream.value()
+                    if stream.expect(",]") == "]":
+                        break
+            else:
+                stream.expect("]")
+            if stream.expect(",}") == "}":
+                return
+
+    @staticmethod
+    def _sensor_of(entry: object) -> Optional[str]:
+        if isinstance(entry, dict) and isinstance(entry.get("sensor"), str):
+            return entry["sensor"]
+        return None
+
+
+# ----------------------------------------------------------------------
+# Validation
+
+
+def _hhmm(value: object, name: str) -> str:
+    match = HHMM.match(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"{name} must be HH:MM")
+    return f"{int(match[1]):02d}:{match[2]}"
+
+
+def _date(value: object, name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be YYYY-MM-DD") from None
+
+
+def validate_entry(sensor: Optional[str], entry: object, channels: Dict[str, int]) -> dict:
+    """Return the schedule described by ``entry``, or raise ``ValueError``.
+
+    The result holds only the keys :meth:`ScheduleManager.add_schedule`
+    stores, plus ``id`` if the entry gave a valid one.  One-off schedules
+    without a ``date`` get the next matching day, as they do when added.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("Entry must be a JSON object")
+    if sensor not in channels:
+        raise ValueError(f"Unknown sensor: {sensor}")
+    state = entry.get("state")
+    if state not in STATES:
+        raise ValueError(f"state must be one of {', '.join(STATES)}")
+    repeat = entry.get("repeat", False)
+    if not isinstance(repeat, bool):
+        raise ValueError("repeat must be true or false")
+    days = entry.get("days")
+    if days is not None and (
+        not isinstance(days, list)
+        or not all(isinstance(day, int) and not isinstance(day, bool) and 0 <= day <= 6 for day in days)
+    ):
+        raise ValueError("days must be a list of weekdays 0-6 (Sunday is 0)")
+    schedule = {
+        "start": _hhmm(entry.get("start"), "start"),
+        "end": _hhmm(entry.get("end"), "end"),
+        "repeat": repeat,
+        "state": state,
+        "days": days,
+        "end_repeat": _date(entry.get("end_repeat"), "end_repeat"),
+    }
+    if not repeat:
+        schedule["date"] = _date(entry.get("date"), "date") or next_occurrence(days).isoformat()
+    schedule_id = entry.get("id")
+    if schedule_id is not None:
+        if not isinstance(schedule_id, int) or isinstance(schedule_id, bool) or schedule_id < 0:
+            raise ValueError("id must be a non-negative integer")
+        schedule["id"] = schedule_id
+    return schedule
+
+
+# ----------------------------------------------------------------------
+# Import
+
+
+@dataclass
+class ImportReport:
+    """Outcome of an import, with one record per entry in file order."""
+
+    mode: str
+    applied: bool = False
+    accepted: int = 0
+    rejected: int = 0
+    entries: List[dict] = field(default_factory=list)
+
+    def accept(self, sensor: str, schedule_id: int) -> None:
+        self.accepted += 1
+        self.entries.append({"entry": len(self.entries), "sensor": sensor, "id": schedule_id})
+
+    def reject(self, sensor: Optional[str], error: str) -> None:
+        self.rejected += 1
+        self.entries.append({"entry": len(self.entries), "sensor": sensor, "error": error})
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "applied": self.applied,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "entries": self.entries,
+        }
+
+
+def import_schedules(
+    manager: "ScheduleManager",
+    reader: ScheduleReader,
+    mode: str = "replace",
+    strict: bool = True,
+    dry_run: bool = False,
+) -> ImportReport:
+    """Validate the entries of ``reader`` and apply the accepted ones in one batch.
+
+    ``replace`` swaps the stored schedules (and overrides, if the file has
+    them) for the file's; ``append`` adds the entries to the stored
+    schedules with new ids.  With ``strict`` nothing is applied if any
+    entry was rejected; with ``dry_run`` nothing is applied at all.
+    Errors that stop the file from being read raise ``ValueError``.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    channels = manager.sensors_channels
+    report = ImportReport(mode)
+    with manager.batch():
+        if mode == "replace":
+            schedules: Dict[str, list] = {sensor: [] for sensor in channels}
+            next_ids = {sensor: 0 for sensor in channels}
+        else:
+            schedules = {sensor: list(items) for sensor, items in manager.sensors_schedule.items()}
+            next_ids = dict(manager.sensors_indices)
+        taken = {sensor: {schedule["id"] for schedule in items} for sensor, items in schedules.items()}
+        conflicts = ConflictIndex(schedules, channels)
+        accepted: List[Tuple[str, dict]] = []
+        for sensor, entry in reader:
+            if isinstance(entry, ValueError):
+                report.reject(sensor, str(entry))
+                continue
+            try:
+                schedule = validate_entry(sensor, entry, channels)
+            except ValueError as exc:
+                report.reject(sensor, str(exc))
+                continue
+            if mode == "append" or "id" not in schedule:
+                schedule["id"] = next_ids[sensor]
+            if schedule["id"] in taken[sensor]:
+                report.reject(sensor, f"Duplicate id {schedule['id']}")
+                continue
+            found = conflicts.check(sensor, schedule)
+            if found:
+                report.reject(sensor, "; ".join(str(conflict) for conflict in found))
+                continue
+            taken[sensor].add(schedule["id"])
+            next_ids[sensor] = max(next_ids[sensor], schedule["id"] + 1)
+            schedules[sensor].append(schedule)
+            conflicts.added(sensor, schedule)
+            accepted.append((sensor, schedule))
+            report.accept(sensor, schedule["id"])
+        if dry_run or (strict and report.rejected):
+            return report
+        if mode == "replace":
+            overrides = _overrides(reader.overrides, channels)
+            for sensor, index in reader.indices.items():
+                if sensor in next_ids and isinstance(index, int) and index > next_ids[sensor]:
+                    next_ids[sensor] = index
+            manager.replace_schedules(schedules, overrides, next_ids)
+        else:
+            manager.insert_schedules(accepted)
+        report.applied = True
+    return report
+
+
+def _overrides(overrides: Dict[str, object], channels: Dict[str, int]) -> Dict[str, Optional[str]]:
+    result: Dict[str, Optional[str]] = {sensor: None for sensor in channels}
+    for sensor, state in overrides.items():
+        if sensor not in channels:
+            raise ValueError(f"Unknown sensor in overrides: {sensor}")
+        if state is not None and state not in STATES:
+            raise ValueError(f"Invalid override for {sensor}: {state!r}")
+        result[sensor] = state
+    return result
@@ -0,0 +1,235 @@
+"""Latency metrics in the Prometheus text format and optional trace spans.
+
+:func:`instrument` and :func:`timed` wrap the slow paths of the scheduler
+(command execution, crontab reads and writes, storage writes, uploads).
+Each wrapped call is observed in ``scheduler_operation_duration_seconds``
+under its operation name, and failures are also counted in
+``scheduler_operation_errors_total``.  The web applications add
+``http_request_duration_seconds`` and serve everything at ``/metrics``.
+
+If ``SCHEDULER_TRACE_FILE`` names a file, every wrapped call is also
+appended to it as a JSON line span.  Spans carry the id of the HTTP request
+they ran for, including on the writer thread, so one slow request can be
+broken down into crontab, storage and queueing time.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(labels)} {_number(value)}" for labels, value in sorted(values.items())]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {labels: (list(counts), total[0]) for labels, (counts, total) in self._values.items()}
+        lines = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket = _format_labels(labels, 'le="' + _number(bound) + '"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+OPERATION_SECONDS = registry.register(
+    Histogram("scheduler_operation_duration_seconds", "Duration of scheduler operations.")
+)
+OPERATION_ERRORS = registry.register(
+    Counter("scheduler_operation_errors_total", "Scheduler operations that raised.")
+)
+REQUEST_SECONDS = registry.register(
+    Histogram("http_request_duration_seconds", "Duration of HTTP requests by route and status.")
+)
+
+# ----------------------------------------------------------------------
+# Tracing
+
+
+class Tracer:
+    """Append finished spans as JSON lines to ``path``; disabled without one."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, span: dict) -> None:
+        line = json.dumps(span, separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a") as file:
+            file.write(line)
+
+
+tracer = Tracer(os.getenv("SCHEDULER_TRACE_FILE"))
+# (trace id, id of the innermost open span) of the code running now.
+_span: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar("span", default=None)
+
+
+def current_trace() -> Optional[str]:
+    """Return the id of the trace the running code belongs to, if tracing."""
+    current = _span.get()
+    return current[0] if current else None
+
+
+@contextmanager
+def span(name: str, trace: Optional[str] = None, **attributes: Any) -> Iterator[None]:
+    """Record ``name`` as a child of the current span, or start trace ``trace``."""
+    if not tracer.enabled:
+        yield
+        return
+    parent = _span.get()
+    trace_id = trace or (parent[0] if parent else uuid.uuid4().hex[:16])
+    span_id = uuid.uuid4().hex[:8]
+    token = _span.set((trace_id, span_id))
+    start = time.time()
+    error = None
+    try:
+        yield
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        _span.reset(token)
+        record = {
+            "trace": trace_id,
+            "span": span_id,
+            "parent": parent[1] if parent and parent[0] == trace_id else None,
+            "name": name,
+            "start": round(start, 6),
+            "duration_ms": round((time.time() - start) * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if error:
+            record["error"] = error
+        if attributes:
+            record["attributes"] = attributes
+        tracer.write(record)
+
+
+# ----------------------------------------------------------------------
+# Instrumentation
+
+
+@contextmanager
+def timed(operation: str) -> Iterator[None]:
+    """Observe the duration of the block, and count it if it raises."""
+    start = time.perf_counter()
+    try:
+        with span(operation):
+            yield
+    except BaseException:
+        OPERATION_ERRORS.inc(operation=operation)
+        raise
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+def instrument(operation: str) -> Callable[[F], F]:
+    """Decorate a function so every call is :func:`timed` as ``operation``."""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timed(operation):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
@@ -0,0 +1,167 @@
+"""Persistent I2C driver for the Sequent Microsystems 8-MOSFET HAT.
+
+The ``8mosfet`` CLI opens the bus, reads the output register, flips one
+bit and writes it back on every invocation.  :class:`MosfetDriver` keeps
+the bus open, caches the output register and applies any number of
+channel changes with a single register write.
+
+The board's I2C address and the output bit behind each CLI channel are
+not guessed: they come from a JSON file named by
+``SCHEDULER_MOSFET_CONFIG``::
+
+    {"bus": 1, "address": "0x3f", "channels": {"1": 0, "2": 1, ...}}
+
+Check them against the ``8mosfet`` CLI for the installed board before
+switching to the driver, e.g. by switching one channel at a time with
+the CLI and reading the register with ``i2cget``.  The CLI remains the
+default.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional, Union
+
+OUTPUT_REGISTER = 0x01
+CONFIG_REGISTER = 0x03
+CHANNELS = range(1, 9)
+CONFIG_ENV = "SCHEDULER_MOSFET_CONFIG"
+
+State = Union[bool, str]
+
+
+def as_bool(state: State) -> bool:
+    """Return ``True`` for ``"on"``/``True`` and ``False`` for ``"off"``/``False``."""
+    if isinstance(state, bool):
+        return state
+    if state in ("on", "off"):
+        return state == "on"
+    raise ValueError(f"Invalid MOSFET state: {state!r}")
+
+
+class MosfetDriver:
+    """Drive the eight channels of one 8-MOSFET board.
+
+    ``address`` is the board's I2C address and ``channel_bits`` maps the
+    channel numbers used with the ``8mosfet`` CLI to output register bits.
+    Both are required, since a wrong mapping switches the wrong sensor
+    (see the module docstring).  The bus is opened lazily on first use.
+    """
+
+    def __init__(self, address: int, channel_bits: Mapping[int, int], bus: int = 1) -> None:
+        bits = sorted(channel_bits.values())
+        if set(channel_bits) - set(CHANNELS) or len(set(bits)) != len(bits) or not set(bits) <= set(range(8)):
+            raise ValueError(f"Invalid MOSFET channel map: {dict(channel_bits)}")
+        self.bus_number = bus
+        self.address = address
+        self.channel_bits: Dict[int, int] = dict(channel_bits)
+        self._bus = None
+        self._output: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path]) -> "MosfetDriver":
+        """Create a driver from a JSON configuration (see the module docstring)."""
+        with open(path, encoding="utf-8") as fh:
+            config = json.load(fh)
+        try:
+            address = config["address"]
+            return cls(
+                int(address, 0) if isinstance(address, str) else int(address),
+                {int(channel): int(bit) for channel, bit in config["channels"].items()},
+                int(config.get("bus", 1)),
+            )
+        except KeyError as exc:
+            raise ValueError(f"{path} is missing {exc.args[0]!r}") from None
+
+    # ------------------------------------------------------------------
+    # Bus handling
+    def open(self) -> None:
+        if self._bus is not None:
+            return
+        from smbus2 import SMBus
+
+        self._bus = SMBus(self.bus_number)
+        self._output = self._bus.read_byte_data(self.address, OUTPUT_REGISTER)
+        if self._bus.read_byte_data(self.address, CONFIG_REGISTER) != 0:
+            self._bus.write_byte_data(self.address, CONFIG_REGISTER, 0)
+
+    def close(self) -> None:
+        if self._bus is not None:
+            self._bus.close()
+            self._bus = None
+            self._output = None
+
+    def __enter__(self) -> "MosfetDriver":
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _write(self, value: int) -> None:
+        self._bus.write_byte_data(self.address, OUTPUT_REGISTER, value)
+        self._output = value
+
+    # ------------------------------------------------------------------
+    # Channel access
+    def state(self) -> Dict[int, bool]:
+        """Return the cached on/off state of every channel."""
+        with self._lock:
+            self.open()
+            return {
+                channel: bool(self._output & (1 << bit))
+                for channel, bit in self.channel_bits.items()
+            }
+
+    def apply(self, changes: Mapping[int, State], stagger: float = 0.0) -> None:
+        """Switch several channels at once.
+
+        Channels being turned off and, without ``stagger``, channels being
+        turned on are all changed by one register write.  With ``stagger``
+        the channels turned on are powered up one at a time, in the order
+        given, ``stagger`` seconds apart, to limit the inrush current.
+        """
+        with self._lock:
+            self.open()
+            value = self._output
+            powering_up = []
+            for channel, state in changes.items():
+                mask = 1 << self.channel_bits[channel]
+                if not as_bool(state):
+                    value &= ~mask
+                elif stagger:
+                    powering_up.append(mask)
+                else:
+                    value |= mask
+            if value != self._output:
+                self._write(value)
+            delay = 0.0
+            for mask in powering_up:
+                if value & mask:
+                    continue
+                time.sleep(delay)
+                value |= mask
+                self._write(value)
+                delay = stagger
+
+    def write(self, channel: int, state: State) -> None:
+        self.apply({channel: state})
+
+    def set_all(
+        self, state: State, channels: Optional[Iterable[int]] = None, stagger: float = 0.0
+    ) -> None:
+        """Switch ``channels`` (default: all) to ``state``."""
+        self.apply({channel: state for channel in channels or self.channel_bits}, stagger)
+
+
+def driver_from_env() -> MosfetDriver:
+    """Return the driver configured by the file named in ``SCHEDULER_MOSFET_CONFIG``."""
+    path = os.getenv(CONFIG_ENV)
+    if not path:
+        raise ValueError(f"The I2C driver needs {CONFIG_ENV} naming its address and channel map")
+    return MosfetDriver.from_file(path)
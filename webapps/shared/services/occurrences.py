@@ -0,0 +1,199 @@
+"""Vectorized expansion of schedules into on/off transitions.
+
+Every schedule of a sensor is expanded over a range of whole days at
+once: a ``schedules x days`` mask selects the dates on which each
+schedule occurs (weekday mask, one-off ``date``, ``end_repeat``), and
+the on/off times of all selected occurrences are computed as NumPy
+``datetime64[m]`` arrays.
+"""
+
+from __future__ import annotations
+
+import datetime
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .timeline import ALL_DAYS, MINUTES_PER_DAY, parse_hhmm, schedule_bounds
+
+EARLIEST = np.datetime64("0001-01-01", "D")
+LATEST = np.datetime64("9999-12-31", "D")
+# 1970-01-01, day zero of datetime64[D], was a Thursday.
+EPOCH_WEEKDAY = 4
+
+
+@dataclass(frozen=True)
+class Transitions:
+    """Time ordered transitions; element ``i`` of every array describes one.
+
+    ``kinds`` is ``1`` where a schedule starts and ``0`` where it ends, so
+    an end sorts before a start at the same minute.
+    """
+
+    times: np.ndarray
+    sensors: np.ndarray
+    states: np.ndarray
+    schedule_ids: np.ndarray
+    kinds: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "Transitions":
+        return cls(
+            np.array([], dtype="datetime64[m]"),
+            np.array([], dtype=str),
+            np.array([], dtype=str),
+            np.array([], dtype=np.int64),
+            np.array([], dtype=np.int8),
+        )
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def _take(self, selection) -> "Transitions":
+        return Transitions(
+            self.times[selection],
+            self.sensors[selection],
+            self.states[selection],
+            self.schedule_ids[selection],
+            self.kinds[selection],
+        )
+
+    def between(self, start: datetime.datetime, end: datetime.datetime) -> "Transitions":
+        """Return the transitions in ``[start, end)``."""
+        first, last = np.searchsorted(
+            self.times, np.array([start, end], dtype="datetime64[m]"), side="left"
+        )
+        return self._take(slice(first, last))
+
+    @classmethod
+    def merge(cls, parts: Iterable["Transitions"]) -> "Transitions":
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        merged = cls(*(np.concatenate(arrays) for arrays in zip(*(part._arrays() for part in parts))))
+        return merged._take(np.lexsort((merged.kinds, merged.times)))
+
+    def _arrays(self) -> Tuple[np.ndarray, ...]:
+        return self.times, self.sensors, self.states, self.schedule_ids, self.kinds
+
+    def to_records(self) -> List[dict]:
+        """Return the transitions as JSON-ready dictionaries."""
+        return [
+            {"time": time, "sensor": sensor, "state": state, "schedule": schedule_id}
+            for time, sensor, state, schedule_id in zip(
+                np.datetime_as_string(self.times, unit="m").tolist(),
+                self.sensors.tolist(),
+                self.states.tolist(),
+                self.schedule_ids.tolist(),
+            )
+        ]
+
+
+def expand_windows(
+    schedules: List[dict], first_day: datetime.date, days: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return ``(on, off, rows)`` for the occurrences of ``schedules`` starting in the range.
+
+    The range is ``days`` days from ``first_day`` plus the day before, so
+    overnight windows running into ``first_day`` are included.  ``rows``
+    indexes ``schedules``.
+    """
+    count = len(schedules)
+    begin = np.empty(count, dtype=np.int64)
+    length = np.empty(count, dtype=np.int64)
+    weekmask = np.zeros((count, 7), dtype=bool)
+    lower = np.full(count, EARLIEST)
+    upper = np.full(count, LATEST)
+    for row, schedule in enumerate(schedules):
+        begin[row] = parse_hhmm(schedule["start"])
+        length[row] = (parse_hhmm(schedule["end"]) - begin[row]) % MINUTES_PER_DAY
+        first, last = schedule_bounds(schedule)
+        if first is not None and first == last:
+            weekmask[row] = True
+        else:
+            weekmask[row, list(schedule.get("days") or ALL_DAYS)] = True
+        if first is not None:
+            lower[row] = np.datetime64(first, "D")
+        if last is not None:
+            upper[row] = np.datetime64(last, "D")
+
+    dates = np.datetime64(first_day, "D") + np.arange(-1, max(days, 0), dtype=np.int64)
+    weekday = (dates.astype(np.int64) + EPOCH_WEEKDAY) % 7
+    mask = (
+        weekmask[:, weekday]
+        & (dates >= lower[:, None])
+        & (dates <= upper[:, None])
+        & (length > 0)[:, None]
+    )
+    rows, columns = np.nonzero(mask)
+    on = dates[columns].astype("datetime64[m]") + begin[rows].astype("timedelta64[m]")
+    off = on + length[rows].astype("timedelta64[m]")
+    return on, off, rows
+
+
+def expand(sensor: str, schedules: List[dict], first_day: datetime.date, days: int) -> Transitions:
+    """Return every transition of ``schedules`` within ``days`` days from ``first_day``."""
+    if not schedules or days <= 0:
+        return Transitions.empty()
+    on, off, rows = expand_windows(schedules, first_day, days)
+    states = np.array([schedule["state"] for schedule in schedules], dtype=str)
+    ids = np.array([schedule["id"] for schedule in schedules], dtype=np.int64)
+    times = np.concatenate((on, off))
+    transitions = Transitions(
+        times,
+        np.full(len(times), sensor),
+        np.concatenate((states[rows], np.full(len(rows), "off"))),
+        np.concatenate((ids[rows], ids[rows])),
+        np.concatenate((np.ones(len(rows), dtype=np.int8), np.zeros(len(rows), dtype=np.int8))),
+    )
+    start = np.datetime64(first_day, "m")
+    inside = (times >= start) & (times < start + np.timedelta64(days * MINUTES_PER_DAY, "m"))
+    transitions = transitions._take(inside)
+    return transitions._take(np.lexsort((transitions.kinds, transitions.times)))
+
+
+class OccurrenceCache:
+    """Per-sensor :func:`expand` results for the horizons asked for today.
+
+    Like :class:`~.timeline.Timeline`, ``schedules`` is the live mapping
+    owned by the schedule manager, which must :meth:`invalidate` a sensor
+    after mutating its schedule list.
+    """
+
+    def __init__(self, schedules: Dict[str, List[dict]]) -> None:
+        self._schedules = schedules
+        self._cache: Dict[str, Dict[Tuple[datetime.date, int], Transitions]] = {}
+
+    def invalidate(self, sensor: Optional[str] = None) -> None:
+        if sensor is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(sensor, None)
+
+    def sensor(self, sensor: str, first_day: datetime.date, days: int) -> Transitions:
+        horizons = self._cache.setdefault(sensor, {})
+        transitions = horizons.get((first_day, days))
+        if transitions is None:
+            # Horizons starting on another day are not asked for again.
+            for key in [key for key in horizons if key[0] != first_day]:
+                del horizons[key]
+            transitions = expand(sensor, self._schedules.get(sensor, []), first_day, days)
+            horizons[(first_day, days)] = transitions
+        return transitions
+
+    def between(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sensors: Optional[Iterable[str]] = None,
+    ) -> Transitions:
+        """Return the transitions of ``sensors`` (default: all) in ``[start, end)``."""
+        first_day = start.date()
+        days = (end.date() - first_day).days + 1
+        return Transitions.merge(
+            self.sensor(sensor, first_day, days).between(start, end)
+            for sensor in (sensors if sensors is not None else self._schedules)
+        )
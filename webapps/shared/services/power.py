@@ -0,0 +1,151 @@
+"""Power and energy budget of the schedule set at minute resolution.
+
+Each sensor draws a constant power, taken from a table keyed like
+``ScheduleManager.sensors_channels``, whenever a schedule holds it in a
+state other than ``off`` or an override keeps it on.  The horizon is a
+NumPy array of minutes; the minutes each sensor is powered are found by
+adding ``+1``/``-1`` at the start/end minute of every occurrence and
+taking a cumulative sum.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .occurrences import expand_windows
+from .timeline import MINUTES_PER_DAY
+
+DEFAULT_TABLE = Path(__file__).resolve().parent.parent / "schedule_files" / "power_draw.json"
+
+
+def load_power_table(path: Optional[Path], sensors: List[str]) -> Dict[str, float]:
+    """Return the draw in watts of every sensor in ``sensors`` from the JSON table at ``path``.
+
+    Sensors missing from the table, or all of them if there is no table,
+    draw nothing.
+    """
+    table: Dict[str, float] = {sensor: 0.0 for sensor in sensors}
+    try:
+        with open(path or DEFAULT_TABLE, "r") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return table
+    table.update(parse_draws(data, sensors))
+    return table
+
+
+def parse_draws(draws, sensors: List[str]) -> Dict[str, float]:
+    """Validate ``{sensor: watts}`` or ``"AML=3.5,UV=12"`` against ``sensors``."""
+    if isinstance(draws, str):
+        pairs = [item.split("=", 1) for item in draws.split(",") if item]
+        if any(len(pair) != 2 for pair in pairs):
+            raise ValueError("Power draws must look like SENSOR=WATTS")
+        draws = dict(pairs)
+    result = {}
+    for sensor, watts in draws.items():
+        if sensor not in sensors:
+            raise ValueError(f"Unknown sensor: {sensor}")
+        result[sensor] = float(watts)
+        if result[sensor] < 0:
+            raise ValueError(f"Negative power draw for {sensor}")
+    return result
+
+
+@dataclass(frozen=True)
+class EnergyBudget:
+    """Minute by minute load of a simulated horizon starting at ``start``.
+
+    ``load`` is the total draw in watts during each minute and ``energy``
+    the energy in watt-hours used by the end of it.
+    """
+
+    start: datetime.datetime
+    draws: Dict[str, float]
+    load: np.ndarray
+    energy: np.ndarray
+    sensor_minutes: Dict[str, int]
+
+    @property
+    def total_wh(self) -> float:
+        return float(self.energy[-1]) if len(self.energy) else 0.0
+
+    @property
+    def peak(self) -> tuple[float, datetime.datetime]:
+        """Return the highest load and the first minute it occurs."""
+        if not len(self.load):
+            return 0.0, self.start
+        minute = int(np.argmax(self.load))
+        return float(self.load[minute]), self.start + datetime.timedelta(minutes=minute)
+
+    def summary(self, step: int = 60) -> dict:
+        """Return a JSON-ready report with the series resampled to ``step`` minutes.
+
+        ``step`` must divide a day.  Each point of the series gives the
+        cumulative energy at the end of the step and the peak load within it.
+        """
+        if step <= 0 or MINUTES_PER_DAY % step:
+            raise ValueError("step must be a divisor of 1440 minutes")
+        peak_w, peak_at = self.peak
+        steps = len(self.load) // step
+        times = np.datetime64(self.start, "m") + np.arange(steps, dtype=np.int64) * step
+        return {
+            "start": self.start.isoformat(timespec="minutes"),
+            "days": len(self.load) // MINUTES_PER_DAY,
+            "total_wh": round(self.total_wh, 3),
+            "peak_w": peak_w,
+            "peak_at": peak_at.isoformat(timespec="minutes"),
+            "sensors": {
+                sensor: {
+                    "draw_w": self.draws.get(sensor, 0.0),
+                    "on_hours": round(minutes / 60, 3),
+                    "energy_wh": round(self.draws.get(sensor, 0.0) * minutes / 60, 3),
+                }
+                for sensor, minutes in self.sensor_minutes.items()
+            },
+            "series": {
+                "step_minutes": step,
+                "time": np.datetime_as_string(times, unit="m").tolist(),
+                "energy_wh": np.round(self.energy[step - 1 :: step], 3).tolist(),
+                "peak_w": self.load.reshape(steps, step).max(axis=1).tolist(),
+            },
+        }
+
+
+def simulate(
+    schedules: Dict[str, List[dict]],
+    overrides: Dict[str, Optional[str]],
+    draws: Dict[str, float],
+    days: int = 90,
+    start: Optional[datetime.datetime] = None,
+) -> EnergyBudget:
+    """Simulate ``days`` days from ``start`` (default: now) of ``schedules``.
+
+    An active override is assumed to stay in place for the whole horizon.
+    """
+    start = (start or datetime.datetime.now()).replace(second=0, microsecond=0)
+    minutes = days * MINUTES_PER_DAY
+    origin = np.datetime64(start, "m")
+    load = np.zeros(minutes)
+    sensor_minutes: Dict[str, int] = {}
+    for sensor, sensor_schedules in schedules.items():
+        override = overrides.get(sensor)
+        if override:
+            powered = np.full(minutes, override != "off")
+        else:
+            active = [schedule for schedule in sensor_schedules if schedule["state"] != "off"]
+            on, off, _ = expand_windows(active, start.date(), days + 1)
+            first = np.clip((on - origin).astype(np.int64), 0, minutes)
+            last = np.clip((off - origin).astype(np.int64), 0, minutes)
+            steps = np.bincount(first, minlength=minutes + 1) - np.bincount(last, minlength=minutes + 1)
+            powered = np.cumsum(steps[:minutes]) > 0
+        sensor_minutes[sensor] = int(np.count_nonzero(powered))
+        watts = draws.get(sensor, 0.0)
+        if watts:
+            load += powered * watts
+    return EnergyBudget(start, dict(draws), load, np.cumsum(load) / 60, sensor_minutes)
@@ -2,20 +2,314 @@ from __future__ import annotations
 
 import datetime
 import json
+import marshal
+import os
+import sys
+import zlib
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from crontab import CronTab
+from .backend import ExecutionBackend, backend_from_env
+from .conflicts import Conflict, ConflictIndex, lint_plan
+from .metrics import instrument
+from .store import ScheduleStore, file_stamp
+from .timeline import Timeline, next_occurrence
 
+if TYPE_CHECKING:  # pragma: no cover - imported for type hints only
+    from .occurrences import OccurrenceCache, Transitions
+    from .power import EnergyBudget
 
-class ScheduleManager:
-    """Manage sensor schedules, overrides and state persistence."""
 
-    def __init__(self, storage_file: Optional[str] = None) -> None:
-        shared_dir = Path(__file__).resolve().parent.parent
-        self.scripts_dir = shared_dir / "scripts"
-        default_storage = shared_dir / "schedule_files" / "sensor_schedule.json"
-        self.storage_file = Path(storage_file) if storage_file else default_storage
+READ_ONLY_COMMANDS = ("view", "view_states", "lint")
+SHARED_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_STORAGE = SHARED_DIR / "schedule_files" / "sensor_schedule.json"
+# Bump when the layout of ScheduleSnapshot.save changes.
+CACHE_FORMAT = 1
+
+
+def storage_path(storage_file: Optional[str] = None) -> Path:
+    """Return ``storage_file``, else ``SCHEDULER_STORAGE``, else the shared sensor_schedule.json."""
+    path = storage_file or os.getenv("SCHEDULER_STORAGE")
+    return Path(path) if path else DEFAULT_STORAGE
+
+
+def cache_path(storage_file: Optional[str] = None) -> Path:
+    """Return where the startup cache of the store at ``storage_file`` lives."""
+    return storage_path(storage_file).with_suffix(".cache")
+
+# Called with the operations applied by a commit or refresh, or ``None``
+# when the whole state was reloaded.
+Listener = Callable[[Optional[List[dict]]], None]
+
+
+class _Undo(Exception):
+    """Roll back the batch of :meth:`ScheduleManager.execute_each`."""
+
+
+class ScheduleView:
+    """Queries shared by :class:`ScheduleManager` and :class:`ScheduleSnapshot`.
+
+    Subclasses provide ``sensors_channels``, ``sensors_schedule``,
+    ``sensors_override``, ``sensors_state`` and the ``timeline`` index over
+    ``sensors_schedule``.  The ``occurrences`` index is built on first use,
+    so NumPy is only imported by the views that need it.
+    """
+
+    sensors_channels: Dict[str, int]
+    sensors_schedule: Dict[str, list]
+    sensors_override: Dict[str, Optional[str]]
+    sensors_state: Dict[str, str]
+    timeline: Timeline
+    _occurrences: Optional["OccurrenceCache"] = None
+
+    @property
+    def occurrences(self) -> "OccurrenceCache":
+        if self._occurrences is None:
+            from .occurrences import OccurrenceCache
+
+            self._occurrences = OccurrenceCache(self.sensors_schedule)
+        return self._occurrences
+
+    def _invalidate(self, sensor: Optional[str] = None) -> None:
+        """Drop what the indexes derived from the schedules of ``sensor`` (default: all)."""
+        self.timeline.invalidate(sensor)
+        if self._occurrences is not None:
+            self._occurrences.invalidate(sensor)
+
+    def lint(self, schedules: Optional[Dict[str, list]] = None) -> List[Conflict]:
+        """Return the conflicts in ``schedules`` (default: the stored schedules)."""
+        return lint_plan(self.sensors_schedule if schedules is None else schedules, self.sensors_channels)
+
+    def lint_file(self, path: Path) -> List[Conflict]:
+        """Return the conflicts in the schedule file at ``path``."""
+        with open(path, "r") as file:
+            data = json.load(file)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object with a 'schedules' key")
+        try:
+            return self.lint(data.get("schedules", {}))
+        except (KeyError, TypeError, AttributeError) as exc:
+            raise ValueError(f"Malformed schedule entry: {exc!r}") from exc
+
+    @staticmethod
+    def format_conflicts(conflicts: List[Conflict]) -> str:
+        if not conflicts:
+            return "No conflicts found."
+        return "\n".join(str(conflict) for conflict in conflicts)
+
+    def _check_sensors(self, sensors: Iterable[str]) -> None:
+        for sensor in sensors:
+            if sensor not in self.sensors_channels:
+                raise ValueError(f"Unknown sensor: {sensor}")
+
+    def view_schedules(self) -> str:
+        lines: List[str] = []
+        for sensor, schedules in self.sensors_schedule.items():
+            override = self.sensors_override[sensor]
+            override_text = f" (OVERRIDE: {override})" if override else ""
+            lines.append(f"{sensor}{override_text} Schedules:")
+            for schedule in schedules:
+                lines.append(
+                    f"{schedule['id']}: Start: {schedule['start']}, End: {schedule['end']}, Repeat: {schedule['repeat']}"
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+    def state_at(self, sensor: str, when: Optional[datetime.datetime] = None) -> tuple[str, str]:
+        """Return ``(state, source)`` for ``sensor`` at ``when`` (default: now).
+
+        ``source`` is ``"override"``, ``"scheduled"`` or ``""`` when the
+        sensor is off because nothing covers ``when``.
+        """
+        override = self.sensors_override[sensor]
+        if override:
+            return override, "override"
+        schedule = self.timeline.state_at(sensor, when or datetime.datetime.now())
+        if schedule is not None:
+            return schedule["state"], "scheduled"
+        return "off", ""
+
+    def calendar(
+        self,
+        days: int = 30,
+        start: Optional[datetime.datetime] = None,
+        sensors: Optional[List[str]] = None,
+    ) -> "Transitions":
+        """Return the scheduled transitions in the ``days`` days from ``start`` (default: now).
+
+        Overrides are not applied; the jobs of an overridden sensor stay
+        disabled until the override is removed.
+        """
+        start = start or datetime.datetime.now()
+        end = start + datetime.timedelta(days=days)
+        self._check_sensors(sensors or [])
+        return self.occurrences.between(start, end, sensors)
+
+    def energy_budget(
+        self,
+        days: int = 90,
+        draws: Optional[object] = None,
+        table: Optional[Path] = None,
+    ) -> "EnergyBudget":
+        """Simulate the power used by the current schedules over ``days`` days.
+
+        Draws come from the power table (``schedule_files/power_draw.json``
+        unless ``table`` is given); ``draws`` as ``{sensor: watts}`` or
+        ``"AML=3.5,UV=12"`` takes precedence.
+        """
+        from .power import load_power_table, parse_draws, simulate
+
+        sensors = list(self.sensors_channels)
+        power = load_power_table(table, sensors)
+        if draws:
+            power.update(parse_draws(draws, sensors))
+        return simulate(self.sensors_schedule, self.sensors_override, power, days)
+
+    def view_states(self, when: Optional[datetime.datetime] = None) -> str:
+        lines: List[str] = []
+        when = when or datetime.datetime.now()
+        for sensor in self.sensors_state:
+            state, source = self.state_at(sensor, when)
+            if source == "override":
+                lines.append(f"{sensor}: {state} (OVERRIDE)")
+            elif source == "scheduled":
+                lines.append(f"{sensor}: {state} (SCHEDULED)")
+            else:
+                lines.append(f"{sensor}: off")
+        return "\n".join(lines)
+
+    def schedules_document(self) -> dict:
+        """Return the schedules and overrides as a JSON-ready dictionary."""
+        return {"schedules": self.sensors_schedule, "overrides": self.sensors_override}
+
+    def states_document(self, when: Optional[datetime.datetime] = None) -> dict:
+        """Return ``{sensor: {"state", "source"}}`` at ``when`` (default: now)."""
+        when = when or datetime.datetime.now()
+        states = {}
+        for sensor in self.sensors_state:
+            state, source = self.state_at(sensor, when)
+            states[sensor] = {"state": state, "source": source}
+        return states
+
+    # ------------------------------------------------------------------
+    # Read-only commands
+    def query(self, command: str, args: List[str]) -> str:
+        """Run one of the :data:`READ_ONLY_COMMANDS`."""
+        if command == "view":
+            return self.view_schedules()
+        if command == "view_states":
+            return self.view_states()
+        if command == "lint":
+            return self.format_conflicts(self.lint())
+        raise ValueError(f"Unknown command: {command}")
+
+
+class ScheduleSnapshot(ScheduleView):
+    """Read-only copy of a manager's state at one ``version``.
+
+    Schedule dictionaries are never modified once stored, so copying the
+    containers is enough to isolate the snapshot from later mutations.
+    """
+
+    def __init__(
+        self,
+        version: Tuple[Optional[str], int],
+        channels: Dict[str, int],
+        schedules: Dict[str, list],
+        overrides: Dict[str, Optional[str]],
+        states: Dict[str, str],
+        stamp: Tuple[int, ...] = (),
+    ) -> None:
+        self.version = version
+        self.revision = version[1]
+        self.stamp = stamp
+        self.sensors_channels = dict(channels)
+        self.sensors_schedule = {sensor: list(items) for sensor, items in schedules.items()}
+        self.sensors_override = dict(overrides)
+        self.sensors_state = dict(states)
+        self.timeline = Timeline(self.sensors_schedule)
+        self._schedules_json: Optional[bytes] = None
+
+    @property
+    def etag(self) -> str:
+        """Strong ETag of everything stored at this version."""
+        generation, revision = self.version
+        return f'"{generation}-{revision}"'
+
+    def schedules_json(self) -> bytes:
+        """Return :meth:`schedules_document` serialized once per snapshot."""
+        if self._schedules_json is None:
+            document = dict(self.schedules_document(), version=self.etag.strip('"'))
+            self._schedules_json = json.dumps(document, separators=(",", ":")).encode()
+        return self._schedules_json
+
+    def states_json(self, when: Optional[datetime.datetime] = None) -> Tuple[bytes, str]:
+        """Return the serialized :meth:`states_document` and its ETag.
+
+        States also change with time, so the ETag adds a checksum of the
+        body to the store version.
+        """
+        document = {"version": self.etag.strip('"'), "states": self.states_document(when)}
+        body = json.dumps(document, separators=(",", ":")).encode()
+        return body, f'{self.etag[:-1]}-{zlib.crc32(body):08x}"'
+
+    # ------------------------------------------------------------------
+    # Startup cache
+    def save(self, path: Path) -> None:
+        """Write the snapshot, with :meth:`schedules_json`, to ``path`` for :meth:`load`."""
+        data = (
+            CACHE_FORMAT,
+            sys.implementation.cache_tag,
+            self.stamp,
+            self.version,
+            self.sensors_channels,
+            self.sensors_schedule,
+            self.sensors_override,
+            self.sensors_state,
+            self.schedules_json(),
+        )
+        temp = path.with_name(f".{path.name}.tmp")
+        temp.write_bytes(marshal.dumps(data))
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path: Path, storage_file: Path) -> Optional["ScheduleSnapshot"]:
+        """Return the snapshot saved at ``path`` if ``storage_file`` is unchanged since.
+
+        ``marshal`` needs no parsing beyond building the objects, so this is
+        much faster than loading the store; ``None`` if there is no usable
+        cache.
+        """
+        try:
+            data = marshal.loads(path.read_bytes())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, tuple) or data[:2] != (CACHE_FORMAT, sys.implementation.cache_tag):
+            return None
+        stamp, version, channels, schedules, overrides, states, body = data[2:]
+        if not stamp or stamp != file_stamp(storage_file):
+            return None
+        snapshot = cls(version, channels, schedules, overrides, states, stamp)
+        snapshot._schedules_json = body
+        return snapshot
+
+
+class ScheduleManager(ScheduleView):
+    """Manage sensor schedules, overrides and state persistence.
+
+    Hardware actuation is delegated to ``backend``, which defaults to the
+    one selected by :func:`~.backend.backend_from_env` (cron unless
+    configured otherwise).
+    """
+
+    def __init__(
+        self,
+        storage_file: Optional[str] = None,
+        backend: Optional[ExecutionBackend] = None,
+    ) -> None:
+        self.scripts_dir = SHARED_DIR / "scripts"
+        self.storage_file = storage_path(storage_file)
         self.sensors_channels: Dict[str, int] = {
             "cDAQ": 1,
             "AML": 2,
@@ -25,38 +319,176 @@ class ScheduleManager:
             "UV": 8,
         }
         self.sensors_state: Dict[str, str] = {key: "off" for key in self.sensors_channels}
+        self.store = ScheduleStore(self.storage_file, self.sensors_channels)
         self.sensors_schedule, self.sensors_override, self.sensors_indices = self._load_from_storage()
+        self.timeline = Timeline(self.sensors_schedule)
+        self.conflicts = ConflictIndex(self.sensors_schedule, self.sensors_channels)
+        self.backend = backend if backend is not None else backend_from_env()
+        self.backend.bind(self)
+        self._batch_depth = 0
+        self._batch_ops: List[dict] = []
+        # Set once a batch has touched the in-memory state.
+        self._batch_dirty = False
+        # Set when a batch asked for a reconcile; run once it commits.
+        self._batch_reconcile = False
+        self._listeners: List[Listener] = []
 
     # ------------------------------------------------------------------
     # Persistence helpers
     def _load_from_storage(self) -> tuple[Dict[str, list], Dict[str, Optional[str]], Dict[str, int]]:
-        """Load schedules, overrides and indices from the storage file."""
+        """Load schedules, overrides and indices from the snapshot and journal."""
+        return self.store.load()
+
+    def _persist(self, op: dict) -> None:
+        """Journal ``op`` when the current batch commits."""
+        self._batch_ops.append(op)
+        if not self._batch_depth:
+            self._commit()
+
+    @property
+    def revision(self) -> int:
+        """Counter bumped by every committed batch of mutations."""
+        return self.store.revision
+
+    @property
+    def version(self) -> Tuple[Optional[str], int]:
+        """``(generation, revision)``; changes whenever the stored state does."""
+        return self.store.generation, self.store.revision
+
+    def snapshot(self) -> ScheduleSnapshot:
+        """Return a read-only copy of the current state."""
+        return ScheduleSnapshot(
+            self.version,
+            self.sensors_channels,
+            self.sensors_schedule,
+            self.sensors_override,
+            self.sensors_state,
+            self.store.stamp,
+        )
+
+    # ------------------------------------------------------------------
+    # Transactions
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group mutations so the backend and storage are each written once.
+
+        If the block raises, nothing is written and the in-memory state is
+        reloaded from storage, so a batch is applied entirely or not at all.
+        Batches may be nested; only the outermost one commits.
+
+        The outermost batch holds the store lock and first catches up with
+        changes made by other processes, so its mutations apply on top of
+        the latest state.
+        """
+        if not self._batch_depth:
+            self.store.acquire()
+            try:
+                self.refresh()
+            except BaseException:
+                self.store.release()
+                raise
+        self._batch_depth += 1
         try:
-            with open(self.storage_file, "r") as file:
-                data = json.load(file)
-            schedules = data.get("schedules", {key: [] for key in self.sensors_channels})
-            overrides = data.get("overrides", {key: None for key in self.sensors_channels})
-            indices = data.get("indices", {key: 0 for key in self.sensors_channels})
-        except FileNotFoundError:
-            schedules = {key: [] for key in self.sensors_channels}
-            overrides = {key: None for key in self.sensors_channels}
-            indices = {key: 0 for key in self.sensors_channels}
-            self._save_to_storage(schedules, overrides, indices)
-        return schedules, overrides, indices
-
-    def _save_to_storage(
-        self,
-        schedules: Dict[str, list],
-        overrides: Dict[str, Optional[str]],
-        indices: Dict[str, int],
-    ) -> None:
-        data = {"schedules": schedules, "overrides": overrides, "indices": indices}
-        with open(self.storage_file, "w") as file:
-            json.dump(data, file, indent=4)
+            yield
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                try:
+                    self._rollback()
+                finally:
+                    self.store.release()
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            try:
+                self._commit()
+            finally:
+                self.store.release()
+
+    def _commit(self) -> None:
+        ops, self._batch_ops = self._batch_ops, []
+        self._batch_dirty = False
+        reconcile, self._batch_reconcile = self._batch_reconcile, False
+        self.store.append(ops, (self.sensors_schedule, self.sensors_override, self.sensors_indices))
+        self.backend.commit()
+        if reconcile:
+            self.backend.reconcile()
+        if ops:
+            self._notify(ops)
+
+    def _rollback(self) -> None:
+        self.backend.rollback()
+        self._batch_ops = []
+        self._batch_reconcile = False
+        if self._batch_dirty:
+            self._batch_dirty = False
+            self.reload()
 
-    def _persist(self) -> None:
-        """Persist current schedules and overrides to storage."""
-        self._save_to_storage(self.sensors_schedule, self.sensors_override, self.sensors_indices)
+    def reconcile(self) -> Optional[Dict[str, int]]:
+        """Bring the execution backend in line with the stored schedules.
+
+        Inside a batch the backend is reconciled once the outermost batch
+        has committed, so a batch that rolls back never reaches it, and
+        ``None`` is returned.  Otherwise returns the backend's change counts.
+        """
+        if self._batch_depth:
+            self._batch_reconcile = True
+            return None
+        return self.backend.reconcile()
+
+    # ------------------------------------------------------------------
+    # Change notification
+    def add_listener(self, listener: Listener) -> None:
+        """Call ``listener`` after every change, local or from another process."""
+        self._listeners.append(listener)
+
+    def _notify(self, ops: Optional[List[dict]]) -> None:
+        for listener in self._listeners:
+            listener(ops)
+
+    def refresh(self) -> bool:
+        """Catch up with changes other processes made to the storage file.
+
+        Only the journal lines appended since the last look are read, and
+        only the indexes of the sensors they touch are invalidated.  The
+        execution backend is left alone: the process that made a change
+        already handed it to its own backend.  Returns whether anything
+        changed.
+        """
+        if not self.store.changed():
+            return False
+        ops = self.store.refresh((self.sensors_schedule, self.sensors_override, self.sensors_indices))
+        if ops is None:
+            self.reload()
+            return True
+        if not ops:
+            return False
+        for op in ops:
+            sensor = op.get("sensor")
+            if sensor is None:
+                self._invalidate()
+            else:
+                self._invalidate(sensor)
+                if op["op"] == "override" and op["state"]:
+                    self.sensors_state[sensor] = op["state"]
+        self.conflicts.invalidate()
+        self._notify(ops)
+        return True
+
+    @instrument("reload")
+    def reload(self) -> None:
+        """Replace the in-memory state with the contents of the storage file."""
+        schedules, overrides, indices = self._load_from_storage()
+        for current, stored in (
+            (self.sensors_schedule, schedules),
+            (self.sensors_override, overrides),
+            (self.sensors_indices, indices),
+        ):
+            current.clear()
+            current.update(stored)
+        self._invalidate()
+        self.conflicts.invalidate()
+        self._notify(None)
 
     # ------------------------------------------------------------------
     # Utility parsing helpers
@@ -69,25 +501,6 @@ class ScheduleManager:
         days_map = {"Mon": 1, "Tue": 2, "Wed": 3, "Thu": 4, "Fri": 5, "Sat": 6, "Sun": 0}
         return [days_map[day] for day in days_str.split(",") if day in days_map]
 
-    # ------------------------------------------------------------------
-    # Cron helpers
-    def _add_crontab_job(self, sensor: str, state: str, time: str, tag: str) -> None:
-        cron = CronTab(user=True)
-        if state == "logging":
-            command = (
-                f'echo "Sensor {sensor} is now logging" '
-                f'&& python {self.scripts_dir / "LogSerialData.py"}'
-            )
-        else:
-            channel = self.sensors_channels[sensor]
-            command = (
-                f'echo "Sensor {sensor} is now in state {state}" '
-                f'&& /home/admin/8mosfet-rpi/8mosfet 0 write {channel} {state}'
-            )
-        job = cron.new(command=command, comment=tag)
-        job.setall(time)
-        cron.write()
-
     # ------------------------------------------------------------------
     # Schedule operations
     def add_schedule(
@@ -100,8 +513,11 @@ class ScheduleManager:
         days: Optional[List[int]] = None,
         end_repeat: Optional[str] = None,
     ) -> str:
-        """Add a schedule for ``sensor`` and create corresponding cron jobs."""
-        schedule_index = self.sensors_indices[sensor]
+        """Add a schedule for ``sensor`` and hand it to the execution backend.
+
+        Raises ``ValueError`` if the schedule overlaps another schedule on
+        the same MOSFET channel.
+        """
         schedule = {
             "start": start,
             "end": end,
@@ -109,140 +525,141 @@ class ScheduleManager:
             "state": state,
             "days": days,
             "end_repeat": end_repeat,
-            "id": schedule_index,
         }
+        if not repeat:
+            schedule["date"] = next_occurrence(days).isoformat()
+        self._check_sensors([sensor])
+        with self.batch():
+            schedule["id"] = self.sensors_indices[sensor]
+            conflicts = self.conflicts.check(sensor, schedule)
+            if conflicts:
+                raise ValueError("Schedule conflicts: " + "; ".join(str(conflict) for conflict in conflicts))
+            schedule_index = self._insert(sensor, schedule)
+        return f"Schedule added for {sensor} with state '{state}' [Index: #{schedule_index}]."
+
+    def insert_schedules(self, schedules: Iterable[Tuple[str, dict]]) -> List[int]:
+        """Add ``(sensor, schedule)`` pairs in one batch without checking conflicts.
+
+        The schedules must already be validated, e.g. by
+        :func:`~.importer.validate_entry`.  Returns the ids they were given.
+        """
+        with self.batch():
+            return [self._insert(sensor, schedule) for sensor, schedule in schedules]
+
+    def _insert(self, sensor: str, schedule: dict) -> int:
+        self._batch_dirty = True
+        schedule_index = schedule["id"] = self.sensors_indices[sensor]
         self.sensors_indices[sensor] += 1
         self.sensors_schedule[sensor].append(schedule)
+        self._invalidate(sensor)
+        self.conflicts.added(sensor, schedule)
+        self.backend.schedule_added(sensor, schedule)
+        self._persist({"op": "add", "sensor": sensor, "schedule": schedule})
+        return schedule_index
 
-        start_hours, start_minutes = start.split(":")
-        end_hours, end_minutes = end.split(":")
-        start_tag = f"sensor_{sensor}_schedule_{schedule_index}_start"
-        end_tag = f"sensor_{sensor}_schedule_{schedule_index}_end"
+    def replace_schedules(
+        self,
+        schedules: Dict[str, list],
+        overrides: Dict[str, Optional[str]],
+        indices: Dict[str, int],
+    ) -> None:
+        """Replace every schedule and override, then reconcile the backend once.
 
-        cron_dates = "*"
-        cron_days = "*"
-        cron_months = "*"
-        if not repeat:
-            if days:
-                next_occurrence = datetime.datetime.now().date()
-                while next_occurrence.weekday() not in days:
-                    next_occurrence += datetime.timedelta(days=1)
-                cron_dates = next_occurrence.strftime("%d")
-                cron_months = next_occurrence.strftime("%m")
-            else:
-                today = datetime.datetime.now().date()
-                cron_dates = today.strftime("%d")
-                cron_months = today.strftime("%m")
-                cron_days = str(today.isoweekday())
-            start_time_cron = f"{start_minutes} {start_hours} {cron_dates} {cron_months} {cron_days}"
-            end_time_cron = f"{end_minutes} {end_hours} {cron_dates} {cron_months} {cron_days}"
-            self._add_crontab_job(sensor, state, start_time_cron, start_tag)
-            self._add_crontab_job(sensor, "off", end_time_cron, end_tag)
-        else:
-            if days:
-                cron_days = ",".join(str(day) for day in days)
-            if end_repeat:
-                end_date = self._parse_date(end_repeat)
-                cron_months = f"{datetime.datetime.now().month}-{end_date.month}"
-                cron_dates = f"{datetime.datetime.now().isoweekday()}-{end_date.isoweekday()}"
-            start_time_cron = f"{start_minutes} {start_hours} {cron_dates} {cron_months} {cron_days}"
-            end_time_cron = f"{end_minutes} {end_hours} {cron_dates} {cron_months} {cron_days}"
-            self._add_crontab_job(sensor, state, start_time_cron, start_tag)
-            self._add_crontab_job(sensor, "off", end_time_cron, end_tag)
-
-        self._persist()
-        return f"Schedule added for {sensor} with state '{state}' [Index: #{schedule_index}]."
+        Like :meth:`insert_schedules`, ``schedules`` must already be
+        validated.  The backend is reconciled when the outermost batch
+        commits.
+        """
+        with self.batch():
+            self._batch_dirty = True
+            for current, new in (
+                (self.sensors_schedule, schedules),
+                (self.sensors_override, overrides),
+                (self.sensors_indices, indices),
+            ):
+                current.clear()
+                current.update(new)
+            for sensor, state in overrides.items():
+                if state:
+                    self.sensors_state[sensor] = state
+            self._invalidate()
+            self.conflicts.invalidate()
+            self._persist({"op": "replace", "schedules": schedules, "overrides": overrides, "indices": indices})
+            self.reconcile()
 
     def remove_schedule(self, sensor: str, index: int) -> str:
-        for i, schedule in enumerate(self.sensors_schedule[sensor]):
-            if schedule["id"] == index:
-                self.sensors_schedule[sensor].pop(i)
-                break
-        else:
-            raise ValueError("Invalid schedule index.")
-
-        cron = CronTab(user=True)
-        tag_start = f"sensor_{sensor}_schedule_{index}_start"
-        tag_end = f"sensor_{sensor}_schedule_{index}_end"
-        for job in cron:
-            if job.comment in {tag_start, tag_end}:
-                cron.remove(job)
-        cron.write()
-        self._persist()
-        return f"Schedule {index} removed from sensor {sensor}."
-
-    def view_schedules(self) -> str:
-        lines: List[str] = []
-        for sensor, schedules in self.sensors_schedule.items():
-            override = self.sensors_override[sensor]
-            override_text = f" (OVERRIDE: {override})" if override else ""
-            lines.append(f"{sensor}{override_text} Schedules:")
-            for schedule in schedules:
-                lines.append(
-                    f"{schedule['id']}: Start: {schedule['start']}, End: {schedule['end']}, Repeat: {schedule['repeat']}"
-                )
-            lines.append("")
-        return "\n".join(lines)
-
-    def view_states(self) -> str:
-        lines: List[str] = []
-        now = datetime.datetime.now().time()
-        for sensor, _ in self.sensors_state.items():
-            override = self.sensors_override[sensor]
-            if override:
-                lines.append(f"{sensor}: {override} (OVERRIDE)")
-                continue
-            found = False
-            for schedule in self.sensors_schedule[sensor]:
-                start_time = datetime.datetime.strptime(schedule["start"], "%H:%M").time()
-                end_time = datetime.datetime.strptime(schedule["end"], "%H:%M").time()
-                if start_time <= now <= end_time:
-                    lines.append(f"{sensor}: {schedule['state']} (SCHEDULED)")
-                    found = True
+        self._check_sensors([sensor])
+        with self.batch():
+            for i, schedule in enumerate(self.sensors_schedule[sensor]):
+                if schedule["id"] == index:
                     break
-            if not found:
-                lines.append(f"{sensor}: off")
-        return "\n".join(lines)
+            else:
+                raise ValueError("Invalid schedule index.")
+            self._batch_dirty = True
+            self.sensors_schedule[sensor].pop(i)
+            self._invalidate(sensor)
+            self.conflicts.removed(sensor, schedule)
+            self.backend.schedule_removed(sensor, schedule)
+            self._persist({"op": "remove", "sensor": sensor, "id": index})
+        return f"Schedule {index} removed from sensor {sensor}."
 
     def override_sensor(self, sensors: List[str], state: str) -> str:
-        cron = CronTab(user=True)
-        for sensor in sensors:
-            self.sensors_state[sensor] = state
-            self.sensors_override[sensor] = state
-            for job in cron.find_comment(f"sensor_{sensor}_schedule_"):
-                job.enable(False)
-            if state == "logging":
-                command = (
-                    f'echo "Sensor {sensor} is now logging" '
-                    f'&& python {self.scripts_dir / "LogSerialData.py"}'
-                )
-            else:
-                channel = self.sensors_channels[sensor]
-                command = (
-                    f'echo "Sensor {sensor} is now overridden to state {state}" '
-                    f'&& /home/admin/8mosfet-rpi/8mosfet 0 write {channel} {state}'
-                )
-            job = cron.new(command=command, comment=f"override_{sensor}")
-            job.setall("* * * * *")
-        cron.write()
-        self._persist()
+        self._check_sensors(sensors)
+        with self.batch():
+            self._batch_dirty = True
+            for sensor in sensors:
+                self.sensors_state[sensor] = state
+                self.sensors_override[sensor] = state
+                self.backend.override_set(sensor, state)
+                self._persist({"op": "override", "sensor": sensor, "state": state})
         return f"Sensors {', '.join(sensors)} overridden to '{state}'."
 
     def remove_override(self, sensors: List[str]) -> str:
-        cron = CronTab(user=True)
-        for sensor in sensors:
-            self.sensors_override[sensor] = None
-            for job in cron.find_comment(f"override_{sensor}"):
-                cron.remove(job)
-            for job in cron.find_comment(f"sensor_{sensor}_schedule_"):
-                job.enable(True)
-        cron.write()
-        self._persist()
+        self._check_sensors(sensors)
+        with self.batch():
+            self._batch_dirty = True
+            for sensor in sensors:
+                self.sensors_override[sensor] = None
+                self.backend.override_removed(sensor)
+                self._persist({"op": "override", "sensor": sensor, "state": None})
         return f"Override removed for sensors {', '.join(sensors)}."
 
+    def apply_ops(self, ops: Iterable[dict]) -> None:
+        """Replay journal operations recorded by another store in one batch.
+
+        Added schedules keep their ids.  An id the local indices do not
+        expect, or a removal of a missing schedule, means the two stores
+        have diverged and raises ``ValueError``.
+        """
+        with self.batch():
+            for op in ops:
+                kind = op["op"]
+                if kind == "replace":
+                    self.replace_schedules(op["schedules"], op["overrides"], op["indices"])
+                    continue
+                sensor = op["sensor"]
+                self._check_sensors([sensor])
+                if kind == "add":
+                    schedule = dict(op["schedule"])
+                    expected = self.sensors_indices[sensor]
+                    if schedule["id"] != expected:
+                        raise ValueError(f"Out of sync: expected {sensor} #{expected}, got #{schedule['id']}")
+                    self._insert(sensor, schedule)
+                elif kind == "remove":
+                    self.remove_schedule(sensor, op["id"])
+                elif kind == "override":
+                    if op["state"]:
+                        self.override_sensor([sensor], op["state"])
+                    else:
+                        self.remove_override([sensor])
+                else:
+                    raise ValueError(f"Unknown operation: {kind}")
+
     # ------------------------------------------------------------------
     # Dispatcher used by API
+    @instrument("execute")
     def execute(self, command: str, args: List[str]) -> str:
+        if command in READ_ONLY_COMMANDS:
+            return self.query(command, args)
         if command == "add":
             if len(args) < 4:
                 raise ValueError("Insufficient arguments for add")
@@ -260,8 +677,54 @@ class ScheduleManager:
         if command == "remove_override":
             sensor = args[0]
             return self.remove_override(sensor.split(","))
-        if command == "view":
-            return self.view_schedules()
-        if command == "view_states":
-            return self.view_states()
+        if command == "reconcile":
+            counts = self.reconcile()
+            if counts is None:
+                return "Reconcile queued until the batch commits."
+            return "Reconciled: " + ", ".join(f"{key} {value}" for key, value in counts.items())
         raise ValueError(f"Unknown command: {command}")
+
+    def execute_many(self, commands: Iterable[Tuple[str, Sequence[str]]]) -> List[str]:
+        """Run ``(command, args)`` pairs as one :meth:`batch` and return their results."""
+        with self.batch():
+            return [self.execute(command, list(args)) for command, args in commands]
+
+    def execute_each(
+        self, commands: Sequence[Tuple[str, Sequence[str]]], atomic: bool = False
+    ) -> List[Tuple[bool, Any]]:
+        """Run ``(command, args)`` pairs in one batch, leaving out those that fail.
+
+        Commands check their arguments against the in-memory state before
+        they change anything, so a rejected command is skipped and the
+        others still share one commit.  Only a command that fails after
+        changing the state rolls the batch back; the others are then
+        applied once more without it.  With ``atomic`` the first failure
+        aborts everything instead.  Returns ``(True, result)`` or
+        ``(False, exception)`` for each command.
+        """
+        failed: Dict[int, Exception] = {}
+        while True:
+            results: Dict[int, str] = {}
+            try:
+                with self.batch():
+                    for index, (command, args) in enumerate(commands):
+                        if index in failed:
+                            continue
+                        dirty, self._batch_dirty = self._batch_dirty, False
+                        try:
+                            results[index] = self.execute(command, list(args))
+                        except Exception as exc:
+                            failed[index] = exc
+                            if atomic or self._batch_dirty:
+                                raise _Undo from exc
+                        finally:
+                            self._batch_dirty = self._batch_dirty or dirty
+            except _Undo:
+                if not atomic:
+                    continue
+                aborted = ValueError("Not applied: another command in the batch failed")
+                return [(False, failed.get(index, aborted)) for index in range(len(commands))]
+            return [
+                (False, failed[index]) if index in failed else (True, results[index])
+                for index in range(len(commands))
+            ]
@@ -0,0 +1,262 @@
+"""In-process asyncio scheduler used instead of cron to execute schedules.
+
+Run it as a long-lived service next to the web applications, which should
+then be started with ``SCHEDULER_BACKEND=daemon`` so they only record
+changes::
+
+    python -m webapps.shared.services.scheduler_daemon --clear-cron
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .backend import MOSFET_CLI, ExecutionBackend
+from .mosfet import CONFIG_ENV, MosfetDriver
+from .schedule_manager import ScheduleManager
+from .timeline import occurrences
+
+logger = logging.getLogger(__name__)
+
+Actuator = Callable[[Dict[str, str]], None]
+
+
+class SensorActuator:
+    """Apply a set of sensor state changes.
+
+    Channel changes go through ``driver`` as one register write when a
+    :class:`~.mosfet.MosfetDriver` is given, otherwise through the
+    ``8mosfet`` CLI executed directly rather than through a shell.  A
+    serial logger started for the ``logging`` state is stopped on the
+    sensor's next transition.
+    """
+
+    def __init__(self, manager: ScheduleManager, driver: Optional[MosfetDriver] = None) -> None:
+        self.manager = manager
+        self.driver = driver
+        self._loggers: Dict[str, subprocess.Popen] = {}
+
+    def __call__(self, changes: Dict[str, str]) -> None:
+        channels: Dict[int, str] = {}
+        for sensor, state in changes.items():
+            process = self._loggers.pop(sensor, None)
+            if process is not None:
+                process.terminate()
+            if state == "logging":
+                self._loggers[sensor] = subprocess.Popen(
+                    [sys.executable, "-m", "webapps.shared.scripts.LogSerialData"],
+                    cwd=self.manager.scripts_dir.parents[2],
+                )
+            else:
+                channels[self.manager.sensors_channels[sensor]] = state
+        if self.driver is not None:
+            if channels:
+                self.driver.apply(channels)
+            return
+        for channel, state in channels.items():
+            subprocess.run([MOSFET_CLI, "0", "write", str(channel), state], check=True)
+
+
+class AsyncioBackend(ExecutionBackend):
+    """Fire schedule transitions from a heap on an asyncio event loop.
+
+    Transitions are planned ``horizon`` ahead and re-planned whenever a
+    batch commits.  Overrides are applied immediately; removing one applies
+    whatever the schedules say the sensor should currently be doing.
+    Changes that fall due together are handed to the actuator as one set.
+    """
+
+    def __init__(
+        self,
+        actuator: Optional[Actuator] = None,
+        driver: Optional[MosfetDriver] = None,
+        horizon: datetime.timedelta = datetime.timedelta(days=1),
+    ) -> None:
+        self.actuator = actuator
+        self.driver = driver
+        self.horizon = horizon
+        self._heap: List[Tuple[datetime.datetime, int, str, str]] = []
+        self._counter = itertools.count()
+        self._planned_until: Optional[datetime.datetime] = None
+        self._lock = threading.Lock()
+        self._staged: List[Tuple[str, Optional[str]]] = []
+        self._staged_dirty = False
+        self._pending: List[Tuple[str, Optional[str]]] = []
+        self._dirty = True
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def bind(self, manager: ScheduleManager) -> None:
+        super().bind(manager)
+        if self.actuator is None:
+            self.actuator = SensorActuator(manager, self.driver)
+
+    # ------------------------------------------------------------------
+    # Backend hooks
+    def schedule_added(self, sensor: str, schedule: dict) -> None:
+        self._staged_dirty = True
+
+    def schedule_removed(self, sensor: str, schedule: dict) -> None:
+        self._staged_dirty = True
+
+    def override_set(self, sensor: str, state: str) -> None:
+        self._staged.append((sensor, state))
+
+    def override_removed(self, sensor: str) -> None:
+        self._staged.append((sensor, None))
+
+    def commit(self) -> None:
+        with self._lock:
+            self._pending.extend(self._staged)
+            self._dirty = self._dirty or self._staged_dirty
+        self._staged = []
+        self._staged_dirty = False
+        self.wakeup()
+
+    def rollback(self) -> None:
+        self._staged = []
+        self._staged_dirty = False
+
+    def resync(self) -> None:
+        """Re-plan and re-apply the current state of every sensor."""
+        with self._lock:
+            self._pending.extend((sensor, None) for sensor in self.manager.sensors_channels)
+            self._dirty = True
+        self.wakeup()
+
+    def reconcile(self) -> Dict[str, int]:
+        self.resync()
+        return {"resynced": len(self.manager.sensors_channels)}
+
+    def wakeup(self) -> None:
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ------------------------------------------------------------------
+    # Event loop
+    def _plan(self, now: datetime.datetime) -> None:
+        self._heap = []
+        until = now + self.horizon
+        for sensor, schedules in self.manager.sensors_schedule.items():
+            for schedule in schedules:
+                for on, off in occurrences(schedule, now, until):
+                    if on >= now:
+                        self._heap.append((on, next(self._counter), sensor, schedule["state"]))
+                    self._heap.append((off, next(self._counter), sensor, "off"))
+        heapq.heapify(self._heap)
+        self._planned_until = until
+
+    async def _fire(self, changes: List[Tuple[str, Optional[str]]]) -> None:
+        resolved: Dict[str, str] = {}
+        for sensor, state in changes:
+            resolved[sensor] = state if state is not None else self.manager.state_at(sensor)[0]
+        if not resolved:
+            return
+        try:
+            await asyncio.to_thread(self.actuator, resolved)
+        except Exception:
+            logger.exception("Failed to apply %s", resolved)
+            return
+        for sensor, state in resolved.items():
+            self.manager.sensors_state[sensor] = state
+            logger.info("Sensor %s is now in state %s", sensor, state)
+
+    async def serve(self) -> None:
+        """Run until cancelled, starting from the current scheduled states."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.resync()
+        while True:
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, []
+                dirty, self._dirty = self._dirty, False
+            await self._fire(pending)
+            now = datetime.datetime.now()
+            if dirty or self._planned_until is None or now >= self._planned_until:
+                self._plan(now)
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, sensor, state = heapq.heappop(self._heap)
+                if not self.manager.sensors_override.get(sensor):
+                    due.append((sensor, state))
+            await self._fire(due)
+            now = datetime.datetime.now()
+            wake_at = self._heap[0][0] if self._heap else self._planned_until
+            delay = max((wake_at - now).total_seconds(), 0.0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _watch_storage(manager: ScheduleManager, interval: float) -> None:
+    """Pick up changes other processes make to the schedule store."""
+    while True:
+        await asyncio.sleep(interval)
+        if manager.refresh():
+            manager.reconcile()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Asyncio sensor scheduler daemon")
+    parser.add_argument("--storage", help="Schedule storage file (default: shared sensor_schedule.json)")
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for schedule changes made by other processes",
+    )
+    parser.add_argument(
+        "--driver",
+        choices=["cli", "i2c"],
+        default="cli",
+        help="Switch channels through the 8mosfet CLI or a persistent I2C handle",
+    )
+    parser.add_argument(
+        "--mosfet-config",
+        default=os.getenv(CONFIG_ENV),
+        help=f"I2C address and channel map for --driver i2c (default: {CONFIG_ENV})",
+    )
+    parser.add_argument(
+        "--clear-cron",
+        action="store_true",
+        help="Remove jobs installed by the cron backend before starting",
+    )
+    args = parser.parse_args(argv)
+    if args.driver == "i2c" and not args.mosfet_config:
+        parser.error(f"--driver i2c needs --mosfet-config or {CONFIG_ENV}")
+    return args
+
+
+async def run(args: argparse.Namespace) -> None:
+    driver = MosfetDriver.from_file(args.mosfet_config) if args.driver == "i2c" else None
+    backend = AsyncioBackend(driver=driver)
+    manager = ScheduleManager(args.storage, backend=backend)
+    if args.clear_cron:
+        from .cron_backend import CronBackend
+
+        CronBackend().clear()
+    await asyncio.gather(backend.serve(), _watch_storage(manager, args.poll))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(run(parse_args(argv)))
+    except KeyboardInterrupt:
+        print("Exiting...")
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    main()
@@ -0,0 +1,305 @@
+"""Crash-safe schedule storage: a JSON snapshot plus an append-only journal.
+
+``sensor_schedule.json`` remains the human readable snapshot.  Every
+committed batch of mutations is appended to ``sensor_schedule.journal``
+as JSON lines and fsynced, so a mutation costs one small append instead
+of rewriting every schedule.  Once the journal grows past
+``compact_every`` operations the state is written to a new snapshot,
+which atomically replaces the old one, and the journal starts over.
+
+The journal's first line names the snapshot ``generation`` it applies
+to.  A snapshot replaced by hand (e.g. an uploaded schedule file) has a
+different or no generation, so a stale journal is ignored.
+
+Several processes may share one store.  Writers hold an exclusive
+``flock`` on ``sensor_schedule.lock`` while they catch up and append, and
+every process notices changes made by the others with a ``stat`` of the
+snapshot and journal, then reads only the journal lines appended since.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import instrument
+
+State = Tuple[Dict[str, list], Dict[str, Optional[str]], Dict[str, int]]
+
+
+def _fsync_dir(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # pragma: no cover - platforms without directory fds
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def file_stamp(snapshot: Path) -> Tuple[int, ...]:
+    """Return the inode, mtime and size of ``snapshot`` and its journal.
+
+    Any write to the store changes the stamp, so it tells whether state
+    derived from the store is still current without reading it.
+    """
+    stamp: List[int] = []
+    for path in (snapshot, snapshot.with_suffix(".journal")):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            stamp.extend((0, 0, 0))
+        else:
+            stamp.extend((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def apply_op(state: State, op: dict) -> None:
+    """Apply one journal operation to ``state`` in place."""
+    schedules, overrides, indices = state
+    kind = op["op"]
+    sensor = op.get("sensor")
+    if kind == "add":
+        schedule = op["schedule"]
+        schedules.setdefault(sensor, []).append(schedule)
+        indices[sensor] = max(indices.get(sensor, 0), schedule["id"] + 1)
+    elif kind == "remove":
+        schedules[sensor] = [s for s in schedules.get(sensor, []) if s["id"] != op["id"]]
+    elif kind == "override":
+        overrides[sensor] = op["state"]
+    elif kind == "replace":
+        for current, key in ((schedules, "schedules"), (overrides, "overrides"), (indices, "indices")):
+            current.clear()
+            current.update(op[key])
+    else:
+        raise ValueError(f"Unknown journal operation: {kind}")
+
+
+class ScheduleStore:
+    """Load and persist the schedule state of one storage file."""
+
+    def __init__(self, snapshot: Path, sensors: Iterable[str], compact_every: int = 500) -> None:
+        self.snapshot = Path(snapshot)
+        self.journal = self.snapshot.with_suffix(".journal")
+        self.lock_file = self.snapshot.with_suffix(".lock")
+        self.sensors = list(sensors)
+        self.compact_every = compact_every
+        self.generation: Optional[str] = None
+        self.revision = 0
+        self._journal_ops = 0
+        self._offset = 0
+        self._stamp: Tuple[int, ...] = ()
+        self._lock_fd: Optional[int] = None
+        self._lock_depth = 0
+
+    def _empty(self) -> State:
+        return (
+            {key: [] for key in self.sensors},
+            {key: None for key in self.sensors},
+            {key: 0 for key in self.sensors},
+        )
+
+    # ------------------------------------------------------------------
+    # Inter-process locking
+    def acquire(self) -> None:
+        """Take the exclusive store lock; nested calls only count."""
+        if not self._lock_depth:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            self._lock_fd = fd
+        self._lock_depth += 1
+
+    def release(self) -> None:
+        self._lock_depth -= 1
+        if not self._lock_depth:
+            fd, self._lock_fd = self._lock_fd, None
+            os.close(fd)  # closing the descriptor drops the flock
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _current_stamp(self) -> Tuple[int, ...]:
+        return file_stamp(self.snapshot)
+
+    @property
+    def stamp(self) -> Tuple[int, ...]:
+        """The :func:`file_stamp` of the files as the loaded state last matched them."""
+        return self._stamp
+
+    def changed(self) -> bool:
+        """Return whether another process changed the store since we last looked."""
+        return self._current_stamp() != self._stamp
+
+    # ------------------------------------------------------------------
+    # Loading
+    def load(self) -> State:
+        """Return the snapshot with the matching journal replayed on top."""
+        with self.locked():
+            state = self._load()
+            self._stamp = self._current_stamp()
+            return state
+
+    def refresh(self, state: State) -> Optional[List[dict]]:
+        """Apply the journal entries other processes appended to ``state``.
+
+        Returns the applied operations, or ``None`` if the snapshot was
+        replaced and ``state`` must be reloaded with :meth:`load`.
+        """
+        with self.locked():
+            current = self._current_stamp()
+            if current == self._stamp:
+                return []
+            # Same snapshot and journal files: only lines were appended.
+            if current[0:3] != self._stamp[0:3] or current[3] != self._stamp[3]:
+                return None
+            ops: List[dict] = []
+            with open(self.journal, "rb") as file:
+                file.seek(self._offset)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    entry = json.loads(line)
+                    for op in entry["ops"]:
+                        apply_op(state, op)
+                    ops.extend(entry["ops"])
+                    self.revision = entry["rev"]
+                    self._journal_ops += len(entry["ops"])
+                    self._offset = file.tell()
+            self._stamp = self._current_stamp()
+            return ops
+
+    def _load(self) -> State:
+        try:
+            with open(self.snapshot, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            state = self._empty()
+            self.revision = 0
+            self.write_snapshot(state)
+            return state
+        default = self._empty()
+        state = (
+            data.get("schedules", default[0]),
+            data.get("overrides", default[1]),
+            data.get("indices", default[2]),
+        )
+        for current, blank in zip(state, default):
+            for sensor in self.sensors:
+                current.setdefault(sensor, blank[sensor])
+        self.revision = data.get("revision", 0)
+        generation = data.get("generation")
+        replayed = self._replay(state, generation) if generation else None
+        if replayed is None:
+            # No journal for this snapshot: start one.
+            self.write_snapshot(state)
+        elif replayed >= self.compact_every:
+            self.write_snapshot(state)
+        else:
+            self.generation = generation
+            self._journal_ops = replayed
+        return state
+
+    def _replay(self, state: State, generation: str) -> Optional[int]:
+        """Apply journal entries for ``generation``; ``None`` if there is no such journal."""
+        try:
+            file = open(self.journal, "rb")
+        except FileNotFoundError:
+            return None
+        count = 0
+        good = 0
+        with file:
+            header = file.readline()
+            try:
+                if json.loads(header).get("generation") != generation:
+                    return None
+            except ValueError:
+                return None
+            good = file.tell()
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a power cut; drop the tail
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                for op in entry["ops"]:
+                    apply_op(state, op)
+                self.revision = entry["rev"]
+                count += len(entry["ops"])
+                good = file.tell()
+        if good != os.path.getsize(self.journal):
+            with open(self.journal, "r+b") as file:
+                file.truncate(good)
+        self._offset = good
+        return count
+
+    # ------------------------------------------------------------------
+    # Writing
+    @instrument("journal_append")
+    def append(self, ops: List[dict], state: State) -> None:
+        """Durably record ``ops``, which have already been applied to ``state``.
+
+        The caller must hold the lock and have caught up with :meth:`refresh`.
+        """
+        if not ops:
+            return
+        self.revision += 1
+        if self._journal_ops + len(ops) >= self.compact_every:
+            self._write_snapshot(state)
+            return
+        line = json.dumps({"rev": self.revision, "ops": ops}, separators=(",", ":")) + "\n"
+        with open(self.journal, "ab") as file:
+            file.write(line.encode())
+            file.flush()
+            os.fsync(file.fileno())
+            self._offset = file.tell()
+        self._journal_ops += len(ops)
+        self._stamp = self._current_stamp()
+
+    def write_snapshot(self, state: State) -> None:
+        """Atomically replace the snapshot with ``state`` and start a new journal."""
+        with self.locked():
+            self._write_snapshot(state)
+
+    @instrument("snapshot_write")
+    def _write_snapshot(self, state: State) -> None:
+        schedules, overrides, indices = state
+        self.generation = uuid.uuid4().hex
+        data = {
+            "schedules": schedules,
+            "overrides": overrides,
+            "indices": indices,
+            "generation": self.generation,
+            "revision": self.revision,
+        }
+        self._replace(self.snapshot, json.dumps(data, indent=4))
+        header = json.dumps({"generation": self.generation}) + "\n"
+        self._replace(self.journal, header)
+        _fsync_dir(self.snapshot.parent)
+        self._journal_ops = 0
+        self._offset = len(header.encode())
+        self._stamp = self._current_stamp()
+
+    @staticmethod
+    def _replace(path: Path, content: str) -> None:
+        temp = path.with_name(f".{path.name}.tmp")
+        with open(temp, "w") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, path)
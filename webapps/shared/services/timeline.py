@@ -0,0 +1,213 @@
+"""Precompiled per-sensor timeline index used to answer state queries."""
+
+from __future__ import annotations
+
+import bisect
+import datetime
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+ALL_DAYS = (0, 1, 2, 3, 4, 5, 6)
+
+
+def parse_hhmm(value: str) -> int:
+    """Return the minute of the day for an ``HH:MM`` string."""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def cron_weekday(date: datetime.date) -> int:
+    """Return the cron day of week (``0`` is Sunday) for ``date``."""
+    return (date.weekday() + 1) % 7
+
+
+def next_occurrence(days: Optional[List[int]], date: Optional[datetime.date] = None) -> datetime.date:
+    """Return the first date from ``date`` (default: today) falling on one of ``days``."""
+    date = date or datetime.date.today()
+    while days and cron_weekday(date) not in days:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+@dataclass(frozen=True)
+class Window:
+    """A single weekly piece of a schedule.
+
+    ``start``/``end`` are minutes of the week (Sunday 00:00 is ``0``) and
+    ``offset`` is the number of days between the occurrence date and the
+    day this piece falls on, which is ``1`` for the tail of an overnight
+    window.
+    """
+
+    start: int
+    end: int
+    offset: int
+    priority: int
+    first: Optional[datetime.date]
+    last: Optional[datetime.date]
+    schedule: dict
+
+    def valid_on(self, date: datetime.date) -> bool:
+        occurrence = date - datetime.timedelta(days=self.offset)
+        if self.first is not None and occurrence < self.first:
+            return False
+        if self.last is not None and occurrence > self.last:
+            return False
+        return True
+
+
+def schedule_bounds(schedule: dict) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+    """Return the first and last occurrence dates of ``schedule``.
+
+    One-off schedules created before the ``date`` field existed are treated
+    as daily windows, which is how they have always been reported.
+    """
+    if not schedule.get("repeat"):
+        if schedule.get("date"):
+            date = datetime.date.fromisoformat(schedule["date"])
+            return date, date
+        return None, None
+    end_repeat = schedule.get("end_repeat")
+    return None, datetime.date.fromisoformat(end_repeat) if end_repeat else None
+
+
+def schedule_windows(schedule: dict, priority: int = 0) -> Iterator[Window]:
+    """Yield the weekly pieces covered by ``schedule``.
+
+    Windows whose end is earlier than their start run overnight into the
+    following day.  A window with identical start and end covers nothing.
+    """
+    start = parse_hhmm(schedule["start"])
+    end = parse_hhmm(schedule["end"])
+    if start == end:
+        return
+    first, last = schedule_bounds(schedule)
+    if first is not None and first == last:
+        days = (cron_weekday(first),)
+    else:
+        days = tuple(sorted(set(schedule.get("days") or ALL_DAYS)))
+    for day in days:
+        base = day * MINUTES_PER_DAY
+        if end > start:
+            yield Window(base + start, base + end, 0, priority, first, last, schedule)
+            continue
+        yield Window(base + start, base + MINUTES_PER_DAY, 0, priority, first, last, schedule)
+        tail = (base + MINUTES_PER_DAY) % MINUTES_PER_WEEK
+        yield Window(tail, tail + end, 1, priority, first, last, schedule)
+
+
+def occurrences(
+    schedule: dict, start: datetime.datetime, end: datetime.datetime
+) -> Iterator[Tuple[datetime.datetime, datetime.datetime]]:
+    """Yield ``(on, off)`` for every occurrence of ``schedule`` overlapping ``[start, end)``."""
+    begin = parse_hhmm(schedule["start"])
+    finish = parse_hhmm(schedule["end"])
+    if begin == finish:
+        return
+    first, last = schedule_bounds(schedule)
+    one_off = first is not None and first == last
+    days = set(schedule.get("days") or ALL_DAYS)
+    length = datetime.timedelta(minutes=(finish - begin) % MINUTES_PER_DAY)
+    date = start.date() - datetime.timedelta(days=1)
+    if first is not None and date < first:
+        date = first
+    while date <= end.date() and (last is None or date <= last):
+        if one_off or cron_weekday(date) in days:
+            on = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(minutes=begin)
+            off = on + length
+            if off > start and on < end:
+                yield on, off
+        date += datetime.timedelta(days=1)
+
+
+class _Segments:
+    """The week cut at every window boundary, listing the windows covering each piece."""
+
+    def __init__(self, windows: List[Window]) -> None:
+        points = {0}
+        for window in windows:
+            points.add(window.start)
+            points.add(window.end)
+        points.discard(MINUTES_PER_WEEK)
+        self._bounds: List[int] = sorted(points)
+        self._covers: List[List[Window]] = [[] for _ in self._bounds]
+        for window in windows:
+            first = bisect.bisect_left(self._bounds, window.start)
+            last = bisect.bisect_left(self._bounds, window.end)
+            for segment in range(first, last):
+                self._covers[segment].append(window)
+
+    def find(self, minute: int, date: datetime.date) -> Optional[Window]:
+        """Return the first window covering ``minute`` that is valid on ``date``."""
+        segment = bisect.bisect_right(self._bounds, minute) - 1
+        for window in self._covers[segment]:
+            if window.valid_on(date):
+                return window
+        return None
+
+
+class SensorTimeline:
+    """Elementary-segment index over the weekly windows of one sensor.
+
+    The week is cut at every window boundary; each segment stores the
+    windows covering it in schedule order, so a lookup is a single bisect
+    followed by a validity check of the (usually one) covering window.
+    Dated one-off windows are kept apart, in segments per calendar day,
+    so they do not pile up in the weekly segments of their weekday.
+    """
+
+    def __init__(self, schedules: List[dict]) -> None:
+        weekly: List[Window] = []
+        dated: Dict[datetime.date, List[Window]] = {}
+        for priority, schedule in enumerate(schedules):
+            for window in schedule_windows(schedule, priority):
+                if window.first is not None and window.first == window.last:
+                    day = window.first + datetime.timedelta(days=window.offset)
+                    dated.setdefault(day, []).append(window)
+                else:
+                    weekly.append(window)
+        self._weekly = _Segments(weekly)
+        self._dated = {day: _Segments(windows) for day, windows in dated.items()}
+
+    def lookup(self, when: datetime.datetime) -> Optional[dict]:
+        """Return the schedule governing the sensor at ``when``, if any."""
+        date = when.date()
+        minute = cron_weekday(date) * MINUTES_PER_DAY + when.hour * 60 + when.minute
+        found = self._weekly.find(minute, date)
+        dated = self._dated.get(date)
+        if dated is not None:
+            window = dated.find(minute, date)
+            if window is not None and (found is None or window.priority < found.priority):
+                found = window
+        return found.schedule if found is not None else None
+
+
+class Timeline:
+    """Lazily rebuilt :class:`SensorTimeline` for every sensor.
+
+    ``schedules`` is the live mapping owned by the schedule manager; callers
+    must :meth:`invalidate` a sensor after mutating its schedule list.
+    """
+
+    def __init__(self, schedules: Dict[str, List[dict]]) -> None:
+        self._schedules = schedules
+        self._index: Dict[str, SensorTimeline] = {}
+
+    def invalidate(self, sensor: Optional[str] = None) -> None:
+        if sensor is None:
+            self._index.clear()
+        else:
+            self._index.pop(sensor, None)
+
+    def sensor(self, sensor: str) -> SensorTimeline:
+        index = self._index.get(sensor)
+        if index is None:
+            index = SensorTimeline(self._schedules.get(sensor, []))
+            self._index[sensor] = index
+        return index
+
+    def state_at(self, sensor: str, when: datetime.datetime) -> Optional[dict]:
+        """Return the schedule active for ``sensor`` at ``when``, if any."""
+        return self.sensor(sensor).lookup(when)
@@ -1,14 +1,27 @@
+// Local copy of the schedules and sensor states, kept current by /events.
+const model = {
+    schedules: {},
+    overrides: {},
+    states: {},
+};
+
 async function executeCommand(command, args = []) {
-    await fetch('/execute', {
+    const response = await fetch('/execute', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ command, args }),
     });
+    if (!response.ok) {
+        const error = await response.json().catch(() => ({ detail: response.statusText }));
+        alert(error.detail);
+        return null;
+    }
+    return response.text();
 }
 
-function addSchedule(event) {
+async function addSchedule(event) {
     event.preventDefault();
     const form = event.target;
     const sensor = form.sensor.value;
@@ -19,58 +32,117 @@ function addSchedule(event) {
     const days = Array.from(form.days.selectedOptions).map(option => option.value).join(',');
     const endRepeat = form.endRepeat.value;
     const args = [sensor, start, end, state, repeat, days, endRepeat];
-    executeCommand('add', args);
-    viewSchedules();
+    await executeCommand('add', args);
 }
 
-function removeSchedule(event) {
+async function removeSchedule(event) {
     event.preventDefault();
     const form = event.target;
     const sensor = form.sensor.value;
     const index = form.index.value;
-    executeCommand('remove', [sensor, index]);
-    viewSchedules();
+    await executeCommand('remove', [sensor, index]);
 }
 
-function overrideSensor(event) {
+async function overrideSensor(event) {
     event.preventDefault();
     const form = event.target;
     const sensor = form.sensor.value;
     const state = form.state.value;
-    executeCommand('override', [sensor, state]);
-    viewSchedules();
-    viewStates();
+    await executeCommand('override', [sensor, state]);
 }
 
-function removeOverride(event) {
+async function removeOverride(event) {
     event.preventDefault();
     const sensor = event.target.sensor.value;
-    executeCommand('remove_override', [sensor]);
-    viewSchedules();
-    viewStates();
+    await executeCommand('remove_override', [sensor]);
+}
+
+function renderSchedules() {
+    const lines = [];
+    for (const [sensor, schedules] of Object.entries(model.schedules)) {
+        const override = model.overrides[sensor];
+        lines.push(`${sensor}${override ? ` (OVERRIDE: ${override})` : ''} Schedules:`);
+        for (const schedule of schedules) {
+            const repeat = schedule.repeat ? 'True' : 'False';
+            lines.push(`${schedule.id}: Start: ${schedule.start}, End: ${schedule.end}, Repeat: ${repeat}`);
+        }
+        lines.push('');
+    }
+    document.getElementById('result').textContent = lines.join('\n');
+}
+
+function renderStates() {
+    const lines = Object.entries(model.states).map(([sensor, { state, source }]) => {
+        if (source === 'override') {
+            return `${sensor}: ${state} (OVERRIDE)`;
+        }
+        if (source === 'scheduled') {
+            return `${sensor}: ${state} (SCHEDULED)`;
+        }
+        return `${sensor}: off`;
+    });
+    document.getElementById('current').textContent = lines.join('\n');
+}
+
+function applyOp(op) {
+    const schedules = model.schedules;
+    if (op.op === 'add') {
+        (schedules[op.sensor] = schedules[op.sensor] || []).push(op.schedule);
+    } else if (op.op === 'remove') {
+        schedules[op.sensor] = (schedules[op.sensor] || []).filter(schedule => schedule.id !== op.id);
+    } else if (op.op === 'override') {
+        model.overrides[op.sensor] = op.state;
+    } else if (op.op === 'replace') {
+        model.schedules = op.schedules;
+        model.overrides = op.overrides;
+    }
 }
 
 function viewSchedules() {
-    fetch('/view_schedules')
-        .then(response => response.text())
-        .then(text => {
-            document.getElementById('result').textContent = text;
+    fetch('/api/schedules')
+        .then(response => response.json())
+        .then(document => {
+            model.schedules = document.schedules;
+            model.overrides = document.overrides;
+            renderSchedules();
         });
 }
 
 function viewStates() {
-    fetch('/view_states')
-        .then(response => response.text())
-        .then(text => {
-            document.getElementById('current').textContent = text;
+    fetch('/api/states')
+        .then(response => response.json())
+        .then(document => {
+            model.states = document.states;
+            renderStates();
         });
 }
 
-setInterval(viewStates, 2000);
+function subscribe() {
+    const events = new EventSource('/events');
+    events.addEventListener('schedules', event => {
+        const document = JSON.parse(event.data);
+        model.schedules = document.schedules;
+        model.overrides = document.overrides;
+        renderSchedules();
+    });
+    events.addEventListener('ops', event => {
+        JSON.parse(event.data).ops.forEach(applyOp);
+        renderSchedules();
+    });
+    events.addEventListener('states', event => {
+        Object.assign(model.states, JSON.parse(event.data));
+        renderStates();
+    });
+}
 
 document.addEventListener('DOMContentLoaded', function () {
-    viewSchedules();
-    viewStates();
+    if (window.EventSource) {
+        subscribe();
+    } else {
+        viewSchedules();
+        viewStates();
+        setInterval(viewStates, 2000);
+    }
 
     document.getElementById('uploadForm').onsubmit = async function (event) {
         event.preventDefault();
@@ -78,30 +150,30 @@ document.addEventListener('DOMContentLoaded', function () {
         const fileInput = document.getElementById('jsonFile');
         const file = fileInput.files[0];
 
-        if (!file || file.type !== 'application/json') {
-            alert('Please select a valid JSON file.');
+        if (!file || !/\.jsonl?$/.test(file.name)) {
+            alert('Please select a .json or .jsonl schedule file.');
             return;
         }
 
-        try {
-            const text = await file.text();
-            JSON.parse(text);
-
-            const formData = new FormData();
-            formData.append('file', file);
-
-            const response = await fetch('/upload_schedule', {
-                method: 'POST',
-                body: formData,
-            });
-
-            if (response.ok) {
-                alert('File uploaded successfully!');
-            } else {
-                alert('Failed to upload the file.');
-            }
-        } catch (error) {
-            alert('The file is not a valid JSON.');
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await fetch('/upload_schedule', {
+            method: 'POST',
+            body: formData,
+        });
+        const result = await response.json().catch(() => ({ detail: response.statusText }));
+
+        if (response.ok) {
+            alert(`Imported ${result.accepted} schedules.`);
+        } else if (result.detail && result.detail.entries) {
+            const errors = result.detail.entries
+                .filter(entry => entry.error)
+                .slice(0, 10)
+                .map(entry => `#${entry.entry} ${entry.sensor ?? ''}: ${entry.error}`);
+            alert(`Nothing imported, ${result.detail.rejected} entries rejected:\n${errors.join('\n')}`);
+        } else {
+            alert(`Failed to upload the file: ${result.detail}`);
         }
     };
 });
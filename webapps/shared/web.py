@@ -0,0 +1,143 @@
+"""HTTP helpers shared by the client and admin applications."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .services.command_queue import CommandQueue
+from .services.metrics import REQUEST_SECONDS, current_trace, registry, span
+from .services.schedule_manager import ScheduleManager, ScheduleSnapshot, cache_path, storage_path
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Return whether ``If-None-Match`` lists ``etag`` (or ``*``)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def cached_response(request: Request, body: bytes, etag: str, media_type: str) -> Response:
+    """Return ``body`` with a strong ``etag``, or ``304`` if the client already has it.
+
+    ``Cache-Control: no-cache`` lets clients keep the body but makes them
+    revalidate on every poll, which costs a bodiless ``304`` while nothing
+    has changed.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+class CachedFile:
+    """A static file read once and served from memory with a content ETag."""
+
+    def __init__(self, path: Path, media_type: str) -> None:
+        self.path = path
+        self.media_type = media_type
+        self._body: Optional[bytes] = None
+        self._etag = ""
+
+    def response(self, request: Request) -> Response:
+        if self._body is None:
+            self._body = self.path.read_bytes()
+            self._etag = f'"{hashlib.sha1(self._body).hexdigest()}"'
+        return cached_response(request, self._body, self._etag, self.media_type)
+
+
+class RequestMetrics:
+    """ASGI middleware timing every request by route, and tracing it if enabled.
+
+    The time recorded is until the response starts, so long-lived streams
+    such as ``/events`` are not counted for their whole lifetime.  A client
+    may pass ``X-Request-ID`` to choose the trace id; the id used is
+    returned in ``X-Trace-ID`` when tracing is enabled.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status: int) -> None:
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            )
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                trace = current_trace()
+                if trace:
+                    MutableHeaders(scope=message).append("X-Trace-ID", trace)
+                record(message["status"])
+            await send(message)
+
+        request_id = Headers(scope=scope).get("x-request-id")
+        try:
+            with span(f"{scope['method']} {scope['path']}", trace=request_id):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            if not recorded:
+                record(500)
+
+
+def metrics_response() -> Response:
+    """Return the current metrics in the Prometheus text format."""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ----------------------------------------------------------------------
+# Startup
+
+
+def fast_start() -> bool:
+    return os.getenv("SCHEDULER_FAST_START") == "1"
+
+
+def open_writer() -> CommandQueue:
+    """Return the command queue serving an application's schedules.
+
+    With ``SCHEDULER_FAST_START=1`` and a startup cache matching the store,
+    requests are answered from the cache, and the manager is only created
+    (and the execution backend reconciled) once startup is over.  Without
+    a usable cache the manager is created now, and the cache is written
+    for the next start.
+    """
+    if not fast_start():
+        return CommandQueue(ScheduleManager())
+    cache = cache_path()
+    snapshot = ScheduleSnapshot.load(cache, storage_path())
+    if snapshot is None:
+        return CommandQueue(ScheduleManager(), cache=cache)
+    return CommandQueue(ScheduleManager, snapshot=snapshot, cache=cache, on_open=ScheduleManager.reconcile)
+
+
+async def start_writer(writer: CommandQueue) -> None:
+    """Start ``writer`` and reconcile the execution backend, unless that waits for the manager."""
+    await writer.start()
+    if writer.opened:
+        await writer.run(writer.manager.reconcile)